@@ -0,0 +1,116 @@
+"""Benchmark ingesting into, reloading and searching a document store.
+
+Builds a `common.documents.DocumentStore` of synthetic documents (words drawn
+from a Zipf-distributed vocabulary, like natural text), in batches, and
+reports:
+
+- ingestion throughput (chunks per second),
+- how long it takes to reopen the store from disk (eg. on restart),
+- search latency percentiles for queries of a few words, over the segments
+  as ingested, and once merged into one.
+
+Run from the repository root with any copilot's environment activated:
+
+    python benchmarks/bench_documents.py --chunks 100000
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from common.documents import DocumentStore
+
+
+def vocabulary(size: int) -> list[str]:
+    return [f"term{i}" for i in range(size)]
+
+
+def words(rng: random.Random, terms: list[str], weights: list[float], n: int) -> str:
+    return " ".join(rng.choices(terms, cum_weights=weights, k=n))
+
+
+def bench_searches(
+    store: DocumentStore, queries: list[str], label: str
+) -> dict[str, float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    percentiles = {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+    }
+    print(
+        f"search ({label}): "
+        + ", ".join(
+            f"{name} {value * 1000:.2f}ms" for name, value in percentiles.items()
+        )
+    )
+    return percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    terms = vocabulary(args.vocabulary)
+    weights = []
+    total = 0.0
+    for rank in range(1, len(terms) + 1):
+        total += 1 / rank
+        weights.append(total)
+    queries = [
+        words(rng, terms, weights, rng.randint(2, 6)) for _ in range(args.queries)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # One chunk per document, without overlap, so chunks are counted exactly.
+        store = DocumentStore(
+            directory,
+            chunk_words=args.chunk_words,
+            overlap_words=0,
+            max_segments=args.batches,
+        )
+        per_batch = args.chunks // args.batches
+        start = time.perf_counter()
+        for batch in range(args.batches):
+            store.add(
+                {
+                    f"document{batch}-{i}.txt": words(
+                        rng, terms, weights, args.chunk_words
+                    )
+                    for i in range(per_batch)
+                }
+            )
+        elapsed = time.perf_counter() - start
+        stats = store.stats()
+        print(
+            f"ingested {stats['chunks']:,} chunks in {stats['segments']} segments: "
+            f"{elapsed:.1f}s ({stats['chunks'] / elapsed:,.0f} chunks/s)"
+        )
+
+        start = time.perf_counter()
+        store = DocumentStore(directory)
+        print(f"reload: {(time.perf_counter() - start) * 1000:.1f}ms")
+        bench_searches(store, queries, f"{stats['segments']} segments")
+
+        start = time.perf_counter()
+        store.merge()
+        print(f"merge: {time.perf_counter() - start:.1f}s")
+        bench_searches(store, queries, "1 segment")
+
+
+if __name__ == "__main__":
+    main()
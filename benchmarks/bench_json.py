@@ -0,0 +1,120 @@
+"""Benchmark JSON encoding and decoding throughput.
+
+Compares the standard library against `common.serialization` (which uses
+orjson when it's installed) for:
+
+- decoding each of the `test_payloads` fixtures (and validating them as an
+  `AgentQueryRequest`),
+- encoding a stream of `copilotMessageChunk` SSE data payloads,
+- encoding a `copilotFunctionCall` SSE event.
+
+Run from the repository root with any copilot's environment activated:
+
+    python benchmarks/bench_json.py
+"""
+
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+from common import serialization
+from common.models import AgentQueryRequest, FunctionCallSSE, FunctionCallSSEData
+
+TEST_PAYLOADS = Path(__file__).parent.parent / "test_payloads"
+
+
+def _report(name: str, seconds: float, number: int, size: int | None = None):
+    ops = number / seconds
+    throughput = f"{ops * size / 1e6:>8.1f} MB/s" if size else ""
+    print(f"  {name:<32} {ops:>12,.0f} ops/s {throughput}")
+
+
+def bench_decode(number: int):
+    print(f"Decoding test payloads ({serialization.BACKEND=})")
+    for path in sorted(TEST_PAYLOADS.glob("*.json")):
+        data = path.read_bytes()
+        print(f"{path.name} ({len(data)} bytes)")
+        _report(
+            "json.loads",
+            timeit.timeit(lambda: json.loads(data), number=number),
+            number,
+            len(data),
+        )
+        _report(
+            "serialization.loads",
+            timeit.timeit(lambda: serialization.loads(data), number=number),
+            number,
+            len(data),
+        )
+        _report(
+            "json.loads + model_validate",
+            timeit.timeit(
+                lambda: AgentQueryRequest.model_validate(json.loads(data)),
+                number=number,
+            ),
+            number,
+            len(data),
+        )
+        _report(
+            "model_validate_json",
+            timeit.timeit(
+                lambda: AgentQueryRequest.model_validate_json(data), number=number
+            ),
+            number,
+            len(data),
+        )
+
+
+def bench_encode(number: int):
+    print(f"Encoding SSE events ({serialization.BACKEND=})")
+    chunks = [f" token{i}" for i in range(100)]
+    print("copilotMessageChunk x 100")
+    _report(
+        "json.dumps",
+        timeit.timeit(
+            lambda: [json.dumps({"delta": chunk}) for chunk in chunks], number=number
+        ),
+        number,
+    )
+    _report(
+        "serialization.dumps",
+        timeit.timeit(
+            lambda: [serialization.dumps({"delta": chunk}) for chunk in chunks],
+            number=number,
+        ),
+        number,
+    )
+
+    sse = FunctionCallSSE(
+        data=FunctionCallSSEData(
+            function="get_widget_data",
+            input_arguments={"widget_uuid": "ff6368ec-a397-4baf-9f5a-fecd9fd797a3"},
+        )
+    )
+    print("copilotFunctionCall")
+    _report(
+        "json.dumps(model_dump())",
+        timeit.timeit(
+            lambda: json.dumps(sse.data.model_dump(exclude_none=True)),
+            number=number * 100,
+        ),
+        number * 100,
+    )
+    _report(
+        "BaseSSE.model_dump",
+        timeit.timeit(sse.model_dump, number=number * 100),
+        number * 100,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    bench_decode(args.number)
+    bench_encode(args.number)
+
+
+if __name__ == "__main__":
+    main()
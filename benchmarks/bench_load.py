@@ -0,0 +1,305 @@
+"""Load test the copilots against a deterministic stub LLM.
+
+Starts `stub_llm.py` and each copilot app (with `uvicorn`) as subprocesses,
+with the copilot pointed at the stub, then replays the `test_payloads`
+fixtures, plus a generated large conversation, at a fixed concurrency. For
+each copilot, reports throughput, time-to-first-token (TTFT, ie. the first
+SSE event) and end-to-end latency percentiles, and the overhead the copilot
+adds to the stub's TTFT.
+
+Since the stub is deterministic, results are comparable between runs: save
+them with `--output` and compare a later run against them with `--baseline`,
+which exits non-zero if any percentile regresses beyond `--tolerance`.
+
+Run from the repository root with the copilots' dependencies installed:
+
+    python benchmarks/bench_load.py --copilot mistral --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).parent.parent
+TEST_PAYLOADS = ROOT / "test_payloads"
+
+# The copilot's directory and app, and the environment pointing it at the stub.
+COPILOTS = {
+    "example": (
+        "example-copilot",
+        "example_copilot.main:app",
+        lambda stub_url: {
+            "OPENAI_BASE_URL": f"{stub_url}/v1",
+            "OPENAI_API_KEY": "stub",
+        },
+    ),
+    "mistral": (
+        "mistral-copilot",
+        "mistral_copilot.main:app",
+        lambda stub_url: {
+            "MISTRAL_BASE_URL": f"{stub_url}/v1",
+            "MISTRAL_API_KEY": "stub",
+        },
+    ),
+    "llama": (
+        "llama31-local-copilot",
+        "llama_copilot.main:app",
+        lambda stub_url: {
+            "COPILOT_BACKENDS": stub_url,
+            # The stub, unlike Ollama, serves requests concurrently.
+            "COPILOT_ADMISSION_MAX_CONCURRENCY": "1024",
+        },
+    ),
+}
+
+
+def large_payload(turns: int, context_items: int, item_bytes: int) -> dict:
+    """A long conversation with a lot of context."""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "human", "content": f"What is {i} + {i}?"})
+        messages.append({"role": "ai", "content": f"{i} + {i} = {2 * i}."})
+    messages.append({"role": "human", "content": "Summarise our conversation."})
+    context = [
+        {
+            "uuid": f"00000000-0000-0000-0000-{i:012d}",
+            "name": f"context_{i}",
+            "description": f"Context item {i}",
+            "data": {"content": "x" * item_bytes},
+        }
+        for i in range(context_items)
+    ]
+    return {"messages": messages, "context": context}
+
+
+def load_payloads(args) -> dict[str, dict]:
+    payloads = {
+        path.stem: json.loads(path.read_text())
+        for path in sorted(TEST_PAYLOADS.glob("*.json"))
+    }
+    if args.large_turns:
+        payloads["large"] = large_payload(
+            args.large_turns, args.large_context_items, args.large_item_bytes
+        )
+    return payloads
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def _serve(command: list[str], cwd: Path, env: dict[str, str], url: str):
+    process = subprocess.Popen(command, cwd=cwd, env=os.environ | env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(url, timeout=1)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{' '.join(command)} failed to start")
+                time.sleep(0.1)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def percentile(values: list[float], p: float) -> float:
+    """The nearest-rank `p`th percentile of `values`."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+@dataclass
+class Result:
+    copilot: str
+    requests: int = 0
+    errors: int = 0
+    duration: float = 0.0
+    ttfts: list[float] = field(default_factory=list)
+    latencies: list[float] = field(default_factory=list)
+
+    def summary(self, stub_ttft: float) -> dict[str, float]:
+        summary = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput": self.requests / self.duration if self.duration else 0.0,
+        }
+        for name, values in (("ttft", self.ttfts), ("latency", self.latencies)):
+            for p in (50, 95, 99):
+                summary[f"{name}_p{p}"] = percentile(values, p)
+        summary["overhead_p50"] = summary["ttft_p50"] - stub_ttft
+        return summary
+
+
+async def _request(client: httpx.AsyncClient, url: str, payload: dict, result: Result):
+    start = time.monotonic()
+    ttft = None
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            if response.status_code != 200:
+                result.errors += 1
+                return
+            async for line in response.aiter_lines():
+                if ttft is None and line.startswith("data:"):
+                    ttft = time.monotonic() - start
+    except httpx.HTTPError:
+        result.errors += 1
+        return
+    result.requests += 1
+    result.ttfts.append(ttft if ttft is not None else math.nan)
+    result.latencies.append(time.monotonic() - start)
+
+
+async def run_load(copilot: str, url: str, payloads: list[dict], args) -> Result:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        # Warm up connections, caches and imports before measuring.
+        warmup = Result(copilot)
+        for payload in payloads:
+            await _request(client, url, payload, warmup)
+
+        result = Result(copilot)
+        queue: asyncio.Queue[dict] = asyncio.Queue()
+        for i in range(args.requests):
+            queue.put_nowait(payloads[i % len(payloads)])
+
+        async def worker():
+            while not queue.empty():
+                await _request(client, url, queue.get_nowait(), result)
+
+        start = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        result.duration = time.monotonic() - start
+        return result
+
+
+def run_copilot(copilot: str, stub_url: str, payloads: list[dict], args) -> Result:
+    directory, app, env = COPILOTS[copilot]
+    port = _free_port()
+    command = [sys.executable, "-m", "uvicorn", app, "--port", str(port)]
+    command += ["--log-level", "warning"]
+    url = f"http://127.0.0.1:{port}"
+    with _serve(command, ROOT / directory, env(stub_url), f"{url}/copilots.json"):
+        return asyncio.run(run_load(copilot, f"{url}/v1/query", payloads, args))
+
+
+def report(summaries: dict[str, dict], baseline: dict[str, dict], tolerance: float):
+    columns = ["throughput", "ttft_p50", "ttft_p95", "ttft_p99"]
+    columns += ["latency_p50", "latency_p95", "latency_p99", "overhead_p50"]
+    width = 19 if baseline else 12
+    print(
+        f"{'copilot':<10} {'requests':>8} {'errors':>6} "
+        + " ".join(f"{column:>{width}}" for column in columns)
+    )
+    regressions = []
+    for copilot, summary in summaries.items():
+        cells = []
+        for column in columns:
+            cell = (
+                f"{summary[column]:.1f}/s"
+                if column == "throughput"
+                else f"{summary[column] * 1000:.1f}ms"
+            )
+            previous = baseline.get(copilot, {}).get(column)
+            if previous:
+                change = (summary[column] - previous) / previous
+                cell += f" ({change:+.0%})"
+                worse = -change if column == "throughput" else change
+                if column != "overhead_p50" and worse > tolerance:
+                    regressions.append(f"{copilot} {column} {change:+.0%}")
+            cells.append(f"{cell:>{width}}")
+        print(
+            f"{copilot:<10} {summary['requests']:>8} {summary['errors']:>6} "
+            + " ".join(cells)
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--copilot", choices=[*COPILOTS, "all"], default=["all"], nargs="+"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--ttft", type=float, default=0.1, help="Stub TTFT (s).")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--no-function-calls", action="store_true")
+    parser.add_argument(
+        "--slow-every", type=int, default=0, help="Make every Nth stub request slow."
+    )
+    parser.add_argument(
+        "--slow-ttft", type=float, default=1.0, help="Slow requests' TTFT (s)."
+    )
+    parser.add_argument(
+        "--quota-rps", type=float, default=0, help="Stub's rate limit (429s)."
+    )
+    parser.add_argument(
+        "--large-turns", type=int, default=100, help="0 disables the large payload."
+    )
+    parser.add_argument("--large-context-items", type=int, default=10)
+    parser.add_argument("--large-item-bytes", type=int, default=4096)
+    parser.add_argument("--output", type=Path, help="Save the results as JSON.")
+    parser.add_argument("--baseline", type=Path, help="Results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    copilots = list(COPILOTS) if "all" in args.copilot else args.copilot
+    payloads = list(load_payloads(args).values())
+
+    stub_port = _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub_command = [sys.executable, str(Path(__file__).parent / "stub_llm.py")]
+    stub_command += ["--port", str(stub_port), "--ttft", str(args.ttft)]
+    stub_command += ["--tokens-per-second", str(args.tokens_per_second)]
+    stub_command += ["--reply-tokens", str(args.reply_tokens)]
+    stub_command += ["--slow-every", str(args.slow_every)]
+    stub_command += ["--slow-ttft", str(args.slow_ttft)]
+    stub_command += ["--quota-rps", str(args.quota_rps)]
+    if args.no_function_calls:
+        stub_command.append("--no-function-calls")
+
+    summaries = {}
+    with _serve(stub_command, ROOT, {}, stub_url):
+        for copilot in copilots:
+            result = run_copilot(copilot, stub_url, payloads, args)
+            summaries[copilot] = result.summary(args.ttft)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    regressions = report(summaries, baseline.get("results", {}), args.tolerance)
+    if args.output:
+        settings = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline", "copilot")
+        }
+        args.output.write_text(
+            json.dumps({"settings": settings, "results": summaries}, indent=2)
+        )
+    if regressions:
+        print("Regressions:", ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
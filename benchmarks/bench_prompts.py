@@ -0,0 +1,104 @@
+"""Micro-benchmark of the per-request cost of building the chat prompt.
+
+Compares declaring a `@chatprompt` function on every request (and escaping
+every message so it survives formatting) against the precompiled
+`common.prompts.ChatPrompt`, which caches the rendered system message.
+
+Run from the repository root with any copilot's environment activated:
+
+    python benchmarks/bench_prompts.py
+"""
+
+import argparse
+import re
+import sys
+import timeit
+from pathlib import Path
+
+from magentic import (
+    AssistantMessage,
+    AsyncStreamedStr,
+    SystemMessage,
+    UserMessage,
+    chatprompt,
+)
+
+from common.context import build_widgets_str
+from common.models import Widget
+from common.prompts import ChatPrompt
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "mistral-copilot"))
+from mistral_copilot.prompts import SYSTEM_PROMPT  # noqa: E402
+
+
+def sanitize_message(message: str) -> str:
+    cleaned_message = re.sub(r"(?<!\{)\{(?!{)", "{{", message)
+    cleaned_message = re.sub(r"(?<!\})\}(?!})", "}}", cleaned_message)
+    return cleaned_message
+
+
+def make_request(n_messages: int, n_widgets: int) -> tuple[list[str], str, str]:
+    messages = [
+        f"Message {i}: what was the closing price on day {i}? "
+        '{"symbol": "AAPL", "period": "quarter"} ' * 5
+        for i in range(n_messages)
+    ]
+    widgets = [
+        Widget(
+            uuid=f"00000000-0000-0000-0000-{i:012d}",
+            name=f"Widget {i}",
+            description="Historical stock price for a ticker",
+            metadata={"symbol": "AAPL", "source": "Financial Modelling Prep"},
+        )
+        for i in range(n_widgets)
+    ]
+    context = "The user is interested in large-cap technology stocks. " * 50
+    return messages, build_widgets_str(widgets), context
+
+
+def build_before(messages: list[str], widgets: str, context: str):
+    chat_messages = [
+        (UserMessage if i % 2 == 0 else AssistantMessage)(sanitize_message(message))
+        for i, message in enumerate(messages)
+    ]
+
+    @chatprompt(SystemMessage(SYSTEM_PROMPT), *chat_messages)
+    async def copilot(widgets: str, context: str) -> AsyncStreamedStr: ...
+
+    return copilot.format(widgets=widgets, context=context)
+
+
+copilot_prompt = ChatPrompt(SYSTEM_PROMPT, output_types=[AsyncStreamedStr])
+
+
+def build_after(messages: list[str], widgets: str, context: str):
+    chat_messages = [
+        (UserMessage if i % 2 == 0 else AssistantMessage)(message)
+        for i, message in enumerate(messages)
+    ]
+    return copilot_prompt.messages(chat_messages, widgets=widgets, context=context)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[2, 20, 200])
+    parser.add_argument("--widgets", type=int, default=50)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for n_messages in args.messages:
+        request = make_request(n_messages, args.widgets)
+        assert [m.content for m in build_before(*request)][0] == (
+            build_after(*request)[0].content
+        )
+        before = timeit.timeit(lambda: build_before(*request), number=args.number)
+        after = timeit.timeit(lambda: build_after(*request), number=args.number)
+        print(
+            f"{n_messages:>8} {before / args.number * 1e6:>12.1f} "
+            f"{after / args.number * 1e6:>12.1f} {before / after:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Measure how quickly each copilot starts up.
+
+For each copilot, reports:
+
+- `import`: the time to import its app module (the median of `--runs` fresh
+  interpreters),
+- `ready`: the time from launching `uvicorn` to the first successful
+  `GET /copilots.json` (ie. when the copilot can pass a health check),
+- `first_query`: the time from launching `uvicorn` to the end of the first
+  `/v1/query` response, sent as soon as the copilot is ready (or `--delay`
+  seconds later), which includes any backend modules still to be imported.
+
+Queries are answered by the deterministic stub LLM in `stub_llm.py`. As with
+`bench_load.py`, save the results with `--output` and compare a later run
+against them with `--baseline`, which exits non-zero if any figure regresses
+beyond `--tolerance`.
+
+Run from the repository root with the copilots' dependencies installed:
+
+    python benchmarks/bench_startup.py --copilot llama
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_load import COPILOTS, ROOT, TEST_PAYLOADS, _free_port, _serve
+
+COLUMNS = ["import", "ready", "first_query"]
+
+
+def import_time(copilot: str, env: dict[str, str], runs: int) -> float:
+    directory, app, _ = COPILOTS[copilot]
+    module = app.split(":")[0]
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT / directory,
+            env=os.environ | env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def startup_time(
+    copilot: str, env: dict[str, str], payload: dict, delay: float
+) -> tuple[float, float]:
+    """The times from launch until the copilot is ready, and has served a query."""
+    directory, app, _ = COPILOTS[copilot]
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "uvicorn", app, "--port", str(port)]
+    command += ["--log-level", "warning"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT / directory, env=os.environ | env)
+    try:
+        with httpx.Client(timeout=120) as client:
+            while True:
+                try:
+                    client.get(f"{url}/copilots.json").raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{copilot} failed to start")
+                    time.sleep(0.01)
+            ready = time.perf_counter() - start
+            time.sleep(delay)
+            client.post(f"{url}/v1/query", json=payload).raise_for_status()
+            first_query = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+    return ready, first_query
+
+
+def report(summaries: dict[str, dict], baseline: dict[str, dict], tolerance: float):
+    width = 19 if baseline else 12
+    print(f"{'copilot':<10} " + " ".join(f"{column:>{width}}" for column in COLUMNS))
+    regressions = []
+    for copilot, summary in summaries.items():
+        cells = []
+        for column in COLUMNS:
+            cell = f"{summary[column] * 1000:.0f}ms"
+            previous = baseline.get(copilot, {}).get(column)
+            if previous:
+                change = (summary[column] - previous) / previous
+                cell += f" ({change:+.0%})"
+                if change > tolerance:
+                    regressions.append(f"{copilot} {column} {change:+.0%}")
+            cells.append(f"{cell:>{width}}")
+        print(f"{copilot:<10} " + " ".join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--copilot", choices=[*COPILOTS, "all"], default=["all"], nargs="+"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Runs to take medians of.")
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="Wait before the first query (s)."
+    )
+    parser.add_argument("--no-warmup", action="store_true")
+    parser.add_argument("--output", type=Path, help="Save the results as JSON.")
+    parser.add_argument("--baseline", type=Path, help="Results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    copilots = list(COPILOTS) if "all" in args.copilot else args.copilot
+    payload = json.loads((TEST_PAYLOADS / "single_message.json").read_text())
+
+    stub_port = _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub_command = [sys.executable, str(Path(__file__).parent / "stub_llm.py")]
+    stub_command += ["--port", str(stub_port), "--ttft", "0", "--reply-tokens", "1"]
+
+    summaries = {}
+    with _serve(stub_command, ROOT, {}, stub_url):
+        for copilot in copilots:
+            env = COPILOTS[copilot][2](stub_url)
+            if args.no_warmup:
+                env["COPILOT_WARMUP"] = "false"
+            startups = [
+                startup_time(copilot, env, payload, args.delay)
+                for _ in range(args.runs)
+            ]
+            summaries[copilot] = {
+                "import": import_time(copilot, env, args.runs),
+                "ready": statistics.median(ready for ready, _ in startups),
+                "first_query": statistics.median(first for _, first in startups),
+            }
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    regressions = report(summaries, baseline.get("results", {}), args.tolerance)
+    if args.output:
+        settings = {
+            "runs": args.runs,
+            "delay": args.delay,
+            "warmup": not args.no_warmup,
+        }
+        args.output.write_text(
+            json.dumps({"settings": settings, "results": summaries}, indent=2)
+        )
+    if regressions:
+        print("Regressions:", ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
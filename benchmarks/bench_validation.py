@@ -0,0 +1,149 @@
+"""Benchmark validating `/v1/query` requests with long conversations.
+
+Compares validating synthetic 100 and 1000 message payloads (a mix of human
+and AI messages, function calls and their results):
+
+- as before: an undiscriminated `LlmFunctionCallResult | LlmMessage` union,
+  decoded with `json.loads` and then validated (as a FastAPI body parameter
+  does),
+- as now: `AgentQueryRequest` (whose messages are discriminated by role),
+  validated straight from JSON by `common.validation.query_request_adapter`,
+
+both on their own and through a FastAPI app (in process, without a server).
+
+Run from the repository root with any copilot's environment activated:
+
+    python benchmarks/bench_validation.py
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import timeit
+
+import httpx
+from fastapi import Depends, FastAPI
+from pydantic import BaseModel, Field
+
+from common.models import (
+    AgentQueryRequest,
+    LlmFunctionCallResult,
+    LlmMessage,
+    RawContext,
+    Widget,
+)
+from common.validation import parse_query_request, query_request_adapter
+
+
+class LegacyAgentQueryRequest(BaseModel):
+    """`AgentQueryRequest`, as it was before its messages were discriminated."""
+
+    messages: list[LlmFunctionCallResult | LlmMessage]
+    context: str | list[RawContext] | None = None
+    use_docs: bool = None
+    widgets: list[Widget] = Field(default=None)
+
+
+def payload(messages: int) -> bytes:
+    """A conversation of `messages` messages, fetching a widget every turn."""
+    conversation = []
+    for i in range(messages // 4):
+        widget_uuid = f"ff6368ec-a397-4baf-9f5a-{i:012d}"
+        function_call = {
+            "function": "get_widget_data",
+            "input_arguments": {"widget_uuid": widget_uuid},
+        }
+        conversation += [
+            {"role": "human", "content": f"What's the latest value of widget {i}?"},
+            {"role": "ai", "content": json.dumps(function_call)},
+            {"role": "tool", **function_call, "content": f"Value: {i}. " * 20},
+            {"role": "ai", "content": f"The latest value of widget {i} is {i}."},
+        ]
+    return json.dumps({"messages": conversation}).encode()
+
+
+def _report(name: str, seconds: float, baseline: float):
+    print(f"  {name:<36} {seconds * 1e3:>8.3f} ms  {baseline / seconds:>5.2f}x")
+
+
+def _best(function, number: int, repeat: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def bench_validation(data: bytes, number: int, repeat: int):
+    baseline = _best(
+        lambda: LegacyAgentQueryRequest.model_validate(json.loads(data)),
+        number,
+        repeat,
+    )
+    _report("before: json.loads + model_validate", baseline, baseline)
+    _report(
+        "after: json.loads + model_validate",
+        _best(
+            lambda: AgentQueryRequest.model_validate(json.loads(data)), number, repeat
+        ),
+        baseline,
+    )
+    _report(
+        "after: TypeAdapter.validate_json",
+        _best(lambda: query_request_adapter.validate_json(data), number, repeat),
+        baseline,
+    )
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/before")
+    async def before(request: LegacyAgentQueryRequest):
+        return len(request.messages)
+
+    @app.post("/after")
+    async def after(request: AgentQueryRequest = Depends(parse_query_request)):
+        return len(request.messages)
+
+    return app
+
+
+async def _bench_endpoint(
+    client: httpx.AsyncClient, path: str, data: bytes, number: int, repeat: int
+) -> float:
+    headers = {"content-type": "application/json"}
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            response = await client.post(path, content=data, headers=headers)
+            assert response.status_code == 200, response.text
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+async def bench_endpoints(data: bytes, number: int, repeat: int):
+    transport = httpx.ASGITransport(app=_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+        baseline = await _bench_endpoint(client, "/before", data, number, repeat)
+        after = await _bench_endpoint(client, "/after", data, number, repeat)
+    _report("before: FastAPI body parameter", baseline, baseline)
+    _report("after: parse_query_request", after, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--number", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for messages in args.messages:
+        data = payload(messages)
+        # Keep the total number of messages validated roughly constant.
+        number = max(args.number // messages, 1)
+        print(f"{messages} messages ({len(data):,} bytes)")
+        bench_validation(data, number, args.repeat)
+        asyncio.run(bench_endpoints(data, number, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
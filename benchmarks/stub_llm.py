@@ -0,0 +1,214 @@
+"""A deterministic stub LLM server, for benchmarking the copilots offline.
+
+The stub speaks just enough of the OpenAI (and Mistral) chat completions API
+and Ollama's chat API for the copilots' clients, streaming a fixed reply at a
+configurable time-to-first-token and token rate. If function calls are
+enabled, requests that offer tools (and whose last message isn't a tool
+result) are answered with a call to the first tool instead. With
+`--slow-every N`, every Nth request waits `--slow-ttft` seconds for its first
+token instead, to reproduce a backend's tail latency. With `--quota-rps`,
+requests beyond that many in any second are rejected with a `429`, like a
+provider's rate limit.
+
+    python benchmarks/stub_llm.py --port 8901 --ttft 0.2 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+UUID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+)
+
+
+@dataclass
+class StubSettings:
+    ttft: float = 0.1
+    tokens_per_second: float = 100.0
+    reply_tokens: int = 64
+    function_calls: bool = True
+    slow_every: int = 0
+    slow_ttft: float = 1.0
+    quota_rps: float = 0
+    requests: int = field(default=0, init=False)
+    accepted: deque = field(default_factory=deque, init=False)
+
+    def tokens(self) -> list[str]:
+        return [f"token{i} " for i in range(self.reply_tokens)]
+
+    def over_quota(self) -> bool:
+        """Whether a request now would exceed `quota_rps` in the last second."""
+        if not self.quota_rps:
+            return False
+        now = time.monotonic()
+        while self.accepted and self.accepted[0] <= now - 1:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.quota_rps:
+            return True
+        self.accepted.append(now)
+        return False
+
+    def next_ttft(self) -> float:
+        """The TTFT of the next request: every `slow_every`th one is slow."""
+        self.requests += 1
+        if self.slow_every and self.requests % self.slow_every == 0:
+            return self.slow_ttft
+        return self.ttft
+
+    async def paced(self, tokens: list[str]) -> AsyncIterator[str]:
+        """Yield `tokens` at the configured TTFT and token rate."""
+        ttft = self.next_ttft()
+        start = time.monotonic()
+        for i, token in enumerate(tokens):
+            delay = start + ttft + i / self.tokens_per_second - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield token
+
+
+def _function_call(body: dict) -> tuple[str, str] | None:
+    """The (name, arguments) of the tool call to reply with, if any."""
+    tools = body.get("tools")
+    messages = body.get("messages", [])
+    if not tools or not messages or messages[-1].get("role") == "tool":
+        return None
+    function = tools[0]["function"]
+    # Fill in the required arguments with the UUIDs in the conversation (ie.
+    # the widgets'), which is what the copilots' functions take.
+    uuids = list(dict.fromkeys(UUID_PATTERN.findall(json.dumps(messages))))
+    uuids = uuids or ["00000000-0000-0000-0000-000000000000"]
+    parameters = function.get("parameters", {})
+    arguments = {
+        name: uuids
+        if parameters["properties"][name].get("type") == "array"
+        else uuids[0]
+        for name in parameters.get("required", [])
+    }
+    return function["name"], json.dumps(arguments)
+
+
+def _openai_chunk(model: str, delta: dict, finish_reason: str | None = None) -> str:
+    chunk = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def create_app(settings: StubSettings) -> Starlette:
+    async def health(request: Request):
+        return PlainTextResponse("Stub LLM is running")
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if settings.over_quota():
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+                status_code=429,
+            )
+        model = body.get("model", "stub")
+        function_call = _function_call(body) if settings.function_calls else None
+
+        async def stream():
+            if function_call is not None:
+                name, arguments = function_call
+                # Stream the arguments in a few fragments, like real APIs do.
+                fragments = [
+                    arguments[i : i + 16] for i in range(0, len(arguments), 16)
+                ]
+                first = True
+                async for fragment in settings.paced(fragments):
+                    tool_call = {"index": 0, "function": {"arguments": fragment}}
+                    if first:
+                        first = False
+                        tool_call |= {"id": "call_stub", "type": "function"}
+                        tool_call["function"]["name"] = name
+                    yield _openai_chunk(
+                        model, {"role": "assistant", "tool_calls": [tool_call]}
+                    )
+                yield _openai_chunk(model, {}, finish_reason="tool_calls")
+            else:
+                async for token in settings.paced(settings.tokens()):
+                    yield _openai_chunk(model, {"role": "assistant", "content": token})
+                yield _openai_chunk(model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+
+        async def stream():
+            async for token in settings.paced(settings.tokens()):
+                message = {"role": "assistant", "content": token}
+                yield json.dumps({"model": model, "message": message, "done": False})
+                yield "\n"
+            yield json.dumps(
+                {
+                    "model": model,
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": 1,
+                    "eval_count": settings.reply_tokens,
+                }
+            )
+            yield "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return Starlette(
+        routes=[
+            Route("/", health),
+            Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+            Route("/chat/completions", chat_completions, methods=["POST"]),
+            Route("/api/chat", ollama_chat, methods=["POST"]),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--ttft", type=float, default=0.1, help="Seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--no-function-calls", action="store_true")
+    parser.add_argument("--slow-every", type=int, default=0)
+    parser.add_argument("--slow-ttft", type=float, default=1.0, help="Seconds.")
+    parser.add_argument("--quota-rps", type=float, default=0)
+    args = parser.parse_args()
+
+    settings = StubSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        function_calls=not args.no_function_calls,
+        slow_every=args.slow_every,
+        slow_ttft=args.slow_ttft,
+        quota_rps=args.quota_rps,
+    )
+    uvicorn.run(
+        create_app(settings), host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
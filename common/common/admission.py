@@ -0,0 +1,180 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator
+
+from fastapi import HTTPException
+
+
+@dataclass
+class Ticket:
+    """An admitted request, holding one of the controller's concurrency slots."""
+
+    controller: "AdmissionController"
+    queue_position: int = 0
+    wait_time: float = 0.0
+    admitted_at: float = field(default_factory=time.monotonic)
+    released: bool = False
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """Response headers reporting how long the request was queued."""
+        return {
+            "X-Queue-Position": str(self.queue_position),
+            "X-Queue-Wait-Time": f"{self.wait_time:.3f}",
+        }
+
+    def release(self) -> None:
+        """Release the slot. This is idempotent."""
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    async def arelease(self) -> None:
+        """Release the slot, from a (Starlette) background task."""
+        self.release()
+
+
+class AdmissionController:
+    """Limits the number of concurrent LLM calls, with a bounded wait queue.
+
+    Up to `max_concurrency` requests are admitted at once, and up to
+    `max_queue` more wait (in FIFO order) for a slot to free up. Requests that
+    arrive while the queue is full are rejected immediately with a `429`, and
+    requests that wait longer than `max_wait` seconds are rejected with a
+    `503`. Both carry a `Retry-After` header estimated from recent request
+    durations.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        max_queue: int = 16,
+        max_wait: float = 60.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_time = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+        # An exponentially-weighted moving average of how long requests hold
+        # a slot, used to estimate `Retry-After`.
+        self._average_duration = 1.0
+
+    @classmethod
+    def from_env(
+        cls, prefix: str = "COPILOT_ADMISSION", **defaults: int | float
+    ) -> "AdmissionController":
+        """Read the settings from `<prefix>_MAX_CONCURRENCY`, `_MAX_QUEUE` and `_MAX_WAIT`."""
+        settings = {
+            "max_concurrency": int(
+                os.environ.get(
+                    f"{prefix}_MAX_CONCURRENCY", defaults.get("max_concurrency", 1)
+                )
+            ),
+            "max_queue": int(
+                os.environ.get(f"{prefix}_MAX_QUEUE", defaults.get("max_queue", 16))
+            ),
+            "max_wait": float(
+                os.environ.get(f"{prefix}_MAX_WAIT", defaults.get("max_wait", 60.0))
+            ),
+        }
+        return cls(**settings)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_time_seconds": self.total_wait_time,
+        }
+
+    def retry_after(self) -> int:
+        """Estimate how many seconds until a new request could be served."""
+        backlog = (self.queued + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * self._average_duration))
+
+    def _reject(self, status_code: int, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def acquire(self) -> Ticket:
+        """Wait for a slot, or raise an `HTTPException` if the request is rejected."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return Ticket(controller=self)
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise self._reject(429, "Too many requests are queued. Try again later.")
+
+        queue_position = len(self._waiters) + 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we gave up, so pass it on.
+                self.in_flight -= 1
+                self._wake_next()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise self._reject(503, "Timed out waiting for the model to be free.")
+
+        wait_time = time.monotonic() - start
+        self.admitted += 1
+        self.total_wait_time += wait_time
+        return Ticket(
+            controller=self, queue_position=queue_position, wait_time=wait_time
+        )
+
+    def _release(self, ticket: Ticket) -> None:
+        duration = time.monotonic() - ticket.admitted_at
+        self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+        self.in_flight -= 1
+        self._wake_next()
+
+    def _wake_next(self) -> None:
+        while self._waiters and self.in_flight < self.max_concurrency:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot is handed directly to the waiter.
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @staticmethod
+    async def hold(ticket: Ticket, events: AsyncIterable[dict]) -> AsyncIterator[dict]:
+        """Stream events, releasing the ticket's slot once the stream ends.
+
+        If the client disconnects the stream may be abandoned without being
+        closed, so responses should also release the ticket in a background
+        task, which runs once the response is finished either way.
+        """
+        try:
+            async for event in events:
+                yield event
+        finally:
+            ticket.release()
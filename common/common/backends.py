@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator
+
+import httpx
+
+from .clients import chat_models
+from .disconnect import ClientDisconnected
+
+
+@dataclass
+class Backend:
+    """An upstream LLM endpoint, and its health and latency statistics."""
+
+    url: str
+    healthy: bool = True
+    outstanding: int = 0
+    requests: int = 0
+    completed: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    # Exponentially-weighted moving averages, in seconds.
+    time_to_first_token: float = 0.0
+    latency: float = 0.0
+
+    def stats(self) -> dict[str, str | bool | int | float]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "completed": self.completed,
+            "failures": self.failures,
+            "time_to_first_token_seconds": self.time_to_first_token,
+            "latency_seconds": self.latency,
+        }
+
+
+def _ewma(average: float, value: float, count: int, alpha: float = 0.2) -> float:
+    return value if count <= 1 else (1 - alpha) * average + alpha * value
+
+
+@dataclass
+class Lease:
+    """A request routed to a backend, counted as outstanding until released."""
+
+    pool: "BackendPool"
+    backend: Backend
+    started_at: float = field(default_factory=time.monotonic)
+    first_token_at: float | None = None
+    released: bool = False
+
+    def first_token(self) -> None:
+        """Record that the backend has started responding."""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def release(self, failed: bool = False) -> None:
+        """Release the lease, recording the request's outcome. This is idempotent."""
+        if not self.released:
+            self.released = True
+            self.pool._release(self, failed)
+
+    async def arelease(self) -> None:
+        """Release the lease, from a (Starlette) background task."""
+        self.release()
+
+
+class BackendPool:
+    """Routes requests across a pool of equivalent LLM endpoints.
+
+    Each request goes to the healthy backend with the fewest outstanding
+    requests (ties are broken by lower latency, then round-robin). A backend
+    is ejected from the pool after `max_failures` consecutive failed requests
+    or a failed health check, and re-admitted once a health check succeeds.
+    If every backend is unhealthy, requests are routed across all of them
+    rather than failing outright.
+
+    Health checks `GET` each backend's `health_path` every
+    `health_check_interval` seconds while `watch` is running.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        health_path: str = "/",
+        health_check_interval: float = 10.0,
+        health_check_timeout: float = 2.0,
+        max_failures: int = 3,
+        client: httpx.AsyncClient | None = None,
+    ):
+        if not urls:
+            raise ValueError("A backend pool needs at least one backend.")
+        self.backends = [Backend(url=url.rstrip("/")) for url in urls]
+        self.health_path = health_path
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.max_failures = max_failures
+        self._client = client
+        self._offsets = itertools.count()
+
+    @classmethod
+    def from_env(
+        cls, default_url: str, prefix: str = "COPILOT_BACKENDS"
+    ) -> "BackendPool":
+        """Create a pool of the comma-separated URLs in `<prefix>`, or `default_url`.
+
+        Health checks are configured by `<prefix>_HEALTH_PATH`,
+        `<prefix>_HEALTH_CHECK_INTERVAL` (`0` disables them) and
+        `<prefix>_MAX_FAILURES`.
+        """
+        urls = [
+            url.strip()
+            for url in os.environ.get(prefix, default_url).split(",")
+            if url.strip()
+        ]
+        return cls(
+            urls,
+            health_path=os.environ.get(f"{prefix}_HEALTH_PATH", "/"),
+            health_check_interval=float(
+                os.environ.get(f"{prefix}_HEALTH_CHECK_INTERVAL", 10.0)
+            ),
+            max_failures=int(os.environ.get(f"{prefix}_MAX_FAILURES", 3)),
+        )
+
+    def stats(self) -> list[dict[str, str | bool | int | float]]:
+        return [backend.stats() for backend in self.backends]
+
+    def select(self) -> Backend:
+        """Pick the backend the next request should be routed to."""
+        candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            candidates = self.backends
+        # Rotate the candidates so that ties are spread round-robin.
+        offset = next(self._offsets) % len(candidates)
+        candidates = candidates[offset:] + candidates[:offset]
+        return min(
+            candidates, key=lambda backend: (backend.outstanding, backend.latency)
+        )
+
+    def lease(self) -> Lease:
+        """Route a request, counting it against the backend until released."""
+        backend = self.select()
+        backend.outstanding += 1
+        backend.requests += 1
+        return Lease(pool=self, backend=backend)
+
+    def _release(self, lease: Lease, failed: bool) -> None:
+        backend = lease.backend
+        backend.outstanding -= 1
+        if failed:
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures:
+                backend.healthy = False
+            return
+
+        backend.consecutive_failures = 0
+        backend.completed += 1
+        now = time.monotonic()
+        if lease.first_token_at is not None:
+            backend.time_to_first_token = _ewma(
+                backend.time_to_first_token,
+                lease.first_token_at - lease.started_at,
+                backend.completed,
+            )
+        backend.latency = _ewma(
+            backend.latency, now - lease.started_at, backend.completed
+        )
+
+    async def check(self, backend: Backend) -> bool:
+        """Health check a backend, ejecting or re-admitting it as appropriate."""
+        client = self._client or chat_models.http_client
+        try:
+            response = await client.get(
+                backend.url + self.health_path, timeout=self.health_check_timeout
+            )
+            healthy = response.is_success
+        except httpx.HTTPError:
+            healthy = False
+        backend.healthy = healthy
+        if healthy:
+            backend.consecutive_failures = 0
+        return healthy
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    @asynccontextmanager
+    async def watch(self) -> AsyncIterator[None]:
+        """Health check the backends periodically for the duration of the context."""
+        if self.health_check_interval <= 0:
+            yield
+            return
+
+        async def _poll():
+            while True:
+                await self.check_all()
+                await asyncio.sleep(self.health_check_interval)
+
+        task = asyncio.create_task(_poll())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    @staticmethod
+    async def hold(lease: Lease, events: AsyncIterable[dict]) -> AsyncIterator[dict]:
+        """Stream events, releasing the lease once the stream ends.
+
+        A stream that raises part-way through counts as a failed request (unless
+        the client disconnected).
+        """
+        try:
+            async for event in events:
+                yield event
+        except ClientDisconnected:
+            raise
+        except Exception:
+            lease.release(failed=True)
+            raise
+        finally:
+            lease.release()
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Sequence
+
+from pydantic import BaseModel
+
+from .serialization import dumpb
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(
+    *,
+    model: str,
+    system_prompt: str,
+    messages: Sequence[BaseModel],
+    context: str = "",
+    widgets: str = "",
+    **settings: Any,
+) -> str:
+    """Compute a canonical key identifying a request.
+
+    Requests with the same key send the same prompt to the same model (with
+    the same settings), ignoring whitespace around message content.
+    """
+    normalized_messages = [
+        message.model_dump(mode="json", exclude_none=True) for message in messages
+    ]
+    for message in normalized_messages:
+        if isinstance(message.get("content"), str):
+            message["content"] = message["content"].strip()
+
+    digest = hashlib.blake2b(digest_size=32)
+    for part in (
+        model,
+        sorted(settings.items()),
+        system_prompt,
+        normalized_messages,
+        context,
+        widgets,
+    ):
+        data = dumpb(part)
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    """A completed response, stored as the SSE events that were streamed."""
+
+    events: list[dict] = field(default_factory=list)
+    expires_at: float = 0.0
+    size: int = 0
+
+
+class ResponseCache:
+    """An exact-match cache of copilot responses.
+
+    Responses are keyed by a canonical hash of everything that determines the
+    completion (the model, its settings, the system prompt, the conversation,
+    context and widgets), and evicted least-recently-used first once either
+    `max_entries` or `max_bytes` is exceeded. Entries expire after `ttl`
+    seconds.
+
+    Completions are only deterministic at low temperatures, so requests with a
+    temperature above `max_temperature` (or no temperature at all, meaning the
+    provider's default) bypass the cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        max_temperature: float = 0.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._size = 0
+
+    @classmethod
+    def from_env(cls, temperature: float | None = None) -> "ResponseCache | None":
+        """Create a cache if `COPILOT_RESPONSE_CACHE` is enabled, else `None`.
+
+        `temperature` is the copilot's own. Requests above `0.0` are only
+        cached if `COPILOT_RESPONSE_CACHE_MAX_TEMPERATURE` is raised to it, so
+        a warning is logged if they never will be.
+        """
+        if os.environ.get("COPILOT_RESPONSE_CACHE", "false").lower() != "true":
+            return None
+        cache = cls(
+            max_entries=int(os.environ.get("COPILOT_RESPONSE_CACHE_MAX_ENTRIES", 1024)),
+            max_bytes=int(
+                os.environ.get("COPILOT_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+            ),
+            ttl=float(os.environ.get("COPILOT_RESPONSE_CACHE_TTL", 3600.0)),
+            max_temperature=float(
+                os.environ.get("COPILOT_RESPONSE_CACHE_MAX_TEMPERATURE", 0.0)
+            ),
+        )
+        if temperature is None or temperature > cache.max_temperature:
+            logger.warning(
+                "The response cache is enabled, but requests at temperature %s "
+                "are never cached (COPILOT_RESPONSE_CACHE_MAX_TEMPERATURE=%s).",
+                temperature,
+                cache.max_temperature,
+            )
+        return cache
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """The total size (in bytes) of the cached responses."""
+        return self._size
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+    def is_cacheable(self, temperature: float | None) -> bool:
+        """Whether a request with the given temperature may use the cache."""
+        if temperature is None or temperature > self.max_temperature:
+            self.bypasses += 1
+            return False
+        return True
+
+    def get(self, key: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, events: list[dict]) -> None:
+        entry = CachedResponse(
+            events=events,
+            expires_at=time.monotonic() + self.ttl,
+            size=sum(len(event["data"]) for event in events),
+        )
+        if entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._size += entry.size
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+    async def record(
+        self, key: str, events: AsyncIterable[dict]
+    ) -> AsyncIterator[dict]:
+        """Pass SSE events through, caching them once the stream completes.
+
+        Streams that fail or are abandoned part-way through are not cached.
+        """
+        recorded = []
+        async for event in events:
+            recorded.append(event)
+            yield event
+        self.put(key, recorded)
+
+    @staticmethod
+    async def replay(response: CachedResponse) -> AsyncIterator[dict]:
+        """Replay a cached response as a stream of SSE events."""
+        for event in response.events:
+            yield dict(event)
@@ -0,0 +1,297 @@
+import asyncio
+import importlib
+import logging
+import os
+from contextlib import asynccontextmanager, suppress
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+import httpx
+
+if TYPE_CHECKING:
+    from magentic import OpenaiChatModel
+    from magentic.chat_model.base import ChatModel
+    from magentic.chat_model.litellm_chat_model import LitellmChatModel
+    from magentic.chat_model.mistral_chat_model import MistralChatModel
+    from magentic.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# The modules each kind of chat model needs, which are imported on first use
+# (LiteLLM, in particular, takes seconds to import).
+BACKEND_MODULES = {
+    "openai": ("openai", "magentic"),
+    "mistral": ("openai", "magentic.chat_model.mistral_chat_model"),
+    "litellm": ("litellm", "magentic.chat_model.litellm_chat_model"),
+}
+
+
+def _warn_unpooled(chat_model: Any) -> None:
+    logger.warning(
+        "Couldn't share the connection pool with %s, which will use its own "
+        "client (is magentic a supported version?).",
+        type(chat_model).__name__,
+    )
+
+
+class ChatModelRegistry:
+    """A process-wide registry of chat model clients.
+
+    Chat models are constructed once per unique configuration and reused across
+    requests, and every client shares a single pooled `httpx.AsyncClient`, so
+    keep-alive connections to the upstream LLM are reused between user turns
+    instead of paying for a new TCP/TLS handshake on every query.
+
+    The registry should be closed with `aclose` when the application shuts down
+    (eg. from the FastAPI lifespan).
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 600.0,
+        connect_timeout: float = 10.0,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._http_client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._models: dict[tuple, Any] = {}
+        self._litellm_initialized = False
+        self._settings: "Settings | None" = None
+        self.warmed: set[str] = set()
+
+    @classmethod
+    def from_env(cls) -> "ChatModelRegistry":
+        """Create a registry with pool limits read from the environment."""
+        return cls(
+            max_connections=int(os.environ.get("COPILOT_HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(
+                os.environ.get("COPILOT_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+            ),
+            keepalive_expiry=float(
+                os.environ.get("COPILOT_HTTP_KEEPALIVE_EXPIRY", 30.0)
+            ),
+            timeout=float(os.environ.get("COPILOT_HTTP_TIMEOUT", 600.0)),
+        )
+
+    def _bind_to_running_loop(self) -> None:
+        # Pooled connections are tied to the event loop that opened them. If
+        # we're now running on a different loop (eg. a new test client) the
+        # old pool can't be reused, so we start afresh.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._loop is not loop:
+            self._loop = loop
+            self._http_client = None
+            self._models.clear()
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """The shared, pooled HTTP client used by all chat models."""
+        self._bind_to_running_loop()
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout
+            )
+            self._models.clear()
+        return self._http_client
+
+    def _pooled_openai_client(
+        self, api_key: str | None, base_url: str | None, max_retries: int | None = None
+    ):
+        import openai
+
+        options = {} if max_retries is None else {"max_retries": max_retries}
+        return openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, http_client=self.http_client, **options
+        )
+
+    def _use_pooled_client(
+        self, chat_model: "OpenaiChatModel", max_retries: int | None = None
+    ) -> None:
+        # magentic creates a fresh `AsyncOpenAI` client (and connection pool)
+        # for every model instance, so we swap it for one backed by the shared
+        # HTTP client. The attribute is private (magentic is pinned to 0.32.x),
+        # so if it's gone, the model keeps its own client.
+        if not hasattr(chat_model, "_async_client"):
+            _warn_unpooled(chat_model)
+            return
+        chat_model._async_client = self._pooled_openai_client(
+            chat_model.api_key, chat_model.base_url, max_retries
+        )
+
+    def get_openai(self, model: str, **kwargs: Any) -> "OpenaiChatModel":
+        """Get a (cached) OpenAI chat model that uses the shared connection pool."""
+        self._bind_to_running_loop()
+        key = ("openai", model, tuple(sorted(kwargs.items())))
+        if key not in self._models:
+            from magentic import OpenaiChatModel
+
+            chat_model = OpenaiChatModel(model, **kwargs)
+            if chat_model.api_type == "openai":
+                self._use_pooled_client(chat_model)
+            self._models[key] = chat_model
+        return self._models[key]
+
+    def get_mistral(
+        self, model: str, max_retries: int | None = None, **kwargs: Any
+    ) -> "MistralChatModel":
+        """Get a (cached) Mistral chat model that uses the shared connection pool.
+
+        `max_retries` overrides the number of times the openai client retries
+        failed requests itself (eg. to leave retries to a `RetryPolicy`).
+        """
+        self._bind_to_running_loop()
+        key = ("mistral", model, max_retries, tuple(sorted(kwargs.items())))
+        if key not in self._models:
+            from magentic.chat_model.mistral_chat_model import MistralChatModel
+
+            chat_model = MistralChatModel(model, **kwargs)
+            # Mistral is served through magentic's OpenAI-compatible model.
+            openai_chat_model = getattr(chat_model, "_mistral_openai_chat_model", None)
+            if openai_chat_model is None:
+                _warn_unpooled(chat_model)
+            else:
+                self._use_pooled_client(openai_chat_model, max_retries)
+            self._models[key] = chat_model
+        return self._models[key]
+
+    def _init_litellm(self) -> Any:
+        """Import LiteLLM, configuring it (once) for the copilots."""
+        if not self._litellm_initialized:
+            # LiteLLM otherwise downloads its model cost map on import, which
+            # we don't use and which stalls startup without internet access.
+            os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+        import litellm
+
+        if not self._litellm_initialized:
+            # LiteLLM's aiohttp transport keeps reading a stream that's been
+            # cancelled (eg. when the client disconnects), so the model keeps
+            # generating; httpx closes the connection instead.
+            litellm.disable_aiohttp_transport = True
+            self._litellm_initialized = True
+        return litellm
+
+    def _import(self, module: str) -> None:
+        if module == "litellm":
+            self._init_litellm()
+        else:
+            importlib.import_module(module)
+
+    def get_litellm(self, model: str, **kwargs: Any) -> "LitellmChatModel":
+        """Get a (cached) LiteLLM chat model that uses the shared connection pool."""
+        self._bind_to_running_loop()
+        key = ("litellm", model, tuple(sorted(kwargs.items())))
+        if key not in self._models:
+            litellm = self._init_litellm()
+            from magentic.chat_model.litellm_chat_model import LitellmChatModel
+
+            # LiteLLM picks up a module-level session for the providers that
+            # support it, and keeps its own cached handlers for the rest.
+            litellm.aclient_session = self.http_client
+            self._models[key] = LitellmChatModel(model, **kwargs)
+        return self._models[key]
+
+    def get_configured(self) -> "ChatModel":
+        """Get the chat model configured by magentic's `MAGENTIC_*` settings.
+
+        Like magentic's own default model (`MAGENTIC_BACKEND`, and eg.
+        `MAGENTIC_OPENAI_MODEL`), but from the registry, so that it uses the
+        shared connection pool. Backends the registry doesn't support are
+        left to magentic. The settings are read once, as reading them parses
+        the environment (and `.env`) again.
+        """
+        from magentic.settings import Backend, get_settings
+
+        if self._settings is None:
+            self._settings = get_settings()
+        settings = self._settings
+        match settings.backend:
+            case Backend.OPENAI:
+                return self.get_openai(
+                    settings.openai_model,
+                    api_key=settings.openai_api_key,
+                    api_type=settings.openai_api_type,
+                    base_url=settings.openai_base_url,
+                    max_tokens=settings.openai_max_tokens,
+                    seed=settings.openai_seed,
+                    temperature=settings.openai_temperature,
+                )
+            case Backend.MISTRAL:
+                return self.get_mistral(
+                    settings.mistral_model,
+                    api_key=settings.mistral_api_key,
+                    base_url=settings.mistral_base_url,
+                    max_tokens=settings.mistral_max_tokens,
+                    seed=settings.mistral_seed,
+                    temperature=settings.mistral_temperature,
+                )
+            case Backend.LITELLM:
+                return self.get_litellm(
+                    settings.litellm_model,
+                    api_base=settings.litellm_api_base,
+                    max_tokens=settings.litellm_max_tokens,
+                    temperature=settings.litellm_temperature,
+                )
+        key = ("configured", settings.backend)
+        if key not in self._models:
+            from magentic.backend import get_chat_model
+
+            self._models[key] = get_chat_model()
+        return self._models[key]
+
+    @asynccontextmanager
+    async def warmup(self, *backends: str) -> AsyncIterator[None]:
+        """Import the backends' modules in the background, within the context.
+
+        Entered from the app's lifespan, this lets the server start (and answer
+        health checks) straight away, rather than paying for the imports on
+        startup or on the first query. The imports start `COPILOT_WARMUP_DELAY`
+        seconds (1 by default) after startup, once the server is accepting
+        connections, and are disabled if `COPILOT_WARMUP` is `false`.
+        """
+        if os.environ.get("COPILOT_WARMUP", "true").lower() != "true":
+            yield
+            return
+        delay = float(os.environ.get("COPILOT_WARMUP_DELAY", 1))
+
+        async def _warmup():
+            # Importing holds the GIL, so would slow the server's own startup.
+            await asyncio.sleep(delay)
+            for backend in backends:
+                for module in BACKEND_MODULES.get(backend, ()):
+                    try:
+                        # In a thread, so the event loop keeps serving requests.
+                        await asyncio.to_thread(self._import, module)
+                    except ImportError as error:
+                        logger.warning("Couldn't warm up %s: %s", backend, error)
+                        break
+                else:
+                    self.warmed.add(backend)
+
+        task = asyncio.create_task(_warmup())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client and drop all cached chat models."""
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+        self._loop = None
+        self._models.clear()
+
+
+chat_models = ChatModelRegistry.from_env()
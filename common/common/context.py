@@ -0,0 +1,181 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from .models import DataContent, RawContext, Widget
+
+if TYPE_CHECKING:
+    from .tabular import TableCompaction
+
+# A rough, model-agnostic estimate that's good enough for budgeting prompts.
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = "... [truncated {count} characters]"
+CONTEXT_SEPARATOR = "\n\n"
+
+
+@dataclass
+class ContextBudget:
+    """A size budget for the context or widgets included in a prompt.
+
+    Sizes are measured in characters. Use `from_tokens` (or `from_env`) to
+    specify the budget in tokens, which are converted using `CHARS_PER_TOKEN`.
+    A limit of `None` means unlimited.
+    """
+
+    max_chars: int | None = None
+    max_item_chars: int | None = None
+
+    @classmethod
+    def from_tokens(
+        cls, max_tokens: int | None, max_item_tokens: int | None = None
+    ) -> "ContextBudget":
+        return cls(
+            max_chars=max_tokens * CHARS_PER_TOKEN if max_tokens else None,
+            max_item_chars=(
+                max_item_tokens * CHARS_PER_TOKEN if max_item_tokens else None
+            ),
+        )
+
+    @classmethod
+    def from_env(
+        cls,
+        prefix: str,
+        default_max_tokens: int | None = None,
+        default_max_item_tokens: int | None = None,
+    ) -> "ContextBudget":
+        """Read the budget from `<prefix>_MAX_TOKENS` and `<prefix>_MAX_ITEM_TOKENS`."""
+        max_tokens = os.environ.get(f"{prefix}_MAX_TOKENS", default_max_tokens)
+        max_item_tokens = os.environ.get(
+            f"{prefix}_MAX_ITEM_TOKENS", default_max_item_tokens
+        )
+        return cls.from_tokens(
+            int(max_tokens) if max_tokens else None,
+            int(max_item_tokens) if max_item_tokens else None,
+        )
+
+
+def _allocate(sizes: list[int], budget: int) -> list[int]:
+    """Split a budget between items, giving smaller items priority.
+
+    Items are visited from smallest to largest and each is given up to an
+    equal share of the remaining budget, so small items are kept whole and
+    the large items are truncated to fit whatever remains.
+    """
+    limits = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=sizes.__getitem__)
+    for i, idx in enumerate(order):
+        limits[idx] = min(sizes[idx], remaining // (len(sizes) - i))
+        remaining -= limits[idx]
+    return limits
+
+
+def _with_content(context: RawContext, content: str) -> str:
+    return context.model_copy(
+        update={"data": DataContent(content=content)}
+    ).model_dump_json()
+
+
+def _truncate_context(context: RawContext, limit: int) -> str | None:
+    """Truncate the item's data content so that it serializes within `limit`.
+
+    Returns `None` if even the item without any content doesn't fit.
+    """
+    content = context.data.content
+    if not isinstance(content, str):
+        content = json.dumps(content, separators=(",", ":"), default=str)
+    # The content is escaped when serialized (structured content, in
+    # particular, is full of quotes), so the truncated item is measured
+    # rather than estimated. Each character kept serializes to at least one,
+    # so dropping the excess fits within a step or two.
+    keep = max(limit - len(_with_content(context, "")) - len(TRUNCATION_MARKER), 0)
+    while True:
+        truncated = _with_content(
+            context,
+            content[:keep] + TRUNCATION_MARKER.format(count=len(content) - keep),
+        )
+        excess = len(truncated) - limit
+        if excess <= 0:
+            return truncated
+        if keep == 0:
+            return None
+        keep = max(keep - excess, 0)
+
+
+def build_context_str(
+    context: str | list[RawContext] | None,
+    budget: ContextBudget | None = None,
+    compaction: "TableCompaction | None" = None,
+) -> str:
+    """Serialize the request context into a single string for the prompt.
+
+    Each context item is serialized once. If the result exceeds the budget,
+    the data content of the largest items is truncated so the total fits
+    (items too small to truncate are left out).
+    With a `compaction`, large tables are summarized before budgeting.
+    """
+    if not context:
+        return ""
+    budget = budget or ContextBudget()
+    if compaction is not None:
+        context = (
+            compaction.compact(context)
+            if isinstance(context, str)
+            else compaction.compact_context(context)
+        )
+    if isinstance(context, str):
+        if budget.max_chars is not None and len(context) > budget.max_chars:
+            return context[: budget.max_chars] + TRUNCATION_MARKER.format(
+                count=len(context) - budget.max_chars
+            )
+        return context
+
+    serialized = [item.model_dump_json() for item in context]
+    limits = [min(len(text), budget.max_item_chars or len(text)) for text in serialized]
+    if budget.max_chars is not None:
+        # The items are joined by blank lines, which count too.
+        available = max(
+            budget.max_chars - len(CONTEXT_SEPARATOR) * (len(limits) - 1), 0
+        )
+        if sum(limits) > available:
+            limits = _allocate(limits, available)
+
+    parts = (
+        text if len(text) <= limit else _truncate_context(item, limit)
+        for item, text, limit in zip(context, serialized, limits)
+    )
+    return CONTEXT_SEPARATOR.join(part for part in parts if part is not None)
+
+
+def build_widgets_str(
+    widgets: list[Widget] | None, budget: ContextBudget | None = None
+) -> str:
+    """Serialize the dashboard widgets into a single string for the prompt.
+
+    Widgets are included in order until the budget is exhausted, and the
+    remaining widgets (and any larger than the per-item limit) are omitted,
+    with a note of how many.
+    """
+    if not widgets:
+        return ""
+    budget = budget or ContextBudget()
+    parts = []
+    total = 0
+    omitted = 0
+    for i, widget in enumerate(widgets):
+        text = widget.model_dump_json()
+        if budget.max_item_chars is not None and len(text) > budget.max_item_chars:
+            # Widgets only carry a description and metadata, so there is no
+            # meaningful way to truncate them without breaking the JSON.
+            omitted += 1
+            continue
+        if budget.max_chars is not None and total + len(text) > budget.max_chars:
+            omitted += len(widgets) - i
+            break
+        parts.append(text)
+        total += len(text) + len(CONTEXT_SEPARATOR)
+    if omitted:
+        parts.append(f"({omitted} more widgets omitted)")
+    return CONTEXT_SEPARATOR.join(parts)
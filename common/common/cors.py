@@ -0,0 +1,37 @@
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+# OpenBB Terminal Pro, and local development servers.
+ORIGINS = [
+    "http://localhost",
+    "http://localhost:1420",
+    "http://localhost:5050",
+    "https://pro.openbb.dev",
+    "https://pro.openbb.co",
+]
+
+
+def add_cors(app: FastAPI) -> None:
+    """Allow OpenBB Terminal Pro to call the app from the browser."""
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+def remove_cors(app: FastAPI) -> None:
+    """Remove the CORS middleware added by `add_cors`.
+
+    For apps mounted in another app that handles CORS itself (eg. the
+    gateway), which would otherwise add the headers twice.
+    """
+    app.user_middleware = [
+        middleware
+        for middleware in app.user_middleware
+        if middleware.cls is not CORSMiddleware
+    ]
+    # The middleware stack is built on the first request; rebuild it if need be.
+    app.middleware_stack = None
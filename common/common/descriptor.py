@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import os
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+from typing import Any, AsyncIterator
+from urllib.parse import urlsplit
+
+from fastapi import Request, Response
+
+from .serialization import dumpb, loads
+
+
+class CopilotDescriptor:
+    """A `copilots.json` descriptor that is loaded once and served from memory.
+
+    The descriptor is read at startup and pre-encoded, so serving it costs no
+    disk I/O or JSON encoding. Responses carry a strong ETag, and requests
+    with a matching `If-None-Match` header are answered with a `304`.
+
+    If `reload` is enabled, `watch` polls the file for changes in the
+    background and reloads the descriptor when it's modified. `overrides` are
+    set on every copilot in the file (eg. features that depend on how the
+    copilot is configured, like `hasDocuments`).
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        cache_control: str = "public, max-age=60",
+        reload: bool | None = None,
+        reload_interval: float = 1.0,
+        overrides: dict[str, Any] | None = None,
+    ):
+        self.path = Path(path)
+        self.cache_control = cache_control
+        self.overrides = overrides or {}
+        if reload is None:
+            reload = (
+                os.environ.get("COPILOT_DESCRIPTOR_RELOAD", "false").lower() == "true"
+            )
+        self.reload = reload
+        self.reload_interval = reload_interval
+        self.load()
+
+    def load(self) -> None:
+        """(Re)load the descriptor from disk."""
+        mtime = self.path.stat().st_mtime_ns
+        with open(self.path, "rb") as f:
+            content = loads(f.read())
+        self._set(
+            {key: {**copilot, **self.overrides} for key, copilot in content.items()}
+        )
+        self._mtime = mtime
+
+    def _set(self, content: dict[str, Any]) -> None:
+        self.content = content
+        self.body = dumpb(content)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def reload_if_changed(self) -> bool:
+        """Reload the descriptor if the file has been modified since last loaded."""
+        if self.path.stat().st_mtime_ns == self._mtime:
+            return False
+        self.load()
+        return True
+
+    @asynccontextmanager
+    async def watch(self) -> AsyncIterator[None]:
+        """Watch the descriptor file for changes for the duration of the context."""
+        if not self.reload:
+            yield
+            return
+
+        async def _poll():
+            while True:
+                await asyncio.sleep(self.reload_interval)
+                # A partially-written file will fail to parse, in which case we
+                # keep serving the previous descriptor and retry on next poll.
+                with suppress(OSError, ValueError):
+                    self.reload_if_changed()
+
+        task = asyncio.create_task(_poll())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    def _matches(self, if_none_match: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        etags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+        return self.etag in etags
+
+    def response(self, request: Request) -> Response:
+        """Serve the descriptor, or a `304` if the client's copy is current."""
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self._matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=self.body, media_type="application/json", headers=headers
+        )
+
+
+class CombinedDescriptor(CopilotDescriptor):
+    """The descriptors of several copilots, mounted in one app, served as one.
+
+    Each copilot is keyed by `<name>_copilot`, and its endpoints are rewritten
+    to the copilot's prefix under `base_url`. The combined descriptor is
+    rebuilt whenever one of the copilots' descriptors is reloaded (by its own
+    app's `watch`).
+    """
+
+    def __init__(
+        self,
+        descriptors: dict[str, CopilotDescriptor],
+        base_url: str,
+        cache_control: str = "public, max-age=60",
+    ):
+        self.descriptors = descriptors
+        self.base_url = base_url.rstrip("/")
+        self.cache_control = cache_control
+        self.reload = False
+        self.load()
+
+    def _etags(self) -> list[str]:
+        return [descriptor.etag for descriptor in self.descriptors.values()]
+
+    def load(self) -> None:
+        content = {}
+        for name, descriptor in self.descriptors.items():
+            for key, copilot in descriptor.content.items():
+                key = (
+                    f"{name}_{key}"
+                    if len(descriptor.content) > 1
+                    else f"{name}_copilot"
+                )
+                endpoints = {
+                    endpoint: f"{self.base_url}/{name}{urlsplit(url).path}"
+                    for endpoint, url in copilot.get("endpoints", {}).items()
+                }
+                content[key] = {**copilot, "endpoints": endpoints}
+        self._set(content)
+        self._part_etags = self._etags()
+
+    def reload_if_changed(self) -> bool:
+        if self._etags() == self._part_etags:
+            return False
+        self.load()
+        return True
+
+    def response(self, request: Request) -> Response:
+        self.reload_if_changed()
+        return super().response(request)
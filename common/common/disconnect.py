@@ -0,0 +1,177 @@
+import asyncio
+import os
+from typing import AsyncIterable, AsyncIterator, Awaitable, TypeVar
+
+from fastapi import HTTPException, Request
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(HTTPException):
+    """The client disconnected before its response was complete."""
+
+    def __init__(self):
+        # 499 is nginx's "Client Closed Request", which nobody will receive.
+        super().__init__(status_code=499, detail="Client disconnected.")
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Wait until the client disconnects, once the request body has been read."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+class _WatchedStream:
+    """Streams chunks from upstream, until they end or the client disconnects.
+
+    The next chunk is always being fetched (in a task), so that when the
+    client disconnects, cancelling the fetch closes the upstream connection
+    even if the response isn't being sent at the time (eg. because it hasn't
+    started yet, or is waiting on a slow client).
+    """
+
+    def __init__(
+        self,
+        watcher: "DisconnectWatcher",
+        request: Request,
+        chunks: AsyncIterable[str],
+    ):
+        self._watcher = watcher
+        self._iterator = chunks.__aiter__()
+        self._next = asyncio.ensure_future(self._iterator.__anext__())
+        self._waiting = False
+        self._count = 0
+        self._done = False
+        self._cancelled = False
+        self._disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+        self._disconnect.add_done_callback(self._on_disconnect)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self._done:
+            raise ClientDisconnected() if self._cancelled else StopAsyncIteration
+        self._waiting = True
+        try:
+            # The fetch isn't awaited directly, as the response's task group
+            # would then cancel it repeatedly, interrupting the connection's
+            # cleanup. Instead, it's cancelled once if the response is.
+            await asyncio.wait({self._next})
+            chunk = self._next.result()
+        except StopAsyncIteration:
+            self._finish(cancelled=False)
+            raise
+        except asyncio.CancelledError:
+            self._next.cancel()
+            self._finish(cancelled=True)
+            raise
+        except Exception:
+            self._finish(cancelled=False, failed=True)
+            raise
+        finally:
+            self._waiting = False
+        self._count += 1
+        self._next = asyncio.ensure_future(self._iterator.__anext__())
+        return chunk
+
+    def _on_disconnect(self, disconnect: asyncio.Future) -> None:
+        # While the response is waiting on the next chunk, it's cancelled
+        # itself (which cancels the fetch), so only an idle stream is handled.
+        if disconnect.cancelled() or self._done or self._waiting:
+            return
+        if self._next.done() and not self._next.cancelled():
+            # Don't warn about an error nobody will see.
+            self._next.exception()
+        self._next.cancel()
+        self._finish(cancelled=True)
+
+    def _finish(self, cancelled: bool, failed: bool = False) -> None:
+        if self._done:
+            return
+        self._done = True
+        self._cancelled = cancelled
+        self._disconnect.cancel()
+        if not failed:
+            self._watcher._record(self._count, completed=not cancelled)
+
+
+class DisconnectWatcher:
+    """Stops upstream generation as soon as the client disconnects.
+
+    Wrap the wait for the upstream's first token with `first`, and its stream
+    of chunks with `stream`. If the client disconnects, the upstream request
+    is cancelled (closing its connection, so the model stops generating)
+    rather than left to run to completion, or until it's garbage collected.
+
+    `tokens_saved` estimates the tokens that weren't generated as a result,
+    from the average length of the responses that completed.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.cancelled = 0
+        self.cancelled_before_first_token = 0
+        self.tokens_saved = 0
+        self.completed = 0
+        self.completed_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> "DisconnectWatcher":
+        """Create a watcher, enabled unless `COPILOT_CANCEL_ON_DISCONNECT` is `false`."""
+        return cls(
+            enabled=os.environ.get("COPILOT_CANCEL_ON_DISCONNECT", "true").lower()
+            == "true"
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "cancelled": self.cancelled,
+            "cancelled_before_first_token": self.cancelled_before_first_token,
+            "tokens_saved": self.tokens_saved,
+        }
+
+    def _expected_tokens(self) -> int:
+        if not self.completed:
+            return 0
+        return round(self.completed_tokens / self.completed)
+
+    def _record(self, tokens: int, completed: bool) -> None:
+        if completed:
+            self.completed += 1
+            self.completed_tokens += tokens
+        else:
+            self.cancelled += 1
+            self.tokens_saved += max(self._expected_tokens() - tokens, 0)
+
+    async def first(self, request: Request, awaitable: Awaitable[T]) -> T:
+        """Await `awaitable`, or cancel it if the client disconnects first.
+
+        Raises `ClientDisconnected` if the client disconnected.
+        """
+        if not self.enabled:
+            return await awaitable
+        task = asyncio.ensure_future(awaitable)
+        disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+        try:
+            await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            disconnect.cancel()
+        if not task.done():
+            task.cancel()
+            self.cancelled += 1
+            self.cancelled_before_first_token += 1
+            self.tokens_saved += self._expected_tokens()
+            raise ClientDisconnected()
+        return task.result()
+
+    def stream(
+        self, request: Request, chunks: AsyncIterable[str]
+    ) -> AsyncIterable[str]:
+        """Stream `chunks`, cancelling the upstream if the client disconnects."""
+        if not self.enabled:
+            return chunks
+        return _WatchedStream(self, request, chunks)
@@ -0,0 +1,582 @@
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+from typing import TYPE_CHECKING, Sequence
+
+from fastapi import FastAPI, HTTPException, Request
+
+from .search import tokenize
+from .serialization import dumpb, loads
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# The stores opened by `DocumentStore.from_env`, by directory.
+_stores: "dict[Path, DocumentStore]" = {}
+_stores_lock = threading.Lock()
+
+
+@lru_cache(maxsize=16)
+def _words_pattern(words: int) -> re.Pattern:
+    """Matches runs of up to `words` words."""
+    return re.compile(rf"\S+(?:\s+\S+){{0,{words - 1}}}")
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap_words: int = 40) -> list[str]:
+    """Split `text` into chunks of `chunk_words` words, overlapping by `overlap_words`.
+
+    Chunks are slices of the original text, so keep its formatting.
+    """
+    step = max(chunk_words - overlap_words, 1)
+    # The text is split into runs of words that chunks start and end on, so
+    # the words themselves are found by the regex engine, not in Python.
+    run = math.gcd(chunk_words, step)
+    runs = [match.span() for match in _words_pattern(run).finditer(text)]
+    chunks = []
+    for start in range(0, len(runs), step // run):
+        end = min(start + chunk_words // run, len(runs))
+        chunks.append(text[runs[start][0] : runs[end - 1][1]])
+        if end == len(runs):
+            break
+    return chunks
+
+
+def extract_text(name: str, data: bytes) -> str:
+    """The text of a document: a PDF (read with pypdf) or plain text.
+
+    Raises a `ValueError` if a PDF can't be read.
+    """
+    if not name.lower().endswith(".pdf"):
+        return data.decode("utf-8", errors="replace")
+    if importlib.util.find_spec("pypdf") is None:
+        raise ValueError("Reading PDFs requires pypdf (`pip install pypdf`).")
+    import pypdf
+
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    except pypdf.errors.PdfReadError as error:
+        raise ValueError(f"Couldn't read {name}: {error}") from error
+
+
+@dataclass
+class DocumentChunk:
+    """A chunk of a document retrieved for a query."""
+
+    document: str
+    text: str
+    score: float
+
+
+class _Segment:
+    """An immutable, memory-mapped part of the index, written by one ingestion.
+
+    Each chunk's text, document and length, and the postings (chunks and BM25
+    weights) of each term are stored in flat arrays, which are mapped rather
+    than read, so loading a segment only reads its vocabulary.
+    """
+
+    def __init__(self, path: Path):
+        import numpy as np
+
+        self.path = path
+        with open(path / "terms.txt", encoding="utf-8") as f:
+            self.terms = {term: i for i, term in enumerate(f.read().split("\n"))}
+        self.text_offsets = np.load(path / "text_offsets.npy", mmap_mode="r")
+        self.documents = np.load(path / "documents.npy", mmap_mode="r")
+        self.lengths = np.load(path / "lengths.npy", mmap_mode="r")
+        self.postings_offsets = np.load(path / "postings_offsets.npy", mmap_mode="r")
+        self.postings_chunks = np.load(path / "postings_chunks.npy", mmap_mode="r")
+        self.postings_weights = np.load(path / "postings_weights.npy", mmap_mode="r")
+        with open(path / "text.bin", "rb") as f:
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.documents)
+
+    @classmethod
+    def write(
+        cls,
+        path: Path,
+        chunks: Sequence[tuple[int, str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "_Segment":
+        """Write the `(document id, text)` chunks to a new segment at `path`.
+
+        Each posting stores its BM25 term weight (with the segment's average
+        chunk length), so a search only has to add up the weights.
+        """
+        import numpy as np
+
+        tokens = [tokenize(text) for _, text in chunks]
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(chunks))
+        all_tokens = list(chain.from_iterable(tokens))
+        terms = {term: i for i, term in enumerate(dict.fromkeys(all_tokens))}
+        term_ids = np.fromiter(
+            map(terms.__getitem__, all_tokens), dtype=np.int64, count=len(all_tokens)
+        )
+        # Sorting (term, chunk) pairs groups the postings by term, in chunk
+        # order, and counting them gives each term's frequency in each chunk.
+        pairs, frequencies = np.unique(
+            term_ids * len(chunks) + np.repeat(np.arange(len(chunks)), lengths),
+            return_counts=True,
+        )
+        posting_terms, posting_chunks = np.divmod(pairs, len(chunks))
+        norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        weights = frequencies * (k1 + 1) / (frequencies + norms[posting_chunks])
+        texts = [text.encode() for _, text in chunks]
+
+        # Written next to the segment, then renamed, so it appears complete.
+        partial = path.with_name(path.name + ".partial")
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir(parents=True)
+        with open(partial / "text.bin", "wb") as f:
+            f.write(b"".join(texts))
+        np.save(partial / "text_offsets.npy", np.cumsum([0, *map(len, texts)]))
+        np.save(
+            partial / "documents.npy",
+            np.array([document for document, _ in chunks], dtype=np.int32),
+        )
+        np.save(partial / "lengths.npy", lengths.astype(np.int32))
+        with open(partial / "terms.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+        np.save(
+            partial / "postings_offsets.npy",
+            np.concatenate(
+                [[0], np.cumsum(np.bincount(posting_terms, minlength=len(terms)))]
+            ),
+        )
+        np.save(partial / "postings_chunks.npy", posting_chunks.astype(np.int32))
+        np.save(partial / "postings_weights.npy", weights.astype(np.float32))
+        partial.rename(path)
+        return cls(path)
+
+    def postings(self, term: str) -> "tuple[np.ndarray, np.ndarray] | None":
+        """The chunks containing `term`, and its BM25 weight in each."""
+        i = self.terms.get(term)
+        if i is None:
+            return None
+        start, end = self.postings_offsets[i], self.postings_offsets[i + 1]
+        return self.postings_chunks[start:end], self.postings_weights[start:end]
+
+    def text(self, i: int) -> str:
+        return self._text[self.text_offsets[i] : self.text_offsets[i + 1]].decode()
+
+    def chunks(self) -> list[tuple[int, str]]:
+        return [(int(self.documents[i]), self.text(i)) for i in range(self.size)]
+
+
+@dataclass
+class _Index:
+    """The segments searched, which of their chunks are live, and document names."""
+
+    segments: list[_Segment]
+    live: "list[np.ndarray | None]"
+    names: dict[int, str]
+
+
+class DocumentStore:
+    """A local store of documents, retrieved by BM25 to answer queries.
+
+    Documents are split into overlapping chunks of `chunk_words` words. Each
+    batch of documents added is indexed into a new segment on disk, whose
+    arrays are memory-mapped, so documents are added incrementally, and the
+    store reloads (eg. on restart) without re-ingesting anything. Scoring a
+    query only visits the postings of its terms, with NumPy, so it stays
+    within milliseconds at 100k chunks. Once there are more than
+    `max_segments` segments, they're merged into one.
+
+    A document added again under the same name replaces the previous version,
+    unless it's unchanged. The store is safe to read from while it's written
+    to, including by another process (eg. the CLI), whose changes are picked
+    up on the next search. There should only be one writer at a time, so
+    `from_env` returns the same store each time it's called for a directory.
+    Segments left by a writer that stopped before saving the manifest are
+    removed when the store is opened.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        top_k: int = 5,
+        chunk_words: int = 200,
+        overlap_words: int = 40,
+        max_segments: int = 16,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.directory = Path(directory)
+        self.top_k = top_k
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.max_segments = max_segments
+        self.k1 = k1
+        self.b = b
+        self.searches = 0
+        self._lock = threading.Lock()
+        self._manifest_mtime: int | None = None
+        self._index = _Index(segments=[], live=[], names={})
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.load()
+        self._remove_orphans()
+
+    @classmethod
+    def from_env(cls, prefix: str = "COPILOT_DOCUMENTS") -> "DocumentStore | None":
+        """Open the store in the `<prefix>_DIR` directory, if it's set.
+
+        The number of chunks retrieved is set by `<prefix>_TOP_K`, and their
+        size by `<prefix>_CHUNK_WORDS` and `<prefix>_OVERLAP_WORDS`.
+        """
+        directory = os.environ.get(f"{prefix}_DIR")
+        if not directory:
+            return None
+        if importlib.util.find_spec("numpy") is None:
+            logger.warning("NumPy isn't installed, so documents won't be used.")
+            return None
+        # Copilots mounted in the same process (eg. by the gateway) share the
+        # store, as there should only be one writer.
+        key = Path(directory).resolve()
+        with _stores_lock:
+            if key not in _stores:
+                _stores[key] = cls(
+                    directory,
+                    top_k=int(os.environ.get(f"{prefix}_TOP_K", 5)),
+                    chunk_words=int(os.environ.get(f"{prefix}_CHUNK_WORDS", 200)),
+                    overlap_words=int(os.environ.get(f"{prefix}_OVERLAP_WORDS", 40)),
+                )
+            return _stores[key]
+
+    def load(self) -> None:
+        """(Re)load the store from disk."""
+        path = self.directory / MANIFEST
+        if path.exists():
+            mtime = path.stat().st_mtime_ns
+            manifest = loads(path.read_bytes())
+        else:
+            mtime, manifest = None, {"segments": [], "documents": {}, "next_id": 0}
+        # Segments are immutable, so those already loaded are kept.
+        loaded = {segment.path.name: segment for segment in self._index.segments}
+        segments = [
+            loaded.get(name) or _Segment(self.directory / name)
+            for name in manifest["segments"]
+        ]
+        # Chunks of replaced or removed documents are left in their segments
+        # until they're merged, and skipped when searching.
+        ids = {document["id"] for document in manifest["documents"].values()}
+        live_masks = []
+        for segment in segments:
+            live = _isin(segment.documents, ids)
+            live_masks.append(None if live.all() else live)
+        self._manifest = manifest
+        # Searches use the index as it was when they started, so it's
+        # replaced as a whole.
+        self._index = _Index(
+            segments=segments,
+            live=live_masks,
+            names={
+                document["id"]: name for name, document in manifest["documents"].items()
+            },
+        )
+        self._manifest_mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        """Reload the store if it's been changed (eg. by another process)."""
+        path = self.directory / MANIFEST
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        try:
+            self.load()
+        except FileNotFoundError:
+            # Another process merged the segments after writing the manifest
+            # we read, so the previous index is used until the next search.
+            return False
+        return True
+
+    def _remove_orphans(self) -> None:
+        """Remove segments that aren't in the manifest, and partly written ones.
+
+        These are left by a writer that stopped before saving the manifest.
+        """
+        with self._lock:
+            segments = set(self._manifest["segments"])
+            for path in self.directory.iterdir():
+                if path.is_dir() and (
+                    path.name.endswith(".partial")
+                    or path.name.startswith("segment-")
+                    and path.name not in segments
+                ):
+                    logger.warning("Removing %s, which isn't in the manifest.", path)
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def _save(self, manifest: dict) -> None:
+        path = self.directory / MANIFEST
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(dumpb(manifest))
+        os.replace(temporary, path)
+        self.load()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "documents": len(self._manifest["documents"]),
+            "chunks": sum(
+                document["chunks"] for document in self._manifest["documents"].values()
+            ),
+            "segments": len(self._index.segments),
+            "searches": self.searches,
+        }
+
+    def documents(self) -> list[str]:
+        """The names of the documents in the store."""
+        return list(self._manifest["documents"])
+
+    def _write_segment(self, manifest: dict, chunks: list[tuple[int, str]]) -> str:
+        """Write a new segment of `chunks`, and return its name."""
+        number = manifest.get("next_segment", 0)
+        # Skips segments that were written but never added to the manifest.
+        while (self.directory / f"segment-{number:08d}").exists():
+            number += 1
+        manifest["next_segment"] = number + 1
+        name = f"segment-{number:08d}"
+        _Segment.write(self.directory / name, chunks, self.k1, self.b)
+        return name
+
+    def add(self, documents: dict[str, str]) -> int:
+        """Add (or replace) documents, given their text by name.
+
+        Unchanged documents are skipped. Returns the number of chunks added.
+        """
+        with self._lock:
+            self.reload_if_changed()
+            manifest = {
+                **self._manifest,
+                "documents": dict(self._manifest["documents"]),
+            }
+            chunks = []
+            for name, text in documents.items():
+                digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+                previous = manifest["documents"].get(name)
+                if previous is not None and previous["hash"] == digest:
+                    continue
+                document_chunks = chunk_text(text, self.chunk_words, self.overlap_words)
+                document_id = manifest["next_id"]
+                manifest["next_id"] += 1
+                manifest["documents"][name] = {
+                    "id": document_id,
+                    "hash": digest,
+                    "chunks": len(document_chunks),
+                }
+                chunks.extend((document_id, chunk) for chunk in document_chunks)
+            if chunks:
+                name = self._write_segment(manifest, chunks)
+                manifest["segments"] = [*manifest["segments"], name]
+            if manifest != self._manifest:
+                self._save(manifest)
+            if len(self._index.segments) > self.max_segments:
+                self._merge()
+            return len(chunks)
+
+    def add_file(self, name: str, data: bytes) -> int:
+        """Add (or replace) a PDF or text file. Returns the number of chunks added."""
+        return self.add({name: extract_text(name, data)})
+
+    def remove(self, name: str) -> bool:
+        """Remove a document. Returns whether it was in the store."""
+        with self._lock:
+            self.reload_if_changed()
+            if name not in self._manifest["documents"]:
+                return False
+            documents = dict(self._manifest["documents"])
+            del documents[name]
+            self._save({**self._manifest, "documents": documents})
+            return True
+
+    def merge(self) -> None:
+        """Merge every segment into one, dropping removed documents' chunks."""
+        with self._lock:
+            self.reload_if_changed()
+            self._merge()
+
+    def _merge(self) -> None:
+        old = list(self._manifest["segments"])
+        chunks = [
+            chunk
+            for segment, live in zip(self._index.segments, self._index.live)
+            for i, chunk in enumerate(segment.chunks())
+            if live is None or live[i]
+        ]
+        manifest = {**self._manifest, "segments": []}
+        if chunks:
+            manifest["segments"] = [self._write_segment(manifest, chunks)]
+        self._save(manifest)
+        for name in old:
+            # Searches in progress keep their mappings of the deleted files.
+            shutil.rmtree(self.directory / name, ignore_errors=True)
+
+    def search(self, query: str, k: int | None = None) -> list[DocumentChunk]:
+        """The `k` (or `top_k`) chunks that best match `query`, best first.
+
+        This reads from disk, so call it in a thread from async code.
+        """
+        import numpy as np
+
+        # Reloading would race with a writer, so it holds the lock, but the
+        # index is replaced as a whole, so it's searched without it.
+        with self._lock:
+            self.reload_if_changed()
+            self.searches += 1
+            index = self._index
+        k = self.top_k if k is None else k
+        segments, live_masks = index.segments, index.live
+        size = sum(segment.size for segment in segments)
+        terms = set(tokenize(query))
+        if not size or not terms or k <= 0:
+            return []
+        postings = [
+            {term: segment.postings(term) for term in terms} for segment in segments
+        ]
+        idf = {}
+        for term in terms:
+            count = sum(
+                len(segment_postings[term][0])
+                for segment_postings in postings
+                if segment_postings[term] is not None
+            )
+            idf[term] = math.log(1 + (size - count + 0.5) / (count + 0.5))
+
+        candidates = []
+        for segment, segment_postings, live in zip(segments, postings, live_masks):
+            matched = [
+                (term, term_postings)
+                for term, term_postings in segment_postings.items()
+                if term_postings is not None
+            ]
+            if not matched:
+                continue
+            chunks = np.concatenate([chunks for _, (chunks, _) in matched])
+            # Summing every term's weights in one pass is much faster than
+            # adding up each term's in turn.
+            scores = np.bincount(
+                chunks,
+                weights=np.concatenate(
+                    [idf[term] * weights for term, (_, weights) in matched]
+                ),
+                minlength=segment.size,
+            )
+            if live is not None:
+                scores[~live] = 0
+            if len(chunks) * 4 < segment.size:
+                # Selecting from mostly zeros is slow, so only the chunks
+                # that match are ranked.
+                matches = np.flatnonzero(scores)
+                if len(matches) > k:
+                    matches = matches[np.argpartition(scores[matches], -k)[-k:]]
+            elif segment.size > k:
+                matches = np.argpartition(scores, -k)[-k:]
+            else:
+                matches = np.arange(segment.size)
+            matches = matches[scores[matches] > 0]
+            candidates.extend((float(scores[i]), segment, int(i)) for i in matches)
+
+        names = index.names
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return [
+            DocumentChunk(
+                document=names[int(segment.documents[i])],
+                text=segment.text(i),
+                score=score,
+            )
+            for score, segment, i in candidates[:k]
+        ]
+
+
+def _isin(documents: "np.ndarray", ids: set[int]) -> "np.ndarray":
+    import numpy as np
+
+    return np.isin(documents, np.fromiter(ids, dtype=np.int32, count=len(ids)))
+
+
+def build_documents_str(chunks: Sequence[DocumentChunk]) -> str:
+    """Serialize retrieved chunks for the prompt, each headed by its document."""
+    return "\n\n".join(f"### {chunk.document}\n{chunk.text}" for chunk in chunks)
+
+
+def add_document_routes(app: FastAPI, store: "DocumentStore | None") -> None:
+    """Let documents be uploaded to, listed from and removed from `store`.
+
+    Documents are uploaded with `PUT /v1/documents/{name}`, with the file as
+    the request body, and are used for queries with `use_docs` set.
+    """
+    if store is None:
+        return None
+
+    @app.get("/v1/documents")
+    def list_documents() -> list[str]:
+        """The documents available to queries with `use_docs`."""
+        return store.documents()
+
+    @app.put("/v1/documents/{name}")
+    async def upload_document(name: str, request: Request) -> dict:
+        """Add (or replace) a PDF or text document."""
+        data = await request.body()
+        try:
+            chunks = await asyncio.to_thread(store.add_file, name, data)
+        except ValueError as error:
+            raise HTTPException(status_code=415, detail=str(error))
+        return {"document": name, "chunks": chunks}
+
+    @app.delete("/v1/documents/{name}")
+    def remove_document(name: str) -> dict:
+        """Remove a document."""
+        if not store.remove(name):
+            raise HTTPException(status_code=404, detail="Document not found.")
+        return {"document": name}
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add documents to (or remove them from) a document store."
+    )
+    parser.add_argument("directory", type=Path, help="The store's directory.")
+    parser.add_argument("files", type=Path, nargs="*", help="PDF or text files.")
+    parser.add_argument("--remove", nargs="+", default=[], metavar="NAME")
+    parser.add_argument("--merge", action="store_true", help="Merge the segments.")
+    args = parser.parse_args()
+
+    store = DocumentStore(args.directory)
+    documents = {
+        path.name: extract_text(path.name, path.read_bytes()) for path in args.files
+    }
+    if documents:
+        print(f"Added {store.add(documents)} chunks.")
+    for name in args.remove:
+        if not store.remove(name):
+            print(f"{name} isn't in the store.")
+    if args.merge:
+        store.merge()
+    print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
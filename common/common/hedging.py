@@ -0,0 +1,106 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+async def _close_unread(response: Any) -> None:
+    """Close the upstream stream of a response that lost the race.
+
+    Responses (eg. magentic's `AsyncStreamedStr`) have no way to close their
+    stream, so we start reading it and cancel the read, which closes the
+    connection.
+    """
+    if not hasattr(response, "__aiter__"):
+        return
+
+    async def _read():
+        async for _ in response:
+            pass
+
+    read = asyncio.ensure_future(_read())
+    # Let the read start, so that it's cancelled while waiting on the stream.
+    await asyncio.sleep(0)
+    read.cancel()
+
+
+class Hedging:
+    """Hedges requests that are slow to start with a second request.
+
+    If the primary request hasn't returned (ie. produced its first token)
+    within `delay` seconds, a hedge request is sent too (eg. to another
+    backend or model), and whichever returns first is used. The other is
+    cancelled. If one fails after the hedge is sent, the other is used.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests = 0
+        self.fired = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls, prefix: str = "COPILOT_HEDGE") -> "Hedging | None":
+        """Create a `Hedging` if `<prefix>_AFTER_MS` is positive, else `None`."""
+        delay_ms = float(os.environ.get(f"{prefix}_AFTER_MS", 0))
+        if delay_ms <= 0:
+            return None
+        return cls(delay=delay_ms / 1000)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "fired": self.fired,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+        }
+
+    async def first(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        hedge: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Return the result of `primary()`, hedged with `hedge()` if it's slow."""
+        self.requests += 1
+        primary_task = asyncio.ensure_future(primary())
+        tasks = {primary_task}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay)
+            if done:
+                # Errors before the hedge fires are the caller's to handle.
+                return primary_task.result()
+
+            self.fired += 1
+            hedge_task = asyncio.ensure_future(hedge())
+            tasks.add(hedge_task)
+            error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                # If both returned at once, the primary wins.
+                for task in sorted(done, key=lambda task: task is not primary_task):
+                    failure = (
+                        asyncio.CancelledError()
+                        if task.cancelled()
+                        else task.exception()
+                    )
+                    if failure is not None:
+                        # If both fail, the primary's error is raised.
+                        if error is None or task is primary_task:
+                            error = failure
+                        continue
+                    if task is primary_task:
+                        self.primary_wins += 1
+                    else:
+                        self.hedge_wins += 1
+                    for loser in done - {task}:
+                        if not loser.cancelled() and loser.exception() is None:
+                            await _close_unread(loser.result())
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import math
+import os
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Sequence
+
+from .context import CHARS_PER_TOKEN
+from .models import MESSAGE_CACHE_SIZE, LlmFunctionCallResult, LlmMessage, RoleEnum
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Chat APIs wrap every message in a few tokens of role and separator markup.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Counts the tokens in messages for a model, memoizing the count per message.
+
+    With `tokenizer="tiktoken"` (the default), messages are tokenized with the
+    model's tiktoken encoding, or `cl100k_base` for models tiktoken doesn't
+    know (eg. Mistral and Llama, where it's a close approximation). If
+    tiktoken isn't installed, or its encoding can't be loaded (it's downloaded
+    on first use), or `tokenizer="chars"`, tokens are estimated from the
+    number of characters instead.
+
+    The encoding is loaded on first use, unless it's loaded in the background
+    with `warmup` (eg. from the app's lifespan), so that the download doesn't
+    block the event loop; tokens are estimated until it's loaded.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        tokenizer: str = "tiktoken",
+        cache_size: int = MESSAGE_CACHE_SIZE,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self._encode: Callable[[str], list] | None = None
+        self._loaded = False
+        self._loading = False
+        # The client resends the whole conversation every turn, so each
+        # message only needs to be tokenized once.
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    @classmethod
+    def from_env(
+        cls, model: str, default_tokenizer: str = "tiktoken"
+    ) -> "TokenCounter":
+        """Create a counter using the tokenizer set in `COPILOT_TOKENIZER`."""
+        return cls(
+            model, tokenizer=os.environ.get("COPILOT_TOKENIZER", default_tokenizer)
+        )
+
+    def _load(self) -> None:
+        try:
+            self._load_encoding()
+        finally:
+            self._loaded = True
+
+    def _load_encoding(self) -> None:
+        if self.tokenizer != "tiktoken":
+            return
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as error:
+            logger.warning(
+                "Couldn't load a tiktoken encoding for %s (%s), estimating token "
+                "counts from message lengths instead.",
+                self.model,
+                error,
+            )
+            return
+        # Special tokens in user content are counted as ordinary text.
+        self._encode = lambda text: encoding.encode(text, disallowed_special=())
+
+    @asynccontextmanager
+    async def warmup(self) -> AsyncIterator[None]:
+        """Load the encoding in a background thread, within the context."""
+        if self._loaded or self._loading:
+            yield
+            return
+        self._loading = True
+
+        async def _warmup():
+            await asyncio.to_thread(self._load)
+            # Drop the counts estimated while the encoding was loading.
+            self.count.cache_clear()
+
+        task = asyncio.create_task(_warmup())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    def _count(self, text: str) -> int:
+        if not self._loaded and not self._loading:
+            self._load()
+        if self._encode is None:
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+        return len(self._encode(text))
+
+    def message_tokens(self, message: LlmMessage | LlmFunctionCallResult) -> int:
+        content = message.content
+        text = content if isinstance(content, str) else dumps(content)
+        return self.count(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class HistoryBudget:
+    """A token budget for the conversation history included in a prompt.
+
+    The system prompt (and any context or widgets) isn't counted. A limit of
+    `None` means unlimited.
+    """
+
+    max_tokens: int | None = None
+
+    @classmethod
+    def from_env(
+        cls, prefix: str, default_max_tokens: int | None = None
+    ) -> "HistoryBudget":
+        """Read the budget from `<prefix>_MAX_TOKENS`."""
+        max_tokens = os.environ.get(f"{prefix}_MAX_TOKENS", default_max_tokens)
+        return cls(max_tokens=int(max_tokens) if max_tokens else None)
+
+
+Message = LlmMessage | LlmFunctionCallResult
+
+
+def _split_turns(messages: Sequence[Message]) -> list[list[Message]]:
+    """Split a conversation into turns, each starting with a human message.
+
+    A turn includes the AI's reply, and any function calls and their results,
+    so these are always kept (or dropped) together.
+    """
+    turns: list[list[Message]] = []
+    for message in messages:
+        if message.role == RoleEnum.human or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def trim_history(
+    messages: Sequence[Message], budget: HistoryBudget, counter: TokenCounter
+) -> list[Message]:
+    """Drop the oldest turns of a conversation until it fits in `budget`.
+
+    The latest turn is always kept, even if it alone exceeds the budget.
+    """
+    if budget.max_tokens is None:
+        return list(messages)
+
+    kept: list[list[Message]] = []
+    total = 0
+    for turn in reversed(_split_turns(messages)):
+        tokens = sum(counter.message_tokens(message) for message in turn)
+        if kept and total + tokens > budget.max_tokens:
+            break
+        kept.append(turn)
+        total += tokens
+    return [message for turn in reversed(kept) for message in turn]
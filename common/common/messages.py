@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+from magentic import AssistantMessage, UserMessage
+
+from .models import MESSAGE_CACHE_SIZE
+
+
+# The client resends the full conversation on every turn, so the same message
+# content is converted over and over again. Since magentic messages are never
+# mutated, it's safe to share them between requests.
+
+
+@lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def user_message(content: str) -> UserMessage:
+    """Get a (memoized) magentic user message."""
+    return UserMessage(content)
+
+
+@lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def assistant_message(content: str) -> AssistantMessage:
+    """Get a (memoized) magentic assistant message.
+
+    Function calls aren't converted: magentic would send them as tool calls
+    without a result, which OpenAI-compatible APIs reject.
+    """
+    return AssistantMessage(content)
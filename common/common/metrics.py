@@ -0,0 +1,319 @@
+import bisect
+import os
+import time
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable
+
+from fastapi import Request, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Buckets (in seconds) for stage timings, which range from microseconds (eg.
+# message conversion) to tens of seconds (eg. streaming a long reply).
+STAGE_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)  # fmt: skip
+TIME_TO_FIRST_TOKEN_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0,
+)  # fmt: skip
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class _Value(_Metric):
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(_Value):
+    type = "counter"
+
+
+class Gauge(_Value):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Labels = (), buckets=STAGE_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket (not cumulative), then sum and count.
+        self._values: dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                label_str = _format_labels(
+                    self.labelnames + ("le",), labels + (_format_value(bucket),)
+                )
+                lines.append(f"{self.name}_bucket{label_str} {cumulative}")
+            label_str = _format_labels(self.labelnames + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{label_str} {count}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _RequestTimingMiddleware:
+    """Records when each request was received, before its body is parsed."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+class Metrics:
+    """Latency and streaming metrics for the copilots, in Prometheus format.
+
+    Records per-stage timings of `/v1/query` (`copilot_stage_seconds`),
+    time-to-first-token and tokens-per-second histograms, and a gauge of
+    in-flight streams, all labelled by copilot. Other components' `stats()`
+    can be exported as gauges with `register_stats`.
+
+    When disabled, timers and stream tracking are no-ops, so instrumented code
+    pays (almost) nothing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stage_seconds = Histogram(
+            "copilot_stage_seconds",
+            "Time spent in each stage of a query.",
+            ("copilot", "stage"),
+        )
+        self.time_to_first_token = Histogram(
+            "copilot_time_to_first_token_seconds",
+            "Time from receiving a query to streaming its first token.",
+            ("copilot",),
+            buckets=TIME_TO_FIRST_TOKEN_BUCKETS,
+        )
+        self.tokens_per_second = Histogram(
+            "copilot_tokens_per_second",
+            "Rate at which tokens were streamed, after the first.",
+            ("copilot",),
+            buckets=TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.streams_in_flight = Gauge(
+            "copilot_streams_in_flight",
+            "Number of responses currently streaming.",
+            ("copilot",),
+        )
+        self.tokens = Counter(
+            "copilot_tokens_total", "Number of tokens streamed.", ("copilot",)
+        )
+        self._metrics: list[_Metric] = [
+            self.stage_seconds,
+            self.time_to_first_token,
+            self.tokens_per_second,
+            self.streams_in_flight,
+            self.tokens,
+        ]
+        self._stats: list[tuple[str, str, Callable[[], dict | list[dict]]]] = []
+
+    @classmethod
+    def from_env(cls) -> "Metrics":
+        """Create metrics, enabled if `COPILOT_METRICS` is `true`."""
+        return cls(enabled=os.environ.get("COPILOT_METRICS", "false").lower() == "true")
+
+    def instrument(self, app: ASGIApp) -> None:
+        """Record when requests are received, so parsing and validation is timed."""
+        if self.enabled:
+            app.add_middleware(_RequestTimingMiddleware)
+
+    def register_stats(
+        self, prefix: str, copilot: str, stats: Callable[[], dict | list[dict]]
+    ) -> None:
+        """Export the numeric values of `stats()` as gauges named `<prefix>_<key>`.
+
+        `stats()` may return a dict, or a list of dicts whose string values
+        (eg. a backend's URL) are used as labels.
+        """
+        self._stats.append((prefix, copilot, stats))
+
+    def stage(self, copilot: str, stage: str):
+        """A context manager timing a stage of a query."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.stage_seconds, (copilot, stage))
+
+    def request_started(self, copilot: str, request: Request) -> float:
+        """Record the time taken to receive and validate a query.
+
+        Returns when the query was received, to measure time-to-first-token
+        from.
+        """
+        now = time.perf_counter()
+        if not self.enabled:
+            return now
+        received_at = request.scope.get("state", {}).get("received_at", now)
+        self.stage_seconds.observe(now - received_at, copilot, "validation")
+        return received_at
+
+    def first_token(self, copilot: str, received_at: float) -> None:
+        """Record the time-to-first-token of a response with no text stream."""
+        if self.enabled:
+            self.time_to_first_token.observe(time.perf_counter() - received_at, copilot)
+
+    def track_stream(
+        self, copilot: str, chunks: AsyncIterable[str], received_at: float
+    ) -> AsyncIterable[str]:
+        """Record time-to-first-token, token rate and streaming time of `chunks`."""
+        if not self.enabled:
+            return chunks
+        return self._track_stream(copilot, chunks, received_at)
+
+    async def _track_stream(
+        self, copilot: str, chunks: AsyncIterable[str], received_at: float
+    ) -> AsyncIterator[str]:
+        self.streams_in_flight.inc(copilot)
+        first_token_at = None
+        count = 0
+        try:
+            async for chunk in chunks:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    self.time_to_first_token.observe(
+                        first_token_at - received_at, copilot
+                    )
+                count += 1
+                yield chunk
+        finally:
+            self.streams_in_flight.dec(copilot)
+            self.tokens.inc(copilot, amount=count)
+            if first_token_at is not None:
+                duration = time.perf_counter() - first_token_at
+                self.stage_seconds.observe(duration, copilot, "streaming")
+                if count > 1 and duration > 0:
+                    self.tokens_per_second.observe((count - 1) / duration, copilot)
+
+    def _render_stats(self) -> list[str]:
+        gauges: dict[str, Gauge] = {}
+        for prefix, copilot, stats in self._stats:
+            entries = stats()
+            for entry in entries if isinstance(entries, list) else [entries]:
+                labelnames = ("copilot",) + tuple(
+                    key for key, value in entry.items() if isinstance(value, str)
+                )
+                labels = (copilot,) + tuple(entry[key] for key in labelnames[1:])
+                for key, value in entry.items():
+                    if isinstance(value, (bool, int, float)):
+                        name = f"{prefix}_{key}"
+                        if name not in gauges:
+                            gauges[name] = Gauge(name, f"{prefix} {key}.", labelnames)
+                        gauges[name]._values[labels] = float(value)
+        return [line for gauge in gauges.values() for line in gauge.render()]
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [line for metric in self._metrics for line in metric.render()]
+        lines.extend(self._render_stats())
+        return "\n".join(lines) + "\n"
+
+    def response(self) -> Response:
+        """Serve the metrics, or a `404` if they're disabled."""
+        if not self.enabled:
+            return Response(status_code=404)
+        return Response(content=self.render(), media_type="text/plain; version=0.0.4")
+
+
+metrics = Metrics.from_env()
@@ -1,8 +1,14 @@
-from typing import Any, Literal
+from typing import Annotated, Any, Literal
 from uuid import UUID
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Discriminator, Field, Tag, field_validator
 from enum import Enum
-import json
+from functools import lru_cache
+
+from .serialization import dumps, loads
+
+# The client resends the full conversation on every turn, so we memoize the
+# (comparatively expensive) parsing of message content.
+MESSAGE_CACHE_SIZE = 4096
 
 
 class RoleEnum(str, Enum):
@@ -11,6 +17,27 @@ class RoleEnum(str, Enum):
     tool = "tool"
 
 
+def widget_data_arguments(widget_uuids: list[str]) -> dict[str, Any]:
+    """The `get_widget_data` input arguments to retrieve one or more widgets.
+
+    A single widget is requested with `widget_uuid`, as before batching was
+    supported, and several at once with `widget_uuids`.
+    """
+    if len(widget_uuids) == 1:
+        return {"widget_uuid": widget_uuids[0]}
+    return {"widget_uuids": list(widget_uuids)}
+
+
+def _widget_uuids(input_arguments: dict[str, Any] | None) -> list[str]:
+    if not input_arguments:
+        return []
+    if "widget_uuids" in input_arguments:
+        return list(input_arguments["widget_uuids"])
+    if "widget_uuid" in input_arguments:
+        return [input_arguments["widget_uuid"]]
+    return []
+
+
 class LlmFunctionCallResult(BaseModel):
     role: RoleEnum = RoleEnum.tool
     function: str = Field(description="The name of the called function.")
@@ -19,11 +46,21 @@ class LlmFunctionCallResult(BaseModel):
     )
     content: str = Field(description="The result of the function call.")
 
+    @property
+    def widget_uuids(self) -> list[str]:
+        """The UUIDs of the widgets whose data this is the result for."""
+        return _widget_uuids(self.input_arguments)
+
 
 class LlmFunctionCall(BaseModel):
     function: str
     input_arguments: dict[str, Any]
 
+    @property
+    def widget_uuids(self) -> list[str]:
+        """The UUIDs of the widgets requested by a `get_widget_data` call."""
+        return _widget_uuids(self.input_arguments)
+
 
 class LlmMessage(BaseModel):
     role: RoleEnum = Field(
@@ -39,15 +76,25 @@ class LlmMessage(BaseModel):
         # the messages that we're able to parse it correctly since the client
         # will send the LlmFunctionCall encoded as a string, rather than JSON.
         if isinstance(v, str):
-            try:
-                parsed_content = json.loads(v)
-                if isinstance(parsed_content, str):
-                    # Sometimes we need a second decode if the content is
-                    # escaped and string-encoded
-                    parsed_content = json.loads(parsed_content)
-                return LlmFunctionCall(**parsed_content)
-            except (json.JSONDecodeError, TypeError, ValueError):
+            # Only a JSON object (or a string-encoded JSON object) can be a
+            # function call, so we can skip decoding anything else.
+            if not v.lstrip().startswith(("{", '"')):
                 return v
+            function_call = _parse_function_call(v)
+            return v if function_call is None else function_call
+
+
+@lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def _parse_function_call(content: str) -> LlmFunctionCall | None:
+    try:
+        parsed_content = loads(content)
+        if isinstance(parsed_content, str):
+            # Sometimes we need a second decode if the content is
+            # escaped and string-encoded
+            parsed_content = loads(parsed_content)
+        return LlmFunctionCall(**parsed_content)
+    except (TypeError, ValueError):
+        return None
 
 
 class DataContent(BaseModel):
@@ -79,8 +126,26 @@ class Widget(BaseModel):
     )
 
 
+def _message_role(message: Any) -> Any:
+    # Tool results have always been accepted without a role, since it defaults
+    # to `tool`.
+    if isinstance(message, dict):
+        return message.get("role", "tool")
+    return getattr(message, "role", None)
+
+
+# Messages are told apart by their role, rather than by trying to validate
+# each one as every member of the union in turn.
+QueryMessage = Annotated[
+    Annotated[LlmFunctionCallResult, Tag("tool")]
+    | Annotated[LlmMessage, Tag("ai")]
+    | Annotated[LlmMessage, Tag("human")],
+    Discriminator(_message_role),
+]
+
+
 class AgentQueryRequest(BaseModel):
-    messages: list[LlmFunctionCallResult | LlmMessage] = Field(
+    messages: list[QueryMessage] = Field(
         description="A list of messages to submit to the copilot."
     )
     context: str | list[RawContext] | None = Field(
@@ -115,7 +180,7 @@ class BaseSSE(BaseModel):
     def model_dump(self, *args, **kwargs) -> dict:
         return {
             "event": self.event,
-            "data": self.data.model_dump_json(exclude_none=True),
+            "data": dumps(self.data, exclude_none=True),
         }
 
 
@@ -0,0 +1,92 @@
+import hashlib
+from collections import OrderedDict
+from string import Formatter
+from typing import Any, Callable, Sequence
+
+from magentic import SystemMessage
+from magentic.chat_model.base import ChatModel
+from magentic.chat_model.message import Message
+
+
+class ChatPrompt:
+    """A chat prompt that is compiled once and reused across requests.
+
+    This replaces declaring a new `@chatprompt` function on every request. The
+    system prompt template is parsed once, and rendered system messages are
+    kept in a bounded LRU cache keyed by a hash of the template arguments,
+    since the same dashboard (widgets and context) is usually sent turn after
+    turn.
+
+    Unlike `@chatprompt`, the chat messages are passed to the model verbatim
+    rather than being treated as templates, so they don't need their curly
+    braces escaped.
+    """
+
+    def __init__(
+        self,
+        system_template: str,
+        output_types: Sequence[type],
+        cache_size: int = 128,
+    ):
+        self._formatter = Formatter()
+        self._template = list(self._formatter.parse(system_template))
+        self.fields = {field for _, field, _, _ in self._template if field}
+        self.output_types = list(output_types)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[bytes, SystemMessage] = OrderedDict()
+
+    def _render(self, **kwargs: Any) -> str:
+        parts = []
+        for literal, field, format_spec, conversion in self._template:
+            parts.append(literal)
+            if field is not None:
+                value = self._formatter.convert_field(kwargs[field], conversion)
+                parts.append(self._formatter.format_field(value, format_spec or ""))
+        return "".join(parts)
+
+    def _cache_key(self, kwargs: dict[str, Any]) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for field in sorted(self.fields):
+            value = str(kwargs[field]).encode()
+            digest.update(len(value).to_bytes(8, "little"))
+            digest.update(value)
+        return digest.digest()
+
+    def system_message(self, **kwargs: Any) -> SystemMessage:
+        """Render the system message, reusing a cached render if possible."""
+        missing = self.fields - kwargs.keys()
+        if missing:
+            raise TypeError(f"Missing prompt arguments: {', '.join(sorted(missing))}")
+
+        key = self._cache_key(kwargs)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        message = SystemMessage(self._render(**kwargs))
+        self._cache[key] = message
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return message
+
+    def messages(
+        self, chat_messages: Sequence[Message[Any]], **kwargs: Any
+    ) -> list[Message[Any]]:
+        """Build the full list of messages to send to the model."""
+        return [self.system_message(**kwargs), *chat_messages]
+
+    async def __call__(
+        self,
+        chat_messages: Sequence[Message[Any]],
+        *,
+        model: ChatModel,
+        functions: list[Callable[..., Any]] | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        """Query the model with the system prompt followed by the chat messages."""
+        message = await model.acomplete(
+            messages=self.messages(chat_messages, **kwargs),
+            functions=functions,
+            output_types=self.output_types,
+        )
+        return message.content
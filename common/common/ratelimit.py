@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterable, AsyncIterator
+
+
+class TokenBucket:
+    """Refills at `rate` units per second, holding up to `capacity` units.
+
+    Units can be taken beyond what's available (eg. to charge for completion
+    tokens after they're streamed), in which case the bucket goes into debt,
+    and later requests wait for it to be repaid.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.available = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` (at most `capacity`) units are available."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= amount
+
+
+class RateLimiter:
+    """Keeps requests to each model within its requests and tokens quotas.
+
+    Every request waits (in FIFO order, per model) until a token bucket
+    refilled at `requests_per_second` has a request to spare, and one
+    refilled at `tokens_per_minute` has room for its prompt. Completion
+    tokens are charged as they're streamed, through `metered`. Each bucket
+    holds `burst` seconds' worth of its quota, so short bursts are sent
+    straight away, but the sustained rate never exceeds the quota.
+
+    A limit of `None` means unlimited. The limiter is shared by every request
+    in the process, rather than by each client, so bursts are smoothed out
+    before they reach the provider, instead of being rejected with a `429`.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float | None = None,
+        tokens_per_minute: float | None = None,
+        burst: float = 1.0,
+    ):
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait_time = 0.0
+        self._buckets: dict[str, tuple[TokenBucket | None, TokenBucket | None]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def from_env(cls, prefix: str = "COPILOT_RATE_LIMIT") -> "RateLimiter | None":
+        """Read the quotas from `<prefix>_RPS` and `<prefix>_TPM`, and the
+        burst from `<prefix>_BURST`. Returns `None` if neither quota is set.
+        """
+        rps = os.environ.get(f"{prefix}_RPS")
+        tpm = os.environ.get(f"{prefix}_TPM")
+        if not rps and not tpm:
+            return None
+        return cls(
+            requests_per_second=float(rps) if rps else None,
+            tokens_per_minute=float(tpm) if tpm else None,
+            burst=float(os.environ.get(f"{prefix}_BURST", 1.0)),
+        )
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "wait_time_seconds": self.total_wait_time,
+        }
+
+    def _model_buckets(
+        self, model: str
+    ) -> tuple[TokenBucket | None, TokenBucket | None]:
+        if model not in self._buckets:
+            requests = tokens = None
+            if self.requests_per_second:
+                requests = TokenBucket(
+                    self.requests_per_second,
+                    max(self.requests_per_second * self.burst, 1.0),
+                )
+            if self.tokens_per_minute:
+                rate = self.tokens_per_minute / 60
+                tokens = TokenBucket(rate, rate * self.burst)
+            self._buckets[model] = (requests, tokens)
+        return self._buckets[model]
+
+    async def acquire(self, model: str, tokens: int = 0) -> None:
+        """Wait until a request with a prompt of `tokens` can be sent to `model`."""
+        self.requests += 1
+        request_bucket, token_bucket = self._model_buckets(model)
+        start = time.monotonic()
+        lock = self._locks.setdefault(model, asyncio.Lock())
+        # The lock is held while waiting, so requests are sent in order.
+        throttled = lock.locked()
+        async with lock:
+            while True:
+                delay = max(
+                    request_bucket.delay(1) if request_bucket else 0.0,
+                    token_bucket.delay(tokens) if token_bucket else 0.0,
+                )
+                if delay <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(delay)
+            if request_bucket is not None:
+                request_bucket.take(1)
+            if token_bucket is not None:
+                token_bucket.take(tokens)
+        if throttled:
+            self.throttled += 1
+            self.total_wait_time += time.monotonic() - start
+
+    def consume(self, model: str, tokens: int) -> None:
+        """Charge `tokens` that were used without waiting (eg. completions)."""
+        _, token_bucket = self._model_buckets(model)
+        if token_bucket is not None:
+            token_bucket.take(tokens)
+
+    async def metered(
+        self, model: str, chunks: AsyncIterable[str]
+    ) -> AsyncIterator[str]:
+        """Stream `chunks`, charging each (as a token) to `model`'s quota."""
+        count = 0
+        try:
+            async for chunk in chunks:
+                count += 1
+                yield chunk
+        finally:
+            self.consume(model, count)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+from typing import Any, Awaitable, Callable, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Like the openai client's own retries: timeouts, conflicts, rate limits and
+# server errors.
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+def _status_code(error: BaseException) -> int | None:
+    """The HTTP status of an upstream error (from openai, LiteLLM or httpx)."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def _is_transport_error(error: BaseException) -> bool:
+    """Whether the request failed to connect or timed out, without a response."""
+    if isinstance(
+        error,
+        (httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError),
+    ):
+        return True
+    # openai wraps these (as do LiteLLM's errors, which subclass openai's). It's
+    # only imported by the chat models, so if it isn't, the error isn't one.
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+
+def _is_retryable(error: BaseException) -> bool:
+    status_code = _status_code(error)
+    if status_code is None:
+        return _is_transport_error(error)
+    return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+def _retry_after(error: BaseException) -> float | None:
+    """The seconds to wait from the error response's `Retry-After` header, if any."""
+    headers: Any = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        # HTTP dates aren't worth parsing for the waits we'll put up with.
+        return None
+
+
+class RetryPolicy:
+    """Retries upstream requests that fail before streaming, where it may help.
+
+    That's requests that fail to connect or time out, and those that fail
+    with a `408`, `409`, `429` or `5xx`, like the openai client's own retries
+    (which are turned off where the policy is used, so they aren't
+    compounded).
+
+    Wrap the wait for the first token with `call`; errors after that can't be
+    retried, as part of the response has been sent. Each retry waits a random
+    time between zero and an exponentially growing backoff ("full jitter"),
+    so clients that were rejected together don't all retry together. A
+    `Retry-After` header is respected, unless it's longer than `max_delay`,
+    in which case the error is raised straight away.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.exhausted = 0
+
+    @classmethod
+    def from_env(cls, prefix: str = "COPILOT_RETRY") -> "RetryPolicy | None":
+        """Read the policy from `<prefix>_MAX_ATTEMPTS`, `_BASE_DELAY` and
+        `_MAX_DELAY`. Returns `None` unless `<prefix>_MAX_ATTEMPTS` is more
+        than one (leaving retries to the upstream client).
+        """
+        max_attempts = int(os.environ.get(f"{prefix}_MAX_ATTEMPTS", 1))
+        if max_attempts <= 1:
+            return None
+        return cls(
+            max_attempts=max_attempts,
+            base_delay=float(os.environ.get(f"{prefix}_BASE_DELAY", 0.5)),
+            max_delay=float(os.environ.get(f"{prefix}_MAX_DELAY", 8.0)),
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {"retries": self.retries, "exhausted": self.exhausted}
+
+    def backoff(self, attempt: int, error: BaseException) -> float | None:
+        """Seconds to wait before retrying after `attempt`, or `None` to give up."""
+        if not _is_retryable(error):
+            return None
+        if attempt >= self.max_attempts:
+            self.exhausted += 1
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+    async def call(self, request: Callable[[], Awaitable[T]]) -> T:
+        """Await `request()`, retrying it while it fails with a retryable error."""
+        attempt = 1
+        while True:
+            try:
+                return await request()
+            except Exception as error:
+                delay = self.backoff(attempt, error)
+                if delay is None:
+                    raise
+                logger.info(
+                    "Upstream request failed (%s), retrying in %.2fs.", error, delay
+                )
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
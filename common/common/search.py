@@ -0,0 +1,146 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from typing import Sequence
+
+from .models import LlmFunctionCallResult, LlmMessage, RoleEnum, Widget
+from .serialization import dumpb
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """An in-memory BM25 index over a (small) set of documents.
+
+    Documents are tokenized once, when the index is built, into an inverted
+    index of term frequencies, so scoring a query only visits the documents
+    that contain one of its terms.
+    """
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        self._lengths: list[int] = []
+        self._postings: dict[str, list[tuple[int, int]]] = {}
+        for i, document in enumerate(documents):
+            tokens = tokenize(document)
+            self._lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings.setdefault(term, []).append((i, frequency))
+        self._average_length = sum(self._lengths) / self.size if self.size else 0.0
+
+    def _idf(self, term: str) -> float:
+        count = len(self._postings.get(term, ()))
+        return math.log(1 + (self.size - count + 0.5) / (count + 0.5))
+
+    def scores(self, query: str) -> list[float]:
+        """Score every document against `query`."""
+        scores = [0.0] * self.size
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for i, frequency in postings:
+                length = self._lengths[i] / (self._average_length or 1)
+                scores[i] += (
+                    idf
+                    * frequency
+                    * (self.k1 + 1)
+                    / (frequency + self.k1 * (1 - self.b + self.b * length))
+                )
+        return scores
+
+    def rank(self, query: str, k: int | None = None) -> list[int]:
+        """The indices of the `k` best matches for `query`, best first.
+
+        Documents that score equally (eg. because none match) keep their
+        original order.
+        """
+        scores = self.scores(query)
+        ranking = sorted(range(self.size), key=lambda i: -scores[i])
+        return ranking if k is None else ranking[:k]
+
+
+def _widget_document(widget: Widget) -> str:
+    parts = [widget.name, widget.description]
+    for key, value in (widget.metadata or {}).items():
+        parts.append(f"{key} {value}")
+    return "\n".join(parts)
+
+
+def _widgets_key(widgets: Sequence[Widget]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for widget in widgets:
+        digest.update(dumpb(widget.model_dump(mode="json")))
+    return digest.hexdigest()
+
+
+def latest_query(messages: Sequence[LlmMessage | LlmFunctionCallResult]) -> str:
+    """The content of the latest human message, if there is one."""
+    for message in reversed(messages):
+        if message.role == RoleEnum.human and isinstance(message.content, str):
+            return message.content
+    return ""
+
+
+class WidgetSelector:
+    """Selects the dashboard widgets most relevant to a query, for the prompt.
+
+    Widgets are ranked with BM25 over their name, description and metadata,
+    and only the `top_k` best matches are kept. The index for each dashboard
+    is cached (keyed by a hash of its widgets), so it's only built once per
+    dashboard rather than once per query; up to `cache_size` dashboards are
+    cached, least-recently-used first.
+    """
+
+    def __init__(self, top_k: int, cache_size: int = 64):
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self._indexes: OrderedDict[str, BM25Index] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(
+        cls, prefix: str, default_top_k: int | None = None
+    ) -> "WidgetSelector | None":
+        """Read `top_k` from `<prefix>_TOP_K`. Returns `None` if it's unset or `0`."""
+        top_k = os.environ.get(f"{prefix}_TOP_K", default_top_k)
+        if not top_k or int(top_k) <= 0:
+            return None
+        return cls(top_k=int(top_k))
+
+    def stats(self) -> dict[str, int]:
+        return {"indexes": len(self._indexes), "hits": self.hits, "misses": self.misses}
+
+    def index(self, widgets: Sequence[Widget]) -> BM25Index:
+        """The (cached) index of a dashboard's widgets."""
+        key = _widgets_key(widgets)
+        index = self._indexes.get(key)
+        if index is not None:
+            self.hits += 1
+            self._indexes.move_to_end(key)
+            return index
+        self.misses += 1
+        index = self._indexes[key] = BM25Index(
+            [_widget_document(widget) for widget in widgets]
+        )
+        if len(self._indexes) > self.cache_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    def select(self, widgets: list[Widget] | None, query: str) -> list[Widget] | None:
+        """The `top_k` widgets most relevant to `query`, most relevant first."""
+        if not widgets or len(widgets) <= self.top_k:
+            return widgets
+        ranking = self.index(widgets).rank(query, self.top_k)
+        return [widgets[i] for i in ranking]
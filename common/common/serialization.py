@@ -0,0 +1,54 @@
+import json
+from typing import Any
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# orjson is used when it's installed, otherwise we fall back to the standard
+# library. Both produce the same compact, UTF-8 (non-ASCII-escaped) output.
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumpb(obj: Any, *, exclude_none: bool = False) -> bytes:
+    """Serialize `obj` to compact JSON bytes.
+
+    Pydantic models are serialized with pydantic's own (native) serializer,
+    which is faster than dumping them to a dict first.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump_json(exclude_none=exclude_none).encode()
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # eg. integers beyond 64 bits, which the standard library handles.
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def dumps(obj: Any, *, exclude_none: bool = False) -> str:
+    """Serialize `obj` to a compact JSON string."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump_json(exclude_none=exclude_none)
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data: str | bytes) -> Any:
+    """Deserialize JSON from a string or bytes."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects numbers beyond a double's range, which the
+            # standard library parses (and invalid JSON fails again below).
+            pass
+    return json.loads(data)
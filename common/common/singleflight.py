@@ -0,0 +1,104 @@
+import asyncio
+import os
+from contextlib import suppress
+from typing import AsyncIterable, AsyncIterator, Callable
+
+
+class _Flight:
+    """A single upstream stream, shared by every subscriber to its key."""
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """Coalesces identical in-flight requests so they share one upstream stream.
+
+    The first request for a key starts the upstream stream, and every
+    concurrent request for the same key subscribes to it. Events are fanned
+    out to every subscriber, and subscribers that join late receive the events
+    produced so far before following the live stream. If every subscriber
+    disconnects, the upstream stream is cancelled.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight | None":
+        """Create a `SingleFlight` if `COPILOT_SINGLE_FLIGHT` is enabled, else `None`."""
+        if os.environ.get("COPILOT_SINGLE_FLIGHT", "false").lower() != "true":
+            return None
+        return cls()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+    async def _produce(
+        self, key: str, flight: _Flight, stream: Callable[[], AsyncIterable[dict]]
+    ) -> None:
+        try:
+            async for event in stream():
+                flight.events.append(event)
+                flight.notify()
+        except BaseException as error:
+            flight.error = error
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def stream(
+        self, key: str, stream: Callable[[], AsyncIterable[dict]]
+    ) -> AsyncIterator[dict]:
+        """Subscribe to the stream for `key`, starting it with `stream` if needed."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, stream))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                changed = flight.changed
+                while position < len(flight.events):
+                    yield flight.events[position]
+                    position += 1
+                if flight.done:
+                    break
+                await changed.wait()
+
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening anymore, so stop generating.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await flight.task
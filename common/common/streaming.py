@@ -0,0 +1,92 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator
+
+
+@dataclass
+class ChunkCoalescing:
+    """Settings for coalescing streamed chunks into fewer SSE events.
+
+    Buffered chunks are flushed once `max_bytes` have accumulated, or
+    `max_delay` seconds after the first chunk was buffered, whichever comes
+    first. The first chunk of a stream is always flushed immediately, so
+    time-to-first-token is unaffected.
+    """
+
+    max_delay: float = 0.02
+    max_bytes: int = 256
+
+    @classmethod
+    def from_env(cls) -> "ChunkCoalescing | None":
+        """Read the settings from the environment, or `None` if disabled.
+
+        Coalescing is enabled by setting `COPILOT_STREAM_COALESCE_MS` to a
+        positive value. `COPILOT_STREAM_COALESCE_BYTES` sets the size threshold.
+        """
+        max_delay_ms = float(os.environ.get("COPILOT_STREAM_COALESCE_MS", 0))
+        if max_delay_ms <= 0:
+            return None
+        return cls(
+            max_delay=max_delay_ms / 1000,
+            max_bytes=int(os.environ.get("COPILOT_STREAM_COALESCE_BYTES", 256)),
+        )
+
+
+def coalesce_chunks(
+    chunks: AsyncIterable[str], coalescing: ChunkCoalescing | None
+) -> AsyncIterable[str]:
+    """Coalesce streamed chunks according to `coalescing` (if enabled)."""
+    if coalescing is None:
+        return chunks
+    return _coalesce(chunks, coalescing.max_bytes, coalescing.max_delay)
+
+
+async def _coalesce(
+    chunks: AsyncIterable[str], max_bytes: int, max_delay: float
+) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    # We wait on the next chunk in a task, rather than with a timeout, so that
+    # flushing on a deadline never cancels (and breaks) the upstream stream.
+    pending: asyncio.Future[str] | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                yield "".join(buffer)
+                buffer, size = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
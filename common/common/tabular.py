@@ -0,0 +1,257 @@
+import csv
+import importlib.util
+import logging
+import math
+import os
+import warnings
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
+
+from .context import CHARS_PER_TOKEN
+from .models import MESSAGE_CACHE_SIZE, DataContent, RawContext
+from .serialization import dumps, loads
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CSV_DELIMITERS = (",", "\t", ";", "|")
+
+Table = tuple[list[str], list[list[Any]]]
+
+
+def _parse_csv(text: str) -> Table | None:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) < 3:
+        return None
+    try:
+        for delimiter in CSV_DELIMITERS:
+            # Only the header and first row are checked before parsing everything.
+            # (A quoted field spanning the lines makes them a single row.)
+            header, first = csv.reader(lines[:2], delimiter=delimiter)
+            if len(header) > 1 and len(first) == len(header):
+                break
+        else:
+            return None
+        header, *rows = csv.reader(lines, delimiter=delimiter)
+    except (ValueError, csv.Error):
+        return None
+    if any(len(row) != len(header) for row in rows):
+        return None
+    return header, [list(column) for column in zip(*rows)]
+
+
+def parse_table(content: Any) -> Table | None:
+    """Parse tabular content into its column names and columns.
+
+    Tables are a list of JSON records, a JSON object of equal-length columns
+    (or either of these, as a JSON string), or CSV (or TSV) text with a
+    header row. Anything else returns `None`.
+    """
+    if isinstance(content, str):
+        text = content.strip()
+        if not text.startswith(("[", "{")):
+            return _parse_csv(text)
+        try:
+            content = loads(text)
+        except ValueError:
+            return None
+
+    if isinstance(content, dict):
+        values = list(content.values())
+        if len(values) == 1 and isinstance(values[0], list):
+            # Records wrapped in an object, eg. `{"results": [...]}`.
+            content = values[0]
+        elif (
+            len(values) > 1
+            and all(isinstance(value, list) for value in values)
+            and len({len(value) for value in values}) == 1
+            and len(values[0]) > 1
+        ):
+            return [str(name) for name in content], values
+
+    if (
+        isinstance(content, list)
+        and len(content) > 1
+        and all(isinstance(row, dict) for row in content)
+    ):
+        names = list(dict.fromkeys(name for row in content for name in row))
+        return [str(name) for name in names], [
+            [row.get(name) for row in content] for name in names
+        ]
+    return None
+
+
+def _to_float(values: list[Any]) -> "np.ndarray | None":
+    """Convert a column to floats (missing values are NaN), if it's numeric."""
+    # NumPy is only imported once there's a table to compact.
+    import numpy as np
+
+    sample = next((value for value in values if value not in (None, "")), None)
+    if sample is None or isinstance(sample, bool):
+        return None
+    try:
+        if isinstance(sample, str):
+            strings = np.asarray(values, dtype=np.str_)
+            strings = np.where((strings == "") | (strings == "None"), "nan", strings)
+            array = strings.astype(np.float64)
+        else:
+            array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    # Values that are lists would be spread over several columns.
+    return array if array.ndim == 1 else None
+
+
+def _number(value: float) -> float | None:
+    value = float(value)
+    return None if math.isnan(value) else float(f"{value:.6g}")
+
+
+def _numeric_stats(columns: list["np.ndarray"]) -> list[dict[str, Any]]:
+    """Compute the statistics of every numeric column at once."""
+    import numpy as np
+
+    matrix = np.column_stack(columns)
+    present = ~np.isnan(matrix)
+    # The last non-missing value, found from the end of each column.
+    last = matrix.shape[0] - 1 - np.argmax(present[::-1], axis=0)
+    with warnings.catch_warnings():
+        # Columns with no values at all are NaN, which is what we want.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        minimum = np.nanmin(matrix, axis=0)
+        maximum = np.nanmax(matrix, axis=0)
+        mean = np.nanmean(matrix, axis=0)
+    counts = present.sum(axis=0)
+    return [
+        {
+            "type": "number",
+            "count": int(counts[i]),
+            "min": _number(minimum[i]),
+            "max": _number(maximum[i]),
+            "mean": _number(mean[i]),
+            "last": _number(matrix[last[i], i]),
+        }
+        for i in range(matrix.shape[1])
+    ]
+
+
+def _other_stats(values: list[Any]) -> dict[str, Any]:
+    present = [value for value in values if value not in (None, "")]
+    stats: dict[str, Any] = {"type": "string", "count": len(present)}
+    if present and all(isinstance(value, str) for value in present):
+        # For ISO dates, this is the date range.
+        stats["min"] = min(present)
+        stats["max"] = max(present)
+        stats["unique"] = len(set(present))
+    if present:
+        stats["last"] = present[-1]
+    return stats
+
+
+def summarize_table(names: list[str], columns: list[list[Any]], rows: int) -> dict:
+    """Summarize a table: its schema, row count, and per-column statistics.
+
+    The first and last `rows` rows are included as samples.
+    """
+    row_count = len(columns[0]) if columns else 0
+    numeric = [_to_float(column) for column in columns]
+    numeric_stats = iter(
+        _numeric_stats([array for array in numeric if array is not None])
+        if any(array is not None for array in numeric)
+        else []
+    )
+    stats = {
+        name: next(numeric_stats) if array is not None else _other_stats(column)
+        for name, column, array in zip(names, columns, numeric)
+    }
+    head = min(rows, row_count)
+    tail = min(rows, row_count - head)
+    return {
+        "summary": (
+            f"A table of {row_count} rows, compacted to fit the prompt. The "
+            "statistics cover every row; only the first and last rows are shown."
+        ),
+        "row_count": row_count,
+        "columns": stats,
+        "head": [list(row) for row in zip(*(column[:head] for column in columns))],
+        "tail": [
+            list(row)
+            for row in zip(*(column[row_count - tail :] for column in columns))
+        ]
+        if tail
+        else [],
+    }
+
+
+@dataclass
+class TableCompaction:
+    """Replaces large tabular payloads with a summary that fits a size budget.
+
+    Tabular content (see `parse_table`) larger than `max_chars` is replaced
+    by a JSON summary (see `summarize_table`) with up to `sample_rows` rows
+    from each end of the table, halving the number of sample rows until the
+    summary fits. Statistics are computed with NumPy, for all the numeric
+    columns at once. Anything else is left as is.
+    """
+
+    max_chars: int = 4_000
+    sample_rows: int = 5
+    cache_size: int = MESSAGE_CACHE_SIZE
+
+    def __post_init__(self):
+        # Tool results are resent on every turn, so each is compacted once.
+        self._compact_text = lru_cache(maxsize=self.cache_size)(self._compact)
+
+    @classmethod
+    def from_env(
+        cls, prefix: str = "COPILOT_TABLE_COMPACTION"
+    ) -> "TableCompaction | None":
+        """Create a `TableCompaction` if `<prefix>` is `true`, else `None`.
+
+        The budget is set in tokens by `<prefix>_MAX_TOKENS`, and the number of
+        sample rows by `<prefix>_SAMPLE_ROWS`.
+        """
+        if os.environ.get(prefix, "false").lower() != "true":
+            return None
+        if importlib.util.find_spec("numpy") is None:
+            logger.warning("NumPy isn't installed, so tables won't be compacted.")
+            return None
+        return cls(
+            max_chars=int(os.environ.get(f"{prefix}_MAX_TOKENS", 1_000))
+            * CHARS_PER_TOKEN,
+            sample_rows=int(os.environ.get(f"{prefix}_SAMPLE_ROWS", 5)),
+        )
+
+    def _compact(self, content: Any) -> Any:
+        size = len(content) if isinstance(content, str) else len(dumps(content))
+        if size <= self.max_chars:
+            return content
+        table = parse_table(content)
+        if table is None:
+            return content
+        names, columns = table
+        rows = self.sample_rows
+        while True:
+            summary = dumps(summarize_table(names, columns, rows))
+            if len(summary) <= self.max_chars or rows == 0:
+                return summary
+            rows //= 2
+
+    def compact(self, content: Any) -> Any:
+        """Compact `content` if it's a large table, otherwise return it as is."""
+        if isinstance(content, str):
+            return self._compact_text(content)
+        return self._compact(content)
+
+    def compact_context(self, context: list[RawContext]) -> list[RawContext]:
+        """Compact the data of any context items that are large tables."""
+        compacted = []
+        for item in context:
+            content = self.compact(item.data.content)
+            if content is not item.data.content:
+                item = item.model_copy(update={"data": DataContent(content=content)})
+            compacted.append(item)
+        return compacted
@@ -1,4 +1,10 @@
+import asyncio
 from ast import literal_eval
+from typing import Any
+
+from magentic import AssistantMessage, AsyncStreamedStr
+
+from .clients import chat_models
 
 
 def capture_stream_response(event_stream: str) -> tuple[str, str]:
@@ -20,3 +26,40 @@ def capture_stream_response(event_stream: str) -> tuple[str, str]:
             data_dict_ = literal_eval(data_payload)
             captured_stream += data_dict_["delta"]
     return event_name, captured_stream
+
+
+class FakeChatModel:
+    """A chat model that streams a fixed reply, without calling an LLM.
+
+    It records the messages of its last request, and how many it's had.
+    """
+
+    def __init__(self, tokens: list[str], ttft: float = 0):
+        self.tokens = tokens
+        self.ttft = ttft
+        self.calls = 0
+        self.messages: list[Any] | None = None
+
+    @property
+    def openai_messages(self) -> list[dict]:
+        """The last request's messages, as sent to OpenAI-compatible APIs."""
+        from magentic.chat_model.openai_chat_model import message_to_openai_message
+
+        return [message_to_openai_message(message) for message in self.messages or []]
+
+    async def acomplete(self, messages, functions=None, output_types=None, stop=None):
+        self.calls += 1
+        self.messages = list(messages)
+        await asyncio.sleep(self.ttft)
+
+        async def _stream():
+            for token in self.tokens:
+                yield token
+
+        return AssistantMessage(AsyncStreamedStr(_stream()))
+
+
+def use_chat_model(monkeypatch, getter: str, chat_model: Any) -> Any:
+    """Have `chat_models.<getter>` (eg. `get_mistral`) return `chat_model`."""
+    monkeypatch.setattr(chat_models, getter, lambda *args, **kwargs: chat_model)
+    return chat_model
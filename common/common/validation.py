@@ -0,0 +1,64 @@
+from typing import Any
+
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from .models import AgentQueryRequest
+
+# Built once, and shared by every request.
+query_request_adapter = TypeAdapter(AgentQueryRequest)
+
+
+async def parse_query_request(request: Request) -> AgentQueryRequest:
+    """Validate the body of a `/v1/query` request, as a FastAPI dependency.
+
+    The body is validated straight from its JSON bytes by pydantic (rather
+    than decoded with the `json` module by FastAPI, and then validated), and
+    invalid requests get the same `422` response as a regular body parameter.
+    """
+    body = await request.body()
+    try:
+        return query_request_adapter.validate_json(body)
+    except ValidationError as error:
+        raise RequestValidationError(
+            [
+                {**details, "loc": ("body", *details["loc"])}
+                for details in error.errors(include_url=False)
+            ],
+            body=body,
+        ) from error
+
+
+def _inline_refs(schema: Any, definitions: dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            name = schema["$ref"].rsplit("/", 1)[-1]
+            return _inline_refs(definitions[name], definitions)
+        return {
+            key: _inline_refs(value, definitions)
+            for key, value in schema.items()
+            if key != "$defs"
+        }
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+def _query_request_openapi() -> dict[str, Any]:
+    schema = query_request_adapter.json_schema()
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": _inline_refs(schema, schema.get("$defs", {}))
+                }
+            },
+        }
+    }
+
+
+# The request body of `/v1/query` in the OpenAPI schema, which FastAPI can't
+# infer when the body is parsed by `parse_query_request`.
+QUERY_REQUEST_OPENAPI = _query_request_openapi()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from common.admission import AdmissionController
+
+
+@pytest.mark.asyncio
+async def test_admits_up_to_max_concurrency():
+    controller = AdmissionController(max_concurrency=2, max_queue=0)
+    first = await controller.acquire()
+    second = await controller.acquire()
+    assert controller.in_flight == 2
+
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire()
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+
+    first.release()
+    first.release()
+    second.release()
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_queued_requests_are_admitted_in_order():
+    controller = AdmissionController(max_concurrency=1, max_queue=2)
+    ticket = await controller.acquire()
+    order = []
+
+    async def wait(name):
+        queued = await controller.acquire()
+        order.append((name, queued.queue_position))
+        queued.release()
+
+    tasks = [asyncio.create_task(wait("a")), asyncio.create_task(wait("b"))]
+    await asyncio.sleep(0)
+    assert controller.queued == 2
+
+    ticket.release()
+    await asyncio.gather(*tasks)
+    assert order == [("a", 1), ("b", 2)]
+    assert controller.stats() | {"wait_time_seconds": 0} == {
+        "in_flight": 0,
+        "queued": 0,
+        "admitted": 3,
+        "rejected": 0,
+        "timed_out": 0,
+        "wait_time_seconds": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_times_out_waiting():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, max_wait=0.01)
+    ticket = await controller.acquire()
+
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire()
+    assert error.value.status_code == 503
+    assert controller.queued == 0
+    assert controller.timed_out == 1
+
+    ticket.release()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=1)
+    ticket = await controller.acquire()
+    task = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert controller.queued == 0
+
+    ticket.release()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_releases_when_stream_ends():
+    controller = AdmissionController(max_concurrency=1)
+    ticket = await controller.acquire()
+
+    async def events():
+        yield {"data": "a"}
+        yield {"data": "b"}
+
+    assert [event async for event in controller.hold(ticket, events())] == [
+        {"data": "a"},
+        {"data": "b"},
+    ]
+    assert controller.in_flight == 0
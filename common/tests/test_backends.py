@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+
+from common.backends import BackendPool, Lease
+from common.disconnect import ClientDisconnected
+
+
+class _StubServer:
+    """A minimal local HTTP server that answers every request with `status`."""
+
+    def __init__(self, status: int = 200):
+        self.status = status
+        self.requests = 0
+
+    async def _handle(self, reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        self.requests += 1
+        writer.write(
+            f"HTTP/1.1 {self.status} Stub\r\nContent-Length: 0\r\n\r\n".encode()
+        )
+        await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def test_routes_to_least_outstanding():
+    pool = BackendPool(["http://a", "http://b/", "http://c"])
+    leases = [pool.lease() for _ in range(3)]
+    assert sorted(lease.backend.url for lease in leases) == [
+        "http://a",
+        "http://b",
+        "http://c",
+    ]
+
+    leases[1].release()
+    assert pool.lease().backend is leases[1].backend
+
+
+def test_ejects_after_consecutive_failures():
+    pool = BackendPool(["http://a", "http://b"], max_failures=2)
+    a, b = pool.backends
+    for _ in range(2):
+        a.outstanding += 1
+        Lease(pool=pool, backend=a).release(failed=True)
+    assert not a.healthy
+    for _ in range(4):
+        lease = pool.lease()
+        assert lease.backend is b
+        lease.release()
+
+    # If every backend is unhealthy, we route across all of them, so `a`
+    # (which hasn't served any requests yet) is picked again.
+    b.healthy = False
+    assert pool.select() is a
+
+
+def test_records_latency_stats():
+    pool = BackendPool(["http://a"])
+    lease = pool.lease()
+    lease.first_token()
+    lease.release()
+    lease.release()
+
+    (stats,) = pool.stats()
+    assert stats["outstanding"] == 0
+    assert stats["requests"] == stats["completed"] == 1
+    assert 0 <= stats["time_to_first_token_seconds"] <= stats["latency_seconds"]
+
+
+@pytest.mark.asyncio
+async def test_health_checks_eject_and_readmit():
+    async with _StubServer() as up, _StubServer(status=503) as down:
+        async with httpx.AsyncClient() as client:
+            pool = BackendPool(
+                [up.url, down.url, "http://127.0.0.1:9"],
+                health_check_interval=0.01,
+                client=client,
+            )
+            async with pool.watch():
+                await asyncio.sleep(0.05)
+                assert [backend.healthy for backend in pool.backends] == [
+                    True,
+                    False,
+                    False,
+                ]
+                assert {pool.lease().backend.url for _ in range(3)} == {up.url}
+
+                down.status = 200
+                await asyncio.sleep(0.05)
+                assert pool.backends[1].healthy
+
+    assert up.requests > 1
+
+
+@pytest.mark.asyncio
+async def test_hold_marks_failed_streams():
+    pool = BackendPool(["http://a"], max_failures=1)
+    lease = pool.lease()
+
+    async def events():
+        yield {"data": "a"}
+        raise httpx.ReadError("upstream went away")
+
+    with pytest.raises(httpx.ReadError):
+        async for _ in pool.hold(lease, events()):
+            pass
+    assert pool.stats()[0]["failures"] == 1
+    assert not pool.backends[0].healthy
+
+
+@pytest.mark.asyncio
+async def test_hold_doesnt_blame_backends_for_disconnects():
+    pool = BackendPool(["http://a"], max_failures=1)
+    lease = pool.lease()
+
+    async def events():
+        yield {"data": "a"}
+        raise ClientDisconnected()
+
+    with pytest.raises(ClientDisconnected):
+        async for _ in pool.hold(lease, events()):
+            pass
+    assert pool.stats()[0]["failures"] == 0
+    assert pool.backends[0].healthy
@@ -0,0 +1,109 @@
+import pytest
+
+from common.cache import ResponseCache, request_key
+from common.models import LlmMessage
+
+EVENTS = [
+    {"event": "copilotMessageChunk", "data": '{"delta":"Hello"}'},
+    {"event": "copilotMessageChunk", "data": '{"delta":" world"}'},
+]
+
+
+def _key(content: str = "Hi there.", **kwargs) -> str:
+    return request_key(
+        model="mistral-large-2407",
+        system_prompt="You are a copilot.",
+        messages=[LlmMessage(role="human", content=content)],
+        **kwargs,
+    )
+
+
+async def _stream(events):
+    for event in events:
+        yield event
+
+
+async def _collect(events) -> list[dict]:
+    return [event async for event in events]
+
+
+def test_key_is_canonical():
+    assert _key() == _key()
+    assert _key("  Hi there.\n") == _key()
+    assert _key("Hi there!") != _key()
+    assert _key(temperature=0.0) != _key(temperature=0.5)
+    assert _key(context="a", widgets="b") != _key(context="ab", widgets="")
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay():
+    cache = ResponseCache()
+    key = _key()
+    assert cache.get(key) is None
+
+    assert await _collect(cache.record(key, _stream(EVENTS))) == EVENTS
+    cached = cache.get(key)
+    assert await _collect(cache.replay(cached)) == EVENTS
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_incomplete_streams_are_not_cached():
+    async def _failing_stream():
+        yield EVENTS[0]
+        raise RuntimeError("Upstream error")
+
+    cache = ResponseCache()
+    with pytest.raises(RuntimeError):
+        await _collect(cache.record(_key(), _failing_stream()))
+    assert len(cache) == 0
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", EVENTS)
+    cache.put("b", EVENTS)
+    cache.get("a")
+    cache.put("c", EVENTS)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    size = sum(len(event["data"]) for event in EVENTS)
+    cache = ResponseCache(max_bytes=size * 2)
+    for key in "abc":
+        cache.put(key, EVENTS)
+    assert len(cache) == 2
+    assert cache.size == size * 2
+    assert cache.get("a") is None
+
+
+def test_ttl_expiry():
+    cache = ResponseCache(ttl=0)
+    cache.put("a", EVENTS)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_non_deterministic_requests_bypass_cache():
+    cache = ResponseCache(max_temperature=0.2)
+    assert cache.is_cacheable(0.0)
+    assert cache.is_cacheable(0.2)
+    assert not cache.is_cacheable(0.7)
+    assert not cache.is_cacheable(None)
+    assert cache.stats()["bypasses"] == 2
+
+
+def test_from_env_only_caches_deterministic_requests(monkeypatch, caplog):
+    assert ResponseCache.from_env(temperature=0.2) is None
+
+    monkeypatch.setenv("COPILOT_RESPONSE_CACHE", "true")
+    cache = ResponseCache.from_env(temperature=0.2)
+    assert not cache.is_cacheable(0.2)
+    assert "never cached" in caplog.text
+    caplog.clear()
+
+    monkeypatch.setenv("COPILOT_RESPONSE_CACHE_MAX_TEMPERATURE", "0.2")
+    cache = ResponseCache.from_env(temperature=0.2)
+    assert cache.is_cacheable(0.2)
+    assert not caplog.records
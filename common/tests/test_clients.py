@@ -0,0 +1,188 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from common import clients
+from common.clients import ChatModelRegistry
+
+
+@pytest.mark.asyncio
+async def test_chat_models_are_reused():
+    registry = ChatModelRegistry()
+    model = registry.get_mistral("mistral-large-2407", api_key="test")
+
+    assert registry.get_mistral("mistral-large-2407", api_key="test") is model
+    assert (
+        registry.get_mistral("mistral-large-2407", api_key="test", temperature=0.5)
+        is not model
+    )
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_chat_models_share_pooled_http_client():
+    registry = ChatModelRegistry(max_connections=7, max_keepalive_connections=3)
+    mistral = registry.get_mistral("mistral-large-2407", api_key="test")
+    openai = registry.get_openai("gpt-4o", api_key="test")
+
+    assert mistral._mistral_openai_chat_model._async_client._client is (
+        registry.http_client
+    )
+    assert openai._async_client._client is registry.http_client
+    assert registry.http_client._transport._pool._max_connections == 7
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_mistral_client_retries_can_be_disabled():
+    registry = ChatModelRegistry()
+    default = registry.get_mistral("mistral-large-2407", api_key="test")
+    no_retries = registry.get_mistral(
+        "mistral-large-2407", api_key="test", max_retries=0
+    )
+
+    assert no_retries is not default
+    assert no_retries._mistral_openai_chat_model._async_client.max_retries == 0
+    assert default._mistral_openai_chat_model._async_client.max_retries > 0
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_aclose_closes_pool():
+    pytest.importorskip("litellm")
+    registry = ChatModelRegistry()
+    http_client = registry.http_client
+    registry.get_litellm("ollama_chat/llama3.1:8b-instruct-q6_K")
+
+    await registry.aclose()
+
+    assert http_client.is_closed
+    assert registry.http_client is not http_client
+
+
+def test_importing_leaves_the_environment_alone():
+    env = {k: v for k, v in os.environ.items() if k != "LITELLM_LOCAL_MODEL_COST_MAP"}
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import os, common.clients; "
+            "print('LITELLM_LOCAL_MODEL_COST_MAP' in os.environ)",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "False"
+
+
+@pytest.mark.asyncio
+async def test_litellm_is_configured_once(monkeypatch):
+    litellm = pytest.importorskip("litellm")
+    monkeypatch.delenv("LITELLM_LOCAL_MODEL_COST_MAP", raising=False)
+    monkeypatch.setattr(litellm, "disable_aiohttp_transport", False)
+    monkeypatch.setattr(litellm, "aclient_session", None)
+    registry = ChatModelRegistry()
+
+    registry.get_litellm("ollama_chat/llama3.1:8b-instruct-q6_K")
+    assert os.environ["LITELLM_LOCAL_MODEL_COST_MAP"] == "True"
+    assert litellm.disable_aiohttp_transport is True
+
+    # Settings changed afterwards are left as they are.
+    litellm.disable_aiohttp_transport = False
+    registry.get_litellm("ollama_chat/llama3.1:70b")
+    assert litellm.disable_aiohttp_transport is False
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_configured_chat_model_follows_magentic_settings(monkeypatch):
+    monkeypatch.setenv("MAGENTIC_BACKEND", "mistral")
+    monkeypatch.setenv("MAGENTIC_MISTRAL_MODEL", "mistral-small-latest")
+    monkeypatch.setenv("MAGENTIC_MISTRAL_API_KEY", "test")
+    registry = ChatModelRegistry()
+    model = registry.get_configured()
+
+    assert model is registry.get_mistral(
+        "mistral-small-latest",
+        api_key="test",
+        base_url=None,
+        max_tokens=None,
+        seed=None,
+        temperature=None,
+    )
+    assert model._mistral_openai_chat_model._async_client._client is (
+        registry.http_client
+    )
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_configured_chat_model_reads_settings_once(monkeypatch):
+    from magentic import settings
+
+    monkeypatch.setenv("MAGENTIC_BACKEND", "openai")
+    monkeypatch.setenv("MAGENTIC_OPENAI_API_KEY", "test")
+    calls = []
+    get_settings = settings.get_settings
+    monkeypatch.setattr(
+        settings, "get_settings", lambda: calls.append(1) or get_settings()
+    )
+    registry = ChatModelRegistry()
+
+    model = registry.get_configured()
+
+    assert registry.get_configured() is model
+    assert len(calls) == 1
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_unsupported_magentic_models_keep_their_own_client(monkeypatch):
+    from magentic import OpenaiChatModel
+
+    class _Model(OpenaiChatModel):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            del self._async_client
+
+    monkeypatch.setattr("magentic.OpenaiChatModel", _Model)
+    registry = ChatModelRegistry()
+
+    model = registry.get_openai("gpt-4o", api_key="test")
+
+    assert isinstance(model, _Model)
+    assert registry.get_openai("gpt-4o", api_key="test") is model
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_warmup_imports_backends_in_background(monkeypatch):
+    monkeypatch.setattr(clients, "BACKEND_MODULES", {"test": ("colorsys",)})
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    monkeypatch.setenv("COPILOT_WARMUP_DELAY", "0")
+    registry = ChatModelRegistry()
+
+    async with registry.warmup("test"):
+        for _ in range(100):
+            if "test" in registry.warmed:
+                break
+            await asyncio.sleep(0.01)
+
+    assert registry.warmed == {"test"}
+    assert "colorsys" in sys.modules
+
+
+@pytest.mark.asyncio
+async def test_warmup_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("COPILOT_WARMUP", "false")
+    registry = ChatModelRegistry()
+
+    async with registry.warmup("litellm"):
+        await asyncio.sleep(0.01)
+
+    assert registry.warmed == set()
@@ -0,0 +1,96 @@
+import json
+from typing import Any
+
+from common.context import ContextBudget, build_context_str, build_widgets_str
+from common.models import DataContent, RawContext, Widget
+
+
+def _context(name: str, content: Any) -> RawContext:
+    return RawContext(
+        uuid="3fa85f64-5717-4562-b3fc-2c963f66afa6",
+        name=name,
+        description=f"The {name} widget",
+        data=DataContent(content=content),
+    )
+
+
+def _widget(name: str) -> Widget:
+    return Widget(
+        uuid="c276369e-e469-4689-b5fe-3f8c76f7c45a",
+        name=name,
+        description=f"The {name} widget",
+    )
+
+
+def test_build_context_str_without_budget():
+    context = [_context("a", "x" * 100), _context("b", "y" * 100)]
+    context_str = build_context_str(context)
+
+    assert context_str.split("\n\n") == [item.model_dump_json() for item in context]
+    assert build_context_str("Some context") == "Some context"
+    assert build_context_str(None) == ""
+
+
+def test_build_context_str_truncates_largest_items_first():
+    small = _context("small", "x" * 100)
+    large = _context("large", "y" * 10_000)
+    context_str = build_context_str([large, small], ContextBudget(max_chars=2_000))
+
+    large_str, small_str = context_str.split("\n\n")
+    assert small_str == small.model_dump_json()
+    assert len(large_str) <= 2_000 - len(small_str)
+    assert json.loads(large_str)["data"]["content"].endswith("characters]")
+
+
+def test_build_context_str_per_item_limit():
+    context_str = build_context_str(
+        [_context("large", "y" * 10_000)], ContextBudget(max_item_chars=500)
+    )
+    assert len(context_str) <= 500
+    assert json.loads(context_str)["name"] == "large"
+
+
+def test_build_context_str_truncates_string_context():
+    context_str = build_context_str("z" * 1_000, ContextBudget.from_tokens(100))
+    assert context_str.startswith("z" * 400)
+    assert context_str.endswith("[truncated 600 characters]")
+
+
+def test_build_widgets_str_omits_widgets_over_budget():
+    widgets = [_widget(str(i)) for i in range(10)]
+    widget_size = len(widgets[0].model_dump_json())
+
+    widgets_str = build_widgets_str(widgets, ContextBudget(max_chars=widget_size * 3))
+
+    parts = widgets_str.split("\n\n")
+    assert parts[:2] == [widgets[0].model_dump_json(), widgets[1].model_dump_json()]
+    assert parts[-1] == "(8 more widgets omitted)"
+
+
+def test_build_context_str_fits_structured_content_within_budget():
+    records = [{"date": f"2024-01-{i % 28 + 1:02d}", "close": i} for i in range(500)]
+    context = [
+        _context("prices", records),
+        _context("quote", {"symbol": "AAPL", "note": 'A "quoted" note\n' * 100}),
+        _context("news", "headline " * 1_000),
+    ]
+
+    for max_chars in (2_000, 8_000):
+        context_str = build_context_str(context, ContextBudget(max_chars=max_chars))
+        assert len(context_str) <= max_chars
+        parts = [json.loads(part) for part in context_str.split("\n\n")]
+        assert parts[0]["name"] == "prices"
+        assert parts[0]["data"]["content"].endswith("characters]")
+
+
+def test_build_widgets_str_notes_widgets_over_item_limit():
+    widgets = [_widget("a"), _widget("b" * 1_000), _widget("c")]
+    widget_size = len(widgets[0].model_dump_json())
+
+    widgets_str = build_widgets_str(widgets, ContextBudget(max_item_chars=widget_size))
+
+    assert widgets_str.split("\n\n") == [
+        widgets[0].model_dump_json(),
+        widgets[2].model_dump_json(),
+        "(1 more widgets omitted)",
+    ]
@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from common.descriptor import CombinedDescriptor, CopilotDescriptor
+
+
+def _make_client(descriptor: CopilotDescriptor) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/copilots.json")
+    def get_copilot_description(request: Request):
+        return descriptor.response(request)
+
+    return TestClient(app)
+
+
+def test_descriptor_is_served_with_etag(tmp_path):
+    path = tmp_path / "copilots.json"
+    path.write_text(json.dumps({"copilot": {"name": "Copilot"}}, indent=4))
+    test_client = _make_client(CopilotDescriptor(path))
+
+    response = test_client.get("/copilots.json")
+
+    assert response.status_code == 200
+    assert response.json() == {"copilot": {"name": "Copilot"}}
+    assert response.headers["etag"].startswith('"')
+    assert "max-age" in response.headers["cache-control"]
+
+
+def test_descriptor_overrides(tmp_path):
+    path = tmp_path / "copilots.json"
+    path.write_text(json.dumps({"copilot": {"name": "Copilot", "hasDocuments": False}}))
+    descriptor = CopilotDescriptor(path, overrides={"hasDocuments": True})
+
+    assert descriptor.content == {"copilot": {"name": "Copilot", "hasDocuments": True}}
+
+
+def test_descriptor_not_modified(tmp_path):
+    path = tmp_path / "copilots.json"
+    path.write_text(json.dumps({"copilot": {"name": "Copilot"}}))
+    test_client = _make_client(CopilotDescriptor(path))
+    etag = test_client.get("/copilots.json").headers["etag"]
+
+    response = test_client.get("/copilots.json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = test_client.get(
+        "/copilots.json", headers={"If-None-Match": '"stale", W/' + etag}
+    )
+    assert response.status_code == 304
+
+    response = test_client.get("/copilots.json", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_descriptor_reload_if_changed(tmp_path):
+    path = tmp_path / "copilots.json"
+    path.write_text(json.dumps({"copilot": {"name": "Copilot"}}))
+    descriptor = CopilotDescriptor(path)
+    etag = descriptor.etag
+
+    assert not descriptor.reload_if_changed()
+
+    path.write_text(json.dumps({"copilot": {"name": "Renamed Copilot"}}))
+    assert descriptor.reload_if_changed()
+    assert descriptor.etag != etag
+    assert json.loads(descriptor.body) == {"copilot": {"name": "Renamed Copilot"}}
+
+
+@pytest.mark.asyncio
+async def test_descriptor_watch_reloads(tmp_path):
+    path = tmp_path / "copilots.json"
+    path.write_text(json.dumps({"copilot": {"name": "Copilot"}}))
+    descriptor = CopilotDescriptor(path, reload=True, reload_interval=0.01)
+
+    async with descriptor.watch():
+        path.write_text(json.dumps({"copilot": {"name": "Renamed Copilot"}}))
+        await asyncio.sleep(0.1)
+
+    assert json.loads(descriptor.body) == {"copilot": {"name": "Renamed Copilot"}}
+
+
+def test_combined_descriptor(tmp_path):
+    descriptors = {}
+    for name in ("first", "second"):
+        path = tmp_path / f"{name}.json"
+        path.write_text(
+            json.dumps(
+                {
+                    "example_copilot": {
+                        "name": name,
+                        "endpoints": {"query": "http://localhost:7777/v1/query"},
+                    }
+                }
+            )
+        )
+        descriptors[name] = CopilotDescriptor(path)
+    combined = CombinedDescriptor(descriptors, base_url="https://copilots.example/")
+    test_client = _make_client(combined)
+
+    response = test_client.get("/copilots.json")
+    assert response.json() == {
+        "first_copilot": {
+            "name": "first",
+            "endpoints": {"query": "https://copilots.example/first/v1/query"},
+        },
+        "second_copilot": {
+            "name": "second",
+            "endpoints": {"query": "https://copilots.example/second/v1/query"},
+        },
+    }
+
+    # Reloading one of the copilots' descriptors updates the combined one.
+    descriptors["second"]._set({"example_copilot": {"name": "changed"}})
+    response = test_client.get(
+        "/copilots.json", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 200
+    assert response.json()["second_copilot"] == {"name": "changed", "endpoints": {}}
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from common.disconnect import ClientDisconnected, DisconnectWatcher
+
+
+class _Client:
+    """A request whose client can be disconnected."""
+
+    def __init__(self):
+        self.disconnected = asyncio.Event()
+        self.request = Request({"type": "http", "method": "POST"}, self.receive)
+
+    async def receive(self) -> dict:
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+
+class _Upstream:
+    def __init__(self, tokens: int, delay: float = 0.01):
+        self.tokens = tokens
+        self.delay = delay
+        self.sent = 0
+        self.closed = False
+
+    async def stream(self):
+        try:
+            for i in range(self.tokens):
+                await asyncio.sleep(self.delay)
+                self.sent += 1
+                yield f"{i} "
+        finally:
+            self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_streams_chunks_through():
+    watcher = DisconnectWatcher()
+    upstream = _Upstream(5)
+
+    chunks = [
+        chunk async for chunk in watcher.stream(_Client().request, upstream.stream())
+    ]
+
+    assert chunks == ["0 ", "1 ", "2 ", "3 ", "4 "]
+    assert watcher.stats() == {
+        "cancelled": 0,
+        "cancelled_before_first_token": 0,
+        "tokens_saved": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_an_idle_stream():
+    watcher = DisconnectWatcher()
+    client = _Client()
+    upstream = _Upstream(100)
+
+    chunks = watcher.stream(client.request, upstream.stream())
+    assert await chunks.__anext__() == "0 "
+    # The response isn't asking for chunks (eg. it's waiting on a slow client)
+    # when the client disconnects.
+    client.disconnected.set()
+    await asyncio.sleep(0.05)
+
+    assert upstream.closed
+    assert upstream.sent < 5
+    assert watcher.stats()["cancelled"] == 1
+    with pytest.raises(ClientDisconnected):
+        await chunks.__anext__()
+
+
+@pytest.mark.asyncio
+async def test_cancelling_the_response_cancels_the_stream():
+    watcher = DisconnectWatcher()
+    upstream = _Upstream(100)
+
+    async def respond():
+        async for _ in watcher.stream(_Client().request, upstream.stream()):
+            pass
+
+    response = asyncio.create_task(respond())
+    await asyncio.sleep(0.05)
+    response.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await response
+    await asyncio.sleep(0.01)
+
+    assert upstream.closed
+    assert upstream.sent < 10
+    assert watcher.stats()["cancelled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_estimates_tokens_saved_from_completed_responses():
+    watcher = DisconnectWatcher()
+    async for _ in watcher.stream(_Client().request, _Upstream(10, delay=0).stream()):
+        pass
+
+    client = _Client()
+    chunks = watcher.stream(client.request, _Upstream(10).stream())
+    for _ in range(3):
+        await chunks.__anext__()
+    client.disconnected.set()
+    await asyncio.sleep(0.05)
+
+    assert watcher.stats()["tokens_saved"] == 7
+
+
+@pytest.mark.asyncio
+async def test_first_cancels_the_upstream_if_the_client_disconnects():
+    watcher = DisconnectWatcher()
+    client = _Client()
+    cancelled = False
+
+    async def first_token():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    asyncio.get_running_loop().call_later(0.01, client.disconnected.set)
+    with pytest.raises(ClientDisconnected) as error:
+        await watcher.first(client.request, first_token())
+    await asyncio.sleep(0)
+
+    assert error.value.status_code == 499
+    assert cancelled
+    assert watcher.stats()["cancelled_before_first_token"] == 1
+
+
+@pytest.mark.asyncio
+async def test_first_returns_the_result():
+    watcher = DisconnectWatcher()
+
+    async def first_token():
+        return "Hello"
+
+    assert await watcher.first(_Client().request, first_token()) == "Hello"
+    assert watcher.stats()["cancelled"] == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_watcher_passes_through():
+    watcher = DisconnectWatcher(enabled=False)
+    chunks = _Upstream(1).stream()
+
+    assert watcher.stream(_Client().request, chunks) is chunks
@@ -0,0 +1,254 @@
+import importlib.util
+import sys
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.documents import (
+    DocumentChunk,
+    DocumentStore,
+    add_document_routes,
+    build_documents_str,
+    chunk_text,
+    extract_text,
+)
+
+REPORTS = {
+    "earnings.txt": "Revenue grew 12% year over year, driven by cloud services. "
+    "Operating margin expanded to 31%.",
+    "outlook.txt": "Management expects capital expenditure to rise next year, "
+    "as new data centres are built.",
+    "risks.txt": "Currency fluctuations and supply chain disruption remain the "
+    "main risks to the forecast.",
+}
+
+requires_numpy = pytest.mark.skipif(
+    importlib.util.find_spec("numpy") is None, reason="numpy isn't installed"
+)
+
+
+def test_chunk_text_overlaps_chunks():
+    text = " ".join(f"word{i}" for i in range(10))
+
+    chunks = chunk_text(text, chunk_words=4, overlap_words=1)
+
+    assert chunks == [
+        "word0 word1 word2 word3",
+        "word3 word4 word5 word6",
+        "word6 word7 word8 word9",
+    ]
+    assert chunk_text("", chunk_words=4) == []
+
+
+@requires_numpy
+def test_search_ranks_relevant_chunks_first(tmp_path):
+    store = DocumentStore(tmp_path, top_k=2)
+    assert store.add(REPORTS) == 3
+
+    results = store.search("What are the risks to the forecast?")
+
+    assert [result.document for result in results][0] == "risks.txt"
+    assert len(results) == 2
+    assert store.search("cryptocurrency") == []
+
+
+@requires_numpy
+def test_adding_documents_is_incremental(tmp_path):
+    store = DocumentStore(tmp_path)
+    store.add({"earnings.txt": REPORTS["earnings.txt"]})
+
+    assert store.add(REPORTS) == 2
+    assert store.add(REPORTS) == 0
+    assert store.stats() == {
+        "documents": 3,
+        "chunks": 3,
+        "segments": 2,
+        "searches": 0,
+    }
+
+
+@requires_numpy
+def test_replacing_a_document(tmp_path):
+    store = DocumentStore(tmp_path)
+    store.add(REPORTS)
+
+    store.add({"outlook.txt": "Management expects margins to stay flat."})
+
+    [result] = store.search("capital expenditure margins")
+    assert result.document == "outlook.txt"
+    assert result.text == "Management expects margins to stay flat."
+
+
+@requires_numpy
+def test_removing_a_document(tmp_path):
+    store = DocumentStore(tmp_path)
+    store.add(REPORTS)
+
+    assert store.remove("risks.txt")
+    assert not store.remove("risks.txt")
+    assert store.search("supply chain risks") == []
+    assert store.documents() == ["earnings.txt", "outlook.txt"]
+
+
+@requires_numpy
+def test_reloads_without_reingesting(tmp_path):
+    DocumentStore(tmp_path).add(REPORTS)
+
+    store = DocumentStore(tmp_path)
+
+    assert store.documents() == list(REPORTS)
+    assert store.search("cloud revenue")[0].document == "earnings.txt"
+
+
+@requires_numpy
+def test_picks_up_changes_from_another_store(tmp_path):
+    reader = DocumentStore(tmp_path)
+    DocumentStore(tmp_path).add(REPORTS)
+
+    assert reader.search("cloud revenue")[0].document == "earnings.txt"
+
+
+@requires_numpy
+def test_merges_segments(tmp_path):
+    store = DocumentStore(tmp_path, max_segments=2)
+    for name, text in REPORTS.items():
+        store.add({name: text})
+    store.remove("outlook.txt")
+
+    assert store.stats()["segments"] == 1
+    store.merge()
+
+    assert [path.name for path in tmp_path.iterdir() if path.is_dir()] == [
+        "segment-00000004"
+    ]
+    assert store.stats()["chunks"] == 2
+    assert store.search("cloud revenue")[0].document == "earnings.txt"
+    assert store.search("data centres") == []
+
+
+@requires_numpy
+def test_searches_while_documents_are_added(tmp_path):
+    store = DocumentStore(tmp_path, max_segments=2)
+    store.add({"earnings.txt": REPORTS["earnings.txt"]})
+    errors = []
+
+    def search():
+        for _ in range(50):
+            try:
+                assert store.search("cloud revenue")[0].document == "earnings.txt"
+            except Exception as error:
+                errors.append(error)
+
+    searcher = threading.Thread(target=search)
+    searcher.start()
+    for i in range(20):
+        store.add({f"report-{i}.txt": f"Report {i} on margins."})
+    searcher.join()
+
+    assert errors == []
+    assert store.stats()["documents"] == 21
+
+
+@requires_numpy
+def test_recovers_from_an_interrupted_write(tmp_path):
+    store = DocumentStore(tmp_path)
+    store.add({"earnings.txt": REPORTS["earnings.txt"]})
+    # A segment, and a partly written one, that never made it to the manifest.
+    (tmp_path / "segment-00000001").mkdir()
+    (tmp_path / "segment-00000001" / "terms.txt").write_text("revenue")
+    (tmp_path / "segment-00000002.partial").mkdir()
+
+    assert store.add({"risks.txt": REPORTS["risks.txt"]}) == 1
+    assert store.search("currency")[0].document == "risks.txt"
+
+    DocumentStore(tmp_path)
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_dir()) == [
+        "segment-00000000",
+        "segment-00000002",
+    ]
+
+
+def _pdf(text: str) -> bytes:
+    """A one page PDF showing `text`."""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    return pdf + b"startxref\n%d\n%%%%EOF\n" % xref
+
+
+def test_extract_text_from_pdf():
+    pytest.importorskip("pypdf")
+
+    assert extract_text("report.pdf", _pdf("Revenue grew 12%.")) == "Revenue grew 12%."
+    with pytest.raises(ValueError, match="report.pdf"):
+        extract_text("report.pdf", b"not a pdf")
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("pypdf") is not None, reason="pypdf is installed"
+)
+def test_pdfs_need_pypdf():
+    with pytest.raises(ValueError, match="pypdf"):
+        extract_text("report.pdf", b"%PDF-1.7")
+
+
+def test_build_documents_str():
+    chunks = [
+        DocumentChunk(document="earnings.txt", text="Revenue grew.", score=2.0),
+        DocumentChunk(document="risks.txt", text="Currency risk.", score=1.0),
+    ]
+
+    assert build_documents_str(chunks) == (
+        "### earnings.txt\nRevenue grew.\n\n### risks.txt\nCurrency risk."
+    )
+
+
+@requires_numpy
+def test_document_routes(tmp_path):
+    store = DocumentStore(tmp_path)
+    app = FastAPI()
+    add_document_routes(app, store)
+    client = TestClient(app)
+
+    response = client.put("/v1/documents/risks.txt", content=REPORTS["risks.txt"])
+    assert response.json() == {"document": "risks.txt", "chunks": 1}
+    assert client.get("/v1/documents").json() == ["risks.txt"]
+    assert client.delete("/v1/documents/risks.txt").status_code == 200
+    assert client.delete("/v1/documents/risks.txt").status_code == 404
+
+
+@requires_numpy
+def test_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("COPILOT_DOCUMENTS_DIR", raising=False)
+    assert DocumentStore.from_env() is None
+
+    monkeypatch.setenv("COPILOT_DOCUMENTS_DIR", str(tmp_path))
+    monkeypatch.setenv("COPILOT_DOCUMENTS_TOP_K", "3")
+    store = DocumentStore.from_env()
+    assert store.top_k == 3
+    # Copilots in the same process share the store.
+    assert DocumentStore.from_env() is store
+
+
+def test_from_env_without_numpy(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setenv("COPILOT_DOCUMENTS_DIR", str(tmp_path))
+
+    assert DocumentStore.from_env() is None
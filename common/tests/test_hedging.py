@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from common.hedging import Hedging
+
+
+class _Backend:
+    """A stub backend that responds after `latency` seconds."""
+
+    def __init__(self, name: str, latency: float, error: Exception | None = None):
+        self.name = name
+        self.latency = latency
+        self.error = error
+        self.cancelled = False
+
+    async def respond(self) -> str:
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+@pytest.mark.asyncio
+async def test_fast_requests_arent_hedged():
+    hedging = Hedging(delay=0.05)
+    primary, hedge = _Backend("primary", 0), _Backend("hedge", 0)
+
+    assert await hedging.first(primary.respond, hedge.respond) == "primary"
+    assert hedging.stats() == {
+        "requests": 1,
+        "fired": 0,
+        "primary_wins": 0,
+        "hedge_wins": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_slow_requests_are_hedged():
+    hedging = Hedging(delay=0.02)
+    primary, hedge = _Backend("primary", 1), _Backend("hedge", 0.01)
+
+    assert await hedging.first(primary.respond, hedge.respond) == "hedge"
+    await asyncio.sleep(0)
+    assert primary.cancelled
+    assert hedging.stats()["fired"] == 1
+    assert hedging.stats()["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_primary_can_still_win_once_hedged():
+    hedging = Hedging(delay=0.02)
+    primary, hedge = _Backend("primary", 0.04), _Backend("hedge", 1)
+
+    assert await hedging.first(primary.respond, hedge.respond) == "primary"
+    await asyncio.sleep(0)
+    assert hedge.cancelled
+    assert hedging.stats()["fired"] == 1
+    assert hedging.stats()["primary_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_the_other_request_if_one_fails():
+    hedging = Hedging(delay=0.01)
+    primary = _Backend("primary", 0.02, error=RuntimeError("primary failed"))
+    hedge = _Backend("hedge", 0.05)
+
+    assert await hedging.first(primary.respond, hedge.respond) == "hedge"
+
+
+@pytest.mark.asyncio
+async def test_raises_the_primary_error_if_both_fail():
+    hedging = Hedging(delay=0.01)
+    primary = _Backend("primary", 0.02, error=RuntimeError("primary failed"))
+    hedge = _Backend("hedge", 0.01, error=RuntimeError("hedge failed"))
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        await hedging.first(primary.respond, hedge.respond)
+
+
+@pytest.mark.asyncio
+async def test_errors_before_the_hedge_fires_are_raised():
+    hedging = Hedging(delay=1)
+    primary = _Backend("primary", 0, error=RuntimeError("primary failed"))
+    hedge = _Backend("hedge", 0)
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        await hedging.first(primary.respond, hedge.respond)
+    assert hedging.stats()["fired"] == 0
+
+
+@pytest.mark.asyncio
+async def test_closes_a_losing_stream_that_responded_at_the_same_time():
+    hedging = Hedging(delay=0.01)
+    both_ready = asyncio.Event()
+    closed = []
+
+    async def stream(name: str):
+        try:
+            yield f"{name} "
+            await asyncio.sleep(1)
+            yield "never sent"
+        finally:
+            closed.append(name)
+
+    def side(name: str):
+        async def respond():
+            await both_ready.wait()
+            return stream(name)
+
+        return respond
+
+    asyncio.get_running_loop().call_later(0.02, both_ready.set)
+    response = await hedging.first(side("primary"), side("hedge"))
+    await asyncio.sleep(0)
+
+    assert [chunk async for chunk in response][:1] == ["primary "]
+    assert closed[0] == "hedge"
+
+
+@pytest.mark.asyncio
+async def test_cancelling_cancels_both_requests():
+    hedging = Hedging(delay=0.01)
+    primary, hedge = _Backend("primary", 1), _Backend("hedge", 1)
+
+    request = asyncio.ensure_future(hedging.first(primary.respond, hedge.respond))
+    await asyncio.sleep(0.02)
+    request.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await request
+    await asyncio.sleep(0)
+
+    assert primary.cancelled and hedge.cancelled
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("COPILOT_HEDGE_AFTER_MS", raising=False)
+    assert Hedging.from_env() is None
+
+    monkeypatch.setenv("COPILOT_HEDGE_AFTER_MS", "250")
+    assert Hedging.from_env().delay == 0.25
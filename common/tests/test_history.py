@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+from common.history import HistoryBudget, TokenCounter, trim_history
+from common.models import AgentQueryRequest
+
+
+def _messages(payload: list[dict]):
+    return AgentQueryRequest(messages=payload).messages
+
+
+def _conversation(turns: int) -> list[dict]:
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "human", "content": f"question {i} " * 10})
+        messages.append({"role": "ai", "content": f"answer {i} " * 10})
+    messages.append({"role": "human", "content": "latest question"})
+    return messages
+
+
+def test_unlimited_budget_keeps_everything():
+    messages = _messages(_conversation(10))
+    assert trim_history(messages, HistoryBudget(), TokenCounter("test")) == messages
+
+
+def test_drops_oldest_turns():
+    messages = _messages(_conversation(10))
+    counter = TokenCounter("test", tokenizer="chars")
+    per_turn = counter.message_tokens(messages[0]) + counter.message_tokens(messages[1])
+
+    trimmed = trim_history(
+        messages, HistoryBudget(max_tokens=3 * per_turn + 10), counter
+    )
+    assert trimmed == messages[-7:]
+    assert trimmed[0].role == "human"
+
+
+def test_always_keeps_latest_turn():
+    messages = _messages(_conversation(2))
+    trimmed = trim_history(
+        messages, HistoryBudget(max_tokens=1), TokenCounter("test", tokenizer="chars")
+    )
+    assert trimmed == messages[-1:]
+
+
+def test_keeps_function_calls_with_their_turn():
+    function_call = (
+        '{"function": "get_widget_data", "input_arguments": {"widget_uuid": "1"}}'
+    )
+    messages = _messages(
+        [
+            *_conversation(3)[:-1],
+            {"role": "human", "content": "what is the weather?"},
+            {"role": "ai", "content": function_call},
+            {
+                "role": "tool",
+                "function": "get_widget_data",
+                "input_arguments": {"widget_uuid": "1"},
+                "content": "sunny " * 50,
+            },
+        ]
+    )
+    counter = TokenCounter("test", tokenizer="chars")
+    latest_turn = sum(counter.message_tokens(message) for message in messages[-3:])
+
+    trimmed = trim_history(messages, HistoryBudget(max_tokens=latest_turn), counter)
+    assert trimmed == messages[-3:]
+
+
+def test_token_counts_are_memoized():
+    counter = TokenCounter("test", tokenizer="chars")
+    messages = _messages(_conversation(5))
+    for _ in range(3):
+        trim_history(messages, HistoryBudget(max_tokens=10_000), counter)
+    info = counter.count.cache_info()
+    assert info.misses == len({message.content for message in messages})
+    assert info.hits == 2 * len(messages) + len(messages) - info.misses
+
+
+def test_falls_back_to_estimate_without_tiktoken(monkeypatch):
+    import sys
+
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    counter = TokenCounter("gpt-4o")
+    assert counter.count("x" * 40) == 10
+
+
+@pytest.mark.asyncio
+async def test_warmup_loads_encoding_in_background(monkeypatch):
+    loaded = threading.Event()
+    release = threading.Event()
+    counter = TokenCounter("gpt-4o")
+
+    def _load_encoding():
+        loaded.set()
+        release.wait(5)
+        counter._encode = lambda text: text.split()
+
+    monkeypatch.setattr(counter, "_load_encoding", _load_encoding)
+
+    async with counter.warmup():
+        await asyncio.to_thread(loaded.wait, 5)
+        # The event loop isn't blocked, and counts are estimated meanwhile.
+        assert counter.count("a b " * 10) == 10
+        release.set()
+        # Once loaded, the estimated counts are dropped.
+        for _ in range(100):
+            if counter.count("a b " * 10) == 20:
+                break
+            await asyncio.sleep(0.01)
+        assert counter.count("a b " * 10) == 20
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from common.metrics import Histogram, Metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", ("copilot",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "test")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{copilot="test",le="0.1"} 1',
+        'latency_seconds_bucket{copilot="test",le="1.0"} 3',
+        'latency_seconds_bucket{copilot="test",le="+Inf"} 4',
+        'latency_seconds_sum{copilot="test"} 6.05',
+        'latency_seconds_count{copilot="test"} 4',
+    ]
+
+
+def test_disabled_metrics_are_no_ops():
+    metrics = Metrics(enabled=False)
+    chunks = object()
+    with metrics.stage("test", "validation"):
+        pass
+    assert metrics.track_stream("test", chunks, 0.0) is chunks
+    assert metrics.stage_seconds.count("test", "validation") == 0
+    assert metrics.response().status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_track_stream():
+    metrics = Metrics()
+
+    async def chunks():
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    received_at = metrics.request_started("test", Request({"type": "http"}))
+    stream = metrics.track_stream("test", chunks(), received_at)
+    assert [chunk async for chunk in stream] == ["a", "b", "c"]
+
+    assert metrics.time_to_first_token.count("test") == 1
+    assert metrics.tokens_per_second.count("test") == 1
+    assert metrics.stage_seconds.count("test", "streaming") == 1
+    assert metrics.tokens.value("test") == 3
+    assert metrics.streams_in_flight.value("test") == 0
+
+
+def test_metrics_endpoint():
+    metrics = Metrics()
+    app = FastAPI()
+    metrics.instrument(app)
+    metrics.register_stats(
+        "copilot_backend",
+        "test",
+        lambda: [{"url": "http://a", "healthy": True, "outstanding": 2}],
+    )
+
+    @app.post("/v1/query")
+    def query(request: Request):
+        metrics.request_started("test", request)
+        with metrics.stage("test", "message_conversion"):
+            pass
+
+    @app.get("/metrics")
+    def get_metrics():
+        return metrics.response()
+
+    client = TestClient(app)
+    client.post("/v1/query")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'copilot_stage_seconds_count{copilot="test",stage="validation"} 1'
+        in response.text
+    )
+    assert (
+        'copilot_stage_seconds_count{copilot="test",stage="message_conversion"} 1'
+        in response.text
+    )
+    assert 'copilot_backend_healthy{copilot="test",url="http://a"} 1.0' in response.text
+    assert (
+        'copilot_backend_outstanding{copilot="test",url="http://a"} 2.0'
+        in response.text
+    )
@@ -0,0 +1,50 @@
+import json
+from unittest.mock import patch
+
+from common.messages import user_message
+from common.models import LlmFunctionCall, LlmMessage
+
+FUNCTION_CALL = {
+    "function": "get_widget_data",
+    "input_arguments": {"widget_uuid": "ff6368ec-a397-4baf-9f5a-fecd9fd797a3"},
+}
+
+
+def test_parse_content_function_call():
+    message = LlmMessage(role="ai", content=json.dumps(FUNCTION_CALL))
+    assert message.content == LlmFunctionCall(**FUNCTION_CALL)
+
+
+def test_parse_content_string_encoded_function_call():
+    content = json.dumps(json.dumps(FUNCTION_CALL))
+    message = LlmMessage(role="ai", content=content)
+    assert message.content == LlmFunctionCall(**FUNCTION_CALL)
+
+
+def test_parse_content_plain_string_skips_json_decoding():
+    with patch("common.models.loads") as mock_loads:
+        message = LlmMessage(role="human", content="What is the weather?")
+
+    assert message.content == "What is the weather?"
+    mock_loads.assert_not_called()
+
+
+def test_parse_content_json_that_is_not_a_function_call():
+    content = '{"not": "a function call"}'
+    assert LlmMessage(role="human", content=content).content == content
+
+
+def test_parse_content_is_memoized():
+    content = json.dumps({**FUNCTION_CALL, "input_arguments": {"widget_uuid": "1"}})
+    first = LlmMessage(role="ai", content=content)
+
+    with patch("common.models.loads") as mock_loads:
+        second = LlmMessage(role="ai", content=content)
+
+    assert second.content is first.content
+    mock_loads.assert_not_called()
+
+
+def test_user_message_is_memoized():
+    assert user_message("Hi there.") is user_message("Hi there.")
+    assert user_message("Hi there.").content == "Hi there."
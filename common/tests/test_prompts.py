@@ -0,0 +1,44 @@
+import pytest
+from magentic import AsyncStreamedStr, UserMessage
+
+from common.prompts import ChatPrompt
+from common.testing import FakeChatModel
+
+TEMPLATE = "Widgets:\n{widgets}\n\nContext:\n{context}\n"
+
+
+def test_system_message_matches_format():
+    prompt = ChatPrompt(TEMPLATE, output_types=[AsyncStreamedStr])
+    kwargs = {"widgets": '{"uuid": "1"}', "context": "{not a field}"}
+
+    assert prompt.system_message(**kwargs).content == TEMPLATE.format(**kwargs)
+
+
+def test_system_message_is_cached():
+    prompt = ChatPrompt(TEMPLATE, output_types=[AsyncStreamedStr], cache_size=2)
+    message = prompt.system_message(widgets="a", context="b")
+
+    assert prompt.system_message(widgets="a", context="b") is message
+    assert prompt.system_message(widgets="ab", context="") is not message
+
+    prompt.system_message(widgets="c", context="d")
+    prompt.system_message(widgets="e", context="f")
+    assert prompt.system_message(widgets="a", context="b") is not message
+
+
+def test_system_message_missing_arguments():
+    prompt = ChatPrompt(TEMPLATE, output_types=[AsyncStreamedStr])
+    with pytest.raises(TypeError, match="context"):
+        prompt.system_message(widgets="a")
+
+
+@pytest.mark.asyncio
+async def test_chat_messages_are_passed_verbatim():
+    prompt = ChatPrompt(TEMPLATE, output_types=[AsyncStreamedStr])
+    model = FakeChatModel(["Hi!"])
+    chat_messages = [UserMessage('What is {"a": 1}?')]
+
+    content = await prompt(chat_messages, model=model, widgets="", context="")
+
+    assert await content.to_string() == "Hi!"
+    assert model.messages[1:] == chat_messages
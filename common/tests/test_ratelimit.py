@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from common.ratelimit import RateLimiter
+
+
+async def _timed(awaitable) -> float:
+    start = time.monotonic()
+    await awaitable
+    return time.monotonic() - start
+
+
+@pytest.mark.asyncio
+async def test_bursts_are_paced_to_the_requests_quota():
+    limiter = RateLimiter(requests_per_second=100, burst=0.01)
+
+    elapsed = await _timed(
+        asyncio.gather(*(limiter.acquire("model") for _ in range(5)))
+    )
+
+    assert elapsed >= 0.035
+    assert limiter.stats()["requests"] == 5
+    assert limiter.stats()["throttled"] == 4
+
+
+@pytest.mark.asyncio
+async def test_prompts_are_paced_to_the_tokens_quota():
+    # 100 tokens per second, with room for 10 at once.
+    limiter = RateLimiter(tokens_per_minute=6_000, burst=0.1)
+
+    assert await _timed(limiter.acquire("model", tokens=10)) < 0.02
+    assert await _timed(limiter.acquire("model", tokens=5)) >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_completion_tokens_are_charged_after_streaming():
+    limiter = RateLimiter(tokens_per_minute=6_000, burst=0.1)
+
+    async def chunks():
+        for i in range(10):
+            yield f"token{i}"
+
+    streamed = [chunk async for chunk in limiter.metered("model", chunks())]
+
+    assert len(streamed) == 10
+    assert await _timed(limiter.acquire("model", tokens=5)) >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_streams_stopped_early_are_charged_what_they_used():
+    limiter = RateLimiter(tokens_per_minute=6_000, burst=0.1)
+
+    async def chunks():
+        for i in range(10):
+            yield f"token{i}"
+
+    stream = limiter.metered("model", chunks())
+    assert await stream.__anext__() == "token0"
+    await stream.aclose()
+
+    request_bucket, token_bucket = limiter._model_buckets("model")
+    assert request_bucket is None
+    assert token_bucket.available == pytest.approx(9, abs=0.5)
+
+
+@pytest.mark.asyncio
+async def test_models_have_separate_quotas():
+    limiter = RateLimiter(requests_per_second=1)
+    await limiter.acquire("model")
+
+    assert await _timed(limiter.acquire("other-model")) < 0.02
+    assert limiter.stats()["throttled"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelling_a_throttled_request_lets_the_next_one_go():
+    limiter = RateLimiter(requests_per_second=10, burst=0.1)
+    await limiter.acquire("model")
+    waiting = asyncio.ensure_future(limiter.acquire("model"))
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+
+    assert await _timed(limiter.acquire("model")) < 0.15
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("COPILOT_RATE_LIMIT_RPS", raising=False)
+    monkeypatch.delenv("COPILOT_RATE_LIMIT_TPM", raising=False)
+    assert RateLimiter.from_env() is None
+
+    monkeypatch.setenv("COPILOT_RATE_LIMIT_TPM", "500000")
+    limiter = RateLimiter.from_env()
+    assert limiter.requests_per_second is None
+    assert limiter.tokens_per_minute == 500_000
+    assert limiter.burst == 1.0
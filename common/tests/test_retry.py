@@ -0,0 +1,115 @@
+import httpx
+import pytest
+
+from common.retry import RetryPolicy
+
+
+class _UpstreamError(Exception):
+    """An error like openai's `APIStatusError`, with the response attached."""
+
+    def __init__(self, status_code: int, headers: dict | None = None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers=headers)
+
+
+class _Upstream:
+    """A stub upstream that fails with each of `errors` before succeeding."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def request(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "first token"
+
+
+@pytest.mark.asyncio
+async def test_retries_rate_limits_and_server_errors():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+    upstream = _Upstream(_UpstreamError(429), _UpstreamError(503))
+
+    assert await policy.call(upstream.request) == "first token"
+    assert upstream.calls == 3
+    assert policy.stats() == {"retries": 2, "exhausted": 0}
+
+
+@pytest.mark.asyncio
+async def test_retries_timeouts_and_conflicts():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+    upstream = _Upstream(_UpstreamError(408), _UpstreamError(409))
+
+    assert await policy.call(upstream.request) == "first token"
+    assert upstream.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_retries_connection_errors_and_timeouts():
+    openai = pytest.importorskip("openai")
+    request = httpx.Request("POST", "https://api.mistral.ai/v1/chat/completions")
+    policy = RetryPolicy(max_attempts=5, base_delay=0.001)
+    upstream = _Upstream(
+        httpx.ConnectError("Connection refused", request=request),
+        httpx.ReadTimeout("Timed out", request=request),
+        openai.APIConnectionError(request=request),
+        openai.APITimeoutError(request=request),
+    )
+
+    assert await policy.call(upstream.request) == "first token"
+    assert upstream.calls == 5
+    assert policy.stats() == {"retries": 4, "exhausted": 0}
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts():
+    policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+    upstream = _Upstream(*(_UpstreamError(500) for _ in range(3)))
+
+    with pytest.raises(_UpstreamError):
+        await policy.call(upstream.request)
+    assert upstream.calls == 2
+    assert policy.stats() == {"retries": 1, "exhausted": 1}
+
+
+@pytest.mark.asyncio
+async def test_doesnt_retry_client_errors():
+    policy = RetryPolicy(base_delay=0.001)
+    upstream = _Upstream(_UpstreamError(400), ValueError("not an HTTP error"))
+
+    with pytest.raises(_UpstreamError):
+        await policy.call(upstream.request)
+    with pytest.raises(ValueError):
+        await policy.call(upstream.request)
+    assert policy.stats()["retries"] == 0
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=4)
+    error = _UpstreamError(429)
+
+    delays = [policy.backoff(1, error) for _ in range(100)]
+    assert all(0 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+    assert all(0 <= policy.backoff(8, error) <= 4 for _ in range(100))
+
+
+def test_backoff_respects_retry_after():
+    policy = RetryPolicy(max_delay=8)
+
+    assert policy.backoff(1, _UpstreamError(429, {"Retry-After": "2"})) == 2
+    # Waiting longer than `max_delay` would only stall the response.
+    assert policy.backoff(1, _UpstreamError(429, {"Retry-After": "60"})) is None
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("COPILOT_RETRY_MAX_ATTEMPTS", raising=False)
+    assert RetryPolicy.from_env() is None
+
+    monkeypatch.setenv("COPILOT_RETRY_MAX_ATTEMPTS", "1")
+    assert RetryPolicy.from_env() is None
+
+    monkeypatch.setenv("COPILOT_RETRY_MAX_ATTEMPTS", "3")
+    assert RetryPolicy.from_env().max_attempts == 3
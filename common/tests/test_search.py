@@ -0,0 +1,89 @@
+from common.models import AgentQueryRequest, Widget
+from common.search import BM25Index, WidgetSelector, latest_query, tokenize
+
+
+def _widgets(count: int) -> list[Widget]:
+    return [
+        Widget(
+            uuid=f"00000000-0000-0000-0000-{i:012d}",
+            name=f"Widget {i}",
+            description="Historical stock prices",
+            metadata={"symbol": f"TICKER{i}"},
+        )
+        for i in range(count)
+    ]
+
+
+def test_tokenize():
+    assert tokenize("AAPL's P/E ratio, 2024") == [
+        "aapl",
+        "s",
+        "p",
+        "e",
+        "ratio",
+        "2024",
+    ]
+
+
+def test_bm25_ranks_matching_documents_first():
+    index = BM25Index(
+        [
+            "Income statement for the last 5 years",
+            "Stock price chart",
+            "Latest news about the stock price",
+        ]
+    )
+    assert index.rank("stock price news") == [2, 1, 0]
+    assert index.rank("stock price news", k=1) == [2]
+    # Documents that don't match keep their order.
+    assert index.rank("weather") == [0, 1, 2]
+
+
+def test_bm25_prefers_rare_terms():
+    index = BM25Index(["price chart", "price table", "price earnings"])
+    assert index.rank("price earnings")[0] == 2
+
+
+def test_selects_top_k_widgets():
+    widgets = _widgets(50)
+    selector = WidgetSelector(top_k=3)
+
+    selected = selector.select(widgets, "What is the latest price of TICKER42?")
+    assert len(selected) == 3
+    assert selected[0] is widgets[42]
+
+    assert selector.select(widgets[:3], "anything") == widgets[:3]
+    assert selector.select(None, "anything") is None
+
+
+def test_caches_index_per_dashboard():
+    widgets = _widgets(10)
+    selector = WidgetSelector(top_k=2, cache_size=1)
+
+    selector.select(widgets, "TICKER1")
+    selector.select(_widgets(10), "TICKER2")
+    assert selector.stats() == {"indexes": 1, "hits": 1, "misses": 1}
+
+    selector.select(widgets[1:], "TICKER1")
+    selector.select(widgets, "TICKER1")
+    assert selector.stats() == {"indexes": 1, "hits": 1, "misses": 3}
+
+
+def test_from_env(monkeypatch):
+    assert WidgetSelector.from_env("COPILOT_WIDGETS") is None
+    assert WidgetSelector.from_env("COPILOT_WIDGETS", default_top_k=5).top_k == 5
+    monkeypatch.setenv("COPILOT_WIDGETS_TOP_K", "0")
+    assert WidgetSelector.from_env("COPILOT_WIDGETS", default_top_k=5) is None
+
+
+def test_latest_query():
+    messages = AgentQueryRequest(
+        messages=[
+            {"role": "human", "content": "first"},
+            {"role": "ai", "content": "answer"},
+            {"role": "human", "content": "second"},
+            {"role": "ai", "content": "answer"},
+        ]
+    ).messages
+    assert latest_query(messages) == "second"
+    assert latest_query([]) == ""
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from common import serialization
+from common.models import FunctionCallSSE, FunctionCallSSEData
+
+OBJ = {"delta": 'Prix: 10€ {"a": 1}', "values": [1, 2.5, None, True], 1: "one"}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def test_dumps_is_compact_and_consistent(backend):
+    expected = json.dumps(
+        {str(k): v for k, v in OBJ.items()}, separators=(",", ":"), ensure_ascii=False
+    )
+    assert serialization.dumps(OBJ) == expected
+    assert serialization.dumpb(OBJ) == expected.encode()
+
+
+def test_loads_round_trip(backend):
+    data = serialization.dumps({"delta": "Hi €"})
+    assert serialization.loads(data) == {"delta": "Hi €"}
+    assert serialization.loads(data.encode()) == {"delta": "Hi €"}
+
+
+def test_big_integers(backend):
+    obj = {"a": 10**400}
+    expected = json.dumps(obj, separators=(",", ":"))
+    assert serialization.dumps(obj) == expected
+    assert serialization.dumpb(obj) == expected.encode()
+    assert serialization.loads(expected) == obj
+
+
+def test_loads_invalid_json(backend):
+    with pytest.raises(ValueError):
+        serialization.loads("{not json")
+
+
+def test_dumps_pydantic_model(backend):
+    data = FunctionCallSSEData(
+        function="get_widget_data", input_arguments={"widget_uuid": "1"}
+    )
+    assert serialization.loads(serialization.dumps(data)) == {
+        "function": "get_widget_data",
+        "input_arguments": {"widget_uuid": "1"},
+        "copilot_function_call_arguments": None,
+    }
+    assert "copilot_function_call_arguments" not in serialization.dumps(
+        data, exclude_none=True
+    )
+
+
+def test_sse_model_dump():
+    sse = FunctionCallSSE(
+        data=FunctionCallSSEData(
+            function="get_widget_data", input_arguments={"widget_uuid": "1"}
+        )
+    )
+    assert sse.model_dump() == {
+        "event": "copilotFunctionCall",
+        "data": '{"function":"get_widget_data","input_arguments":{"widget_uuid":"1"}}',
+    }
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from common.singleflight import SingleFlight
+
+
+def _events(n: int) -> list[dict]:
+    return [
+        {"event": "copilotMessageChunk", "data": f'{{"delta":"{i}"}}'} for i in range(n)
+    ]
+
+
+class _Upstream:
+    def __init__(self, events: list[dict], delay: float = 0.01):
+        self.events = events
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for event in self.events:
+                await asyncio.sleep(self.delay)
+                yield event
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def _collect(events) -> list[dict]:
+    return [event async for event in events]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_upstream():
+    single_flight = SingleFlight()
+    upstream = _Upstream(_events(5))
+
+    results = await asyncio.gather(
+        *(_collect(single_flight.stream("key", upstream.stream)) for _ in range(3))
+    )
+
+    assert upstream.calls == 1
+    assert results == [_events(5)] * 3
+    assert single_flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 2}
+
+
+@pytest.mark.asyncio
+async def test_late_joiner_receives_prefix():
+    single_flight = SingleFlight()
+    upstream = _Upstream(_events(10))
+
+    first = asyncio.create_task(_collect(single_flight.stream("key", upstream.stream)))
+    await asyncio.sleep(0.05)
+    late = await _collect(single_flight.stream("key", upstream.stream))
+
+    assert upstream.calls == 1
+    assert late == _events(10)
+    assert await first == _events(10)
+
+
+@pytest.mark.asyncio
+async def test_different_keys_do_not_share():
+    single_flight = SingleFlight()
+    upstream = _Upstream(_events(2))
+
+    await asyncio.gather(
+        _collect(single_flight.stream("a", upstream.stream)),
+        _collect(single_flight.stream("b", upstream.stream)),
+    )
+
+    assert upstream.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_upstream_errors_are_raised_to_all_subscribers():
+    async def _failing_stream():
+        yield _events(1)[0]
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Upstream error")
+
+    single_flight = SingleFlight()
+    results = await asyncio.gather(
+        *(_collect(single_flight.stream("key", _failing_stream)) for _ in range(2)),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(single_flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_is_cancelled_when_all_subscribers_leave():
+    single_flight = SingleFlight()
+    upstream = _Upstream(_events(100))
+
+    stream = single_flight.stream("key", upstream.stream)
+    assert await stream.__anext__() == _events(1)[0]
+    await stream.aclose()
+
+    assert upstream.cancelled
+    assert len(single_flight) == 0
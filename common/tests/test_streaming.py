@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from common.streaming import ChunkCoalescing, coalesce_chunks
+
+
+async def _stream(chunks: list[str], delay: float = 0.0):
+    for chunk in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+async def _collect(chunks) -> list[str]:
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.asyncio
+async def test_coalescing_disabled_passes_chunks_through():
+    chunks = _stream(["a", "b"])
+    assert coalesce_chunks(chunks, None) is chunks
+
+
+@pytest.mark.asyncio
+async def test_coalesce_by_size_flushes_first_chunk_immediately():
+    coalescing = ChunkCoalescing(max_delay=10, max_bytes=4)
+    chunks = await _collect(coalesce_chunks(_stream(list("abcdefghij")), coalescing))
+
+    assert chunks == ["a", "bcde", "fghi", "j"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_by_time_flushes_stalled_buffer():
+    async def _stalling_stream():
+        yield "Hello"
+        yield ","
+        yield " world"
+        await asyncio.sleep(0.2)
+        yield "!"
+
+    coalescing = ChunkCoalescing(max_delay=0.02, max_bytes=1024)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    flushed = []
+    async for chunk in coalesce_chunks(_stalling_stream(), coalescing):
+        flushed.append((chunk, loop.time() - start))
+
+    assert [chunk for chunk, _ in flushed] == ["Hello", ", world", "!"]
+    # The buffered chunks are flushed on the deadline, not when the stream
+    # eventually resumes.
+    assert flushed[1][1] < 0.15
+
+
+@pytest.mark.asyncio
+async def test_coalesce_preserves_content():
+    tokens = [f"token{i} " for i in range(100)]
+    coalescing = ChunkCoalescing(max_delay=0.005, max_bytes=64)
+    chunks = await _collect(coalesce_chunks(_stream(tokens, delay=0.001), coalescing))
+
+    assert "".join(chunks) == "".join(tokens)
+    assert len(chunks) < len(tokens)
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("COPILOT_STREAM_COALESCE_MS", raising=False)
+    assert ChunkCoalescing.from_env() is None
+
+    monkeypatch.setenv("COPILOT_STREAM_COALESCE_MS", "20")
+    monkeypatch.setenv("COPILOT_STREAM_COALESCE_BYTES", "512")
+    assert ChunkCoalescing.from_env() == ChunkCoalescing(max_delay=0.02, max_bytes=512)
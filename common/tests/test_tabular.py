@@ -0,0 +1,141 @@
+import json
+import sys
+
+import pytest
+
+from common.context import build_context_str
+from common.models import DataContent, RawContext
+from common.serialization import loads
+from common.tabular import TableCompaction, parse_table, summarize_table
+
+RECORDS = [
+    {
+        "date": f"2024-01-{i + 1:02d}",
+        "close": 100.0 + i,
+        "volume": None if i == 9 else i,
+    }
+    for i in range(10)
+]
+CSV = "date,close\n" + "\n".join(f"2024-01-{i + 1:02d},{100 + i}" for i in range(10))
+
+
+def test_parse_table():
+    names, columns = parse_table(RECORDS)
+    assert names == ["date", "close", "volume"]
+    assert columns[1] == [100.0 + i for i in range(10)]
+
+    assert parse_table(json.dumps(RECORDS)) == (names, columns)
+    assert parse_table({"results": RECORDS}) == (names, columns)
+    assert parse_table({"a": [1, 2], "b": [3, 4]}) == (["a", "b"], [[1, 2], [3, 4]])
+
+    names, columns = parse_table(CSV)
+    assert names == ["date", "close"]
+    assert columns[1][-1] == "109"
+
+
+def test_parse_table_ignores_other_content():
+    assert parse_table("The price went up.\nThen it went down.\nThe end.") is None
+    assert parse_table({"price": 100}) is None
+    assert parse_table([1, 2, 3]) is None
+    assert parse_table("[not json") is None
+
+
+def test_summarize_table():
+    pytest.importorskip("numpy")
+    summary = summarize_table(*parse_table(RECORDS), rows=2)
+
+    assert summary["row_count"] == 10
+    assert summary["columns"]["close"] == {
+        "type": "number",
+        "count": 10,
+        "min": 100.0,
+        "max": 109.0,
+        "mean": 104.5,
+        "last": 109.0,
+    }
+    # The last value that isn't missing.
+    assert summary["columns"]["volume"]["last"] == 8.0
+    assert summary["columns"]["date"]["min"] == "2024-01-01"
+    assert summary["columns"]["date"]["max"] == "2024-01-10"
+    assert summary["head"] == [["2024-01-01", 100.0, 0], ["2024-01-02", 101.0, 1]]
+    assert summary["tail"][-1] == ["2024-01-10", 109.0, None]
+
+
+def test_summarize_table_with_list_values():
+    pytest.importorskip("numpy")
+    records = [
+        {"range": [i, i + 1], "close": float(i), "labels": ["a", "b"]}
+        for i in range(500)
+    ]
+
+    summary = summarize_table(*parse_table(records), rows=1)
+
+    assert summary["columns"]["range"] == {
+        "type": "string",
+        "count": 500,
+        "last": [499, 500],
+    }
+    assert summary["columns"]["close"]["min"] == 0.0
+    assert summary["columns"]["close"]["max"] == 499.0
+    assert summary["columns"]["labels"]["type"] == "string"
+
+
+def test_summarize_csv_table():
+    pytest.importorskip("numpy")
+    summary = summarize_table(*parse_table(CSV), rows=1)
+    assert summary["columns"]["close"]["mean"] == 104.5
+    assert summary["head"] == [["2024-01-01", "100"]]
+
+
+def test_compacts_large_tables_within_budget():
+    pytest.importorskip("numpy")
+    records = [{"close": float(i), "note": "x" * 20} for i in range(10_000)]
+    compaction = TableCompaction(max_chars=1_000, sample_rows=50)
+
+    compacted = compaction.compact(json.dumps(records))
+    assert len(compacted) <= 1_000
+    summary = loads(compacted)
+    assert summary["row_count"] == 10_000
+    assert summary["columns"]["close"]["max"] == 9999.0
+    assert 0 < len(summary["head"]) < 50
+
+
+def test_leaves_small_and_non_tabular_content():
+    compaction = TableCompaction(max_chars=1_000)
+    assert compaction.compact(json.dumps(RECORDS[:2])) == json.dumps(RECORDS[:2])
+    assert compaction.compact("x" * 2_000) == "x" * 2_000
+    prose = '"Quoted intro\n' + "line of prose, more\n" * 50
+    assert parse_table(prose) is None
+    assert compaction.compact(prose) == prose
+
+
+def test_build_context_str_compacts_tables():
+    pytest.importorskip("numpy")
+    context = [
+        RawContext(
+            uuid="00000000-0000-0000-0000-000000000000",
+            name="Prices",
+            description="Daily prices",
+            data=DataContent(content=RECORDS * 100),
+        )
+    ]
+    compaction = TableCompaction(max_chars=2_000)
+
+    context_str = build_context_str(context, compaction=compaction)
+    assert len(context_str) < 2_500
+    assert '\\"row_count\\":1000' in context_str
+    assert context[0].data.content == RECORDS * 100
+
+
+def test_from_env(monkeypatch):
+    pytest.importorskip("numpy")
+    assert TableCompaction.from_env() is None
+    monkeypatch.setenv("COPILOT_TABLE_COMPACTION", "true")
+    monkeypatch.setenv("COPILOT_TABLE_COMPACTION_MAX_TOKENS", "500")
+    assert TableCompaction.from_env().max_chars == 2_000
+
+
+def test_from_env_without_numpy(monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setenv("COPILOT_TABLE_COMPACTION", "true")
+    assert TableCompaction.from_env() is None
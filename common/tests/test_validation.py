@@ -0,0 +1,85 @@
+import json
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from common.models import AgentQueryRequest, LlmFunctionCallResult, LlmMessage
+from common.validation import (
+    QUERY_REQUEST_OPENAPI,
+    parse_query_request,
+    query_request_adapter,
+)
+
+FUNCTION_CALL = {
+    "function": "get_widget_data",
+    "input_arguments": {"widget_uuid": "ff6368ec-a397-4baf-9f5a-fecd9fd797a3"},
+}
+MESSAGES = [
+    {"role": "human", "content": "What's the price?"},
+    {"role": "ai", "content": json.dumps(FUNCTION_CALL)},
+    {"role": "tool", **FUNCTION_CALL, "content": "100"},
+    {"role": "ai", "content": "It's 100."},
+]
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/query", openapi_extra=QUERY_REQUEST_OPENAPI)
+    async def query(request: AgentQueryRequest = Depends(parse_query_request)):
+        return [type(message).__name__ for message in request.messages]
+
+    return app
+
+
+def test_messages_are_discriminated_by_role():
+    messages = AgentQueryRequest(messages=MESSAGES).messages
+    assert [type(message) for message in messages] == [
+        LlmMessage,
+        LlmMessage,
+        LlmFunctionCallResult,
+        LlmMessage,
+    ]
+    # Tool results don't need a role.
+    (result,) = AgentQueryRequest(messages=[{**FUNCTION_CALL, "content": "1"}]).messages
+    assert isinstance(result, LlmFunctionCallResult)
+
+
+def test_validate_json_matches_model_validate():
+    data = json.dumps({"messages": MESSAGES}).encode()
+    assert query_request_adapter.validate_json(data) == AgentQueryRequest(
+        messages=MESSAGES
+    )
+
+
+def test_parse_query_request():
+    client = TestClient(_app())
+    response = client.post("/v1/query", json={"messages": MESSAGES})
+    assert response.json() == [
+        "LlmMessage",
+        "LlmMessage",
+        "LlmFunctionCallResult",
+        "LlmMessage",
+    ]
+
+
+def test_parse_query_request_invalid():
+    client = TestClient(_app())
+
+    response = client.post(
+        "/v1/query", json={"messages": [{"role": "system", "content": "Hi"}]}
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "messages", 0]
+
+    response = client.post("/v1/query", content=b"{not json")
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+
+
+def test_openapi_request_body():
+    schema = _app().openapi()["paths"]["/v1/query"]["post"]["requestBody"]
+    assert schema["required"]
+    json_schema = schema["content"]["application/json"]["schema"]
+    assert "messages" in json_schema["properties"]
+    assert "$ref" not in json.dumps(json_schema)
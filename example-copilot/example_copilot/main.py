@@ -1,85 +1,128 @@
-import re
-import json
+import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import AsyncGenerator
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from magentic import (
-    chatprompt,
-    SystemMessage,
-    UserMessage,
-    AssistantMessage,
-    AsyncStreamedStr,
-)
+from fastapi import Depends, FastAPI, Request
+from magentic import AsyncStreamedStr
 from sse_starlette.sse import EventSourceResponse
 
 from dotenv import load_dotenv
+from common.clients import chat_models
+from common.cors import add_cors
+from common.context import ContextBudget, build_context_str
+from common.descriptor import CopilotDescriptor
+from common.disconnect import DisconnectWatcher
+from common.history import HistoryBudget, TokenCounter, trim_history
+from common.metrics import metrics
+from common.messages import assistant_message, user_message
+from common.prompts import ChatPrompt
+from common.serialization import dumps
+from common.streaming import ChunkCoalescing, coalesce_chunks
+from common.tabular import TableCompaction
+from common.validation import QUERY_REQUEST_OPENAPI, parse_query_request
 from common.models import AgentQueryRequest
 from .prompts import SYSTEM_PROMPT
 
 
 load_dotenv(".env")
-app = FastAPI()
-
-origins = [
-    "http://localhost",
-    "http://localhost:1420",
-    "http://localhost:5050",
-    "https://pro.openbb.dev",
-    "https://pro.openbb.co",
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+COPILOT_ID = "example"
+CONTEXT_BUDGET = ContextBudget.from_env(
+    "COPILOT_CONTEXT", default_max_tokens=16_000, default_max_item_tokens=8_000
+)
+HISTORY_BUDGET = HistoryBudget.from_env("COPILOT_HISTORY", default_max_tokens=32_000)
+# The chat model is configured through magentic's `MAGENTIC_*` settings.
+BACKEND = os.environ.get("MAGENTIC_BACKEND", "openai")
+MODEL = os.environ.get(f"MAGENTIC_{BACKEND.upper()}_MODEL", "gpt-4o")
+token_counter = TokenCounter.from_env(MODEL)
+STREAM_COALESCING = ChunkCoalescing.from_env()
+table_compaction = TableCompaction.from_env()
+disconnect_watcher = DisconnectWatcher.from_env()
+copilot_descriptor = CopilotDescriptor(
+    Path(__file__).parent.resolve() / "copilots.json"
 )
 
 
-def sanitize_message(message: str) -> str:
-    """Sanitize a message by escaping forbidden characters."""
-    cleaned_message = re.sub(r"(?<!\{)\{(?!{)", "{{", message)
-    cleaned_message = re.sub(r"(?<!\})\}(?!})", "}}", cleaned_message)
-    return cleaned_message
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with (
+        copilot_descriptor.watch(),
+        chat_models.warmup(BACKEND),
+        token_counter.warmup(),
+    ):
+        yield
+    await chat_models.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+add_cors(app)
+metrics.instrument(app)
+metrics.register_stats("copilot_disconnect", COPILOT_ID, disconnect_watcher.stats)
+
+
+copilot_prompt = ChatPrompt(SYSTEM_PROMPT, output_types=[AsyncStreamedStr])
 
 
 async def create_message_stream(
-    content: AsyncStreamedStr,
+    content: AsyncStreamedStr, received_at: float, http_request: Request
 ) -> AsyncGenerator[dict, None]:
-    async for chunk in content:
-        yield {"event": "copilotMessageChunk", "data": json.dumps({"delta": chunk})}
+    chunks = metrics.track_stream(
+        COPILOT_ID, disconnect_watcher.stream(http_request, content), received_at
+    )
+    async for chunk in coalesce_chunks(chunks, STREAM_COALESCING):
+        yield {"event": "copilotMessageChunk", "data": dumps({"delta": chunk})}
 
 
 @app.get("/copilots.json")
-def get_copilot_description():
+def get_copilot_description(request: Request):
     """Widgets configuration file for the OpenBB Terminal Pro"""
-    return JSONResponse(
-        content=json.load(open((Path(__file__).parent.resolve() / "copilots.json")))
-    )
+    return copilot_descriptor.response(request)
 
 
-@app.post("/v1/query")
-async def query(request: AgentQueryRequest) -> EventSourceResponse:
-    """Query the Copilot."""
-
-    chat_messages = []
-    for message in request.messages:
-        if message.role == "ai":
-            chat_messages.append(
-                AssistantMessage(content=sanitize_message(message.content))
-            )
-        elif message.role == "human":
-            chat_messages.append(UserMessage(content=sanitize_message(message.content)))
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics, if enabled with `COPILOT_METRICS=true`."""
+    return metrics.response()
 
-    @chatprompt(SystemMessage(SYSTEM_PROMPT), *chat_messages)
-    async def _llm(context: str) -> AsyncStreamedStr: ...
 
-    result = await _llm(context=request.context)
+@app.post("/v1/query", openapi_extra=QUERY_REQUEST_OPENAPI)
+async def query(
+    http_request: Request,
+    request: AgentQueryRequest = Depends(parse_query_request),
+) -> EventSourceResponse:
+    """Query the Copilot."""
+    received_at = metrics.request_started(COPILOT_ID, http_request)
+
+    with metrics.stage(COPILOT_ID, "history_trimming"):
+        messages = trim_history(request.messages, HISTORY_BUDGET, token_counter)
+
+    with metrics.stage(COPILOT_ID, "message_conversion"):
+        chat_messages = []
+        for message in messages:
+            if message.role == "ai":
+                # This copilot can't call functions, so function calls (and
+                # their results) in the history are left out.
+                if isinstance(message.content, str):
+                    chat_messages.append(assistant_message(message.content))
+            elif message.role == "human":
+                chat_messages.append(user_message(message.content))
+
+    with metrics.stage(COPILOT_ID, "context_serialization"):
+        context_str = build_context_str(
+            request.context, CONTEXT_BUDGET, table_compaction
+        )
+
+    with metrics.stage(COPILOT_ID, "upstream_first_token"):
+        result = await disconnect_watcher.first(
+            http_request,
+            copilot_prompt(
+                chat_messages,
+                model=chat_models.get_configured(),
+                context=context_str,
+            ),
+        )
     return EventSourceResponse(
-        content=create_message_stream(result),
+        content=create_message_stream(result, received_at, http_request),
         media_type="text/event-stream",
     )
@@ -3,7 +3,7 @@ from fastapi.testclient import TestClient
 from example_copilot.main import app
 import pytest
 from pathlib import Path
-from common.testing import capture_stream_response
+from common.testing import FakeChatModel, capture_stream_response, use_chat_model
 
 test_client = TestClient(app)
 
@@ -60,9 +60,38 @@ def test_query_with_context():
     assert "pizza" in captured_stream.lower()
 
 
+def test_query_with_function_call_in_history(monkeypatch):
+    test_payload_path = (
+        Path(__file__).parent.parent.parent
+        / "test_payloads"
+        / "retrieve_widget_from_dashboard_with_result.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+    chat_model = use_chat_model(monkeypatch, "get_configured", FakeChatModel(["10"]))
+
+    response = test_client.post("/v1/query", json=test_payload)
+    assert capture_stream_response(response.text) == ("copilotMessageChunk", "10")
+    # The function call isn't sent as a tool call without a result.
+    assert [message["role"] for message in chat_model.openai_messages] == [
+        "system",
+        "user",
+    ]
+
+
 def test_query_no_messages():
     test_payload = {
         "messages": [],
     }
     response = test_client.post("/v1/query", json=test_payload)
     "messages list cannot be empty" in response.text
+
+
+def test_get_copilot_description():
+    response = test_client.get("/copilots.json")
+    assert response.status_code == 200
+    assert "endpoints" in next(iter(response.json().values()))
+
+    response = test_client.get(
+        "/copilots.json", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
@@ -0,0 +1,75 @@
+import importlib
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import FastAPI, Request
+
+from common.cors import add_cors, remove_cors
+from common.descriptor import CombinedDescriptor
+from common.metrics import metrics
+
+# Each copilot's module, by the prefix it's mounted under.
+COPILOTS = {
+    "example": "example_copilot.main",
+    "mistral": "mistral_copilot.main",
+    "llama": "llama_copilot.main",
+}
+
+
+def load_copilots(names: list[str]) -> dict:
+    """Import the apps of the named copilots.
+
+    Only the named copilots are imported, so the others aren't initialized.
+    """
+    return {name: importlib.import_module(COPILOTS[name]) for name in names}
+
+
+copilots = load_copilots(
+    [
+        name.strip()
+        for name in os.environ.get(
+            "COPILOT_GATEWAY_COPILOTS", ",".join(COPILOTS)
+        ).split(",")
+        if name.strip()
+    ]
+)
+copilot_descriptor = CombinedDescriptor(
+    {name: module.copilot_descriptor for name, module in copilots.items()},
+    base_url=os.environ.get("COPILOT_GATEWAY_URL", "http://localhost:7777"),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted apps' lifespans aren't run by Starlette, so we run them here.
+    async with AsyncExitStack() as stack:
+        for module in copilots.values():
+            await stack.enter_async_context(
+                module.app.router.lifespan_context(module.app)
+            )
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+# CORS is handled here, for every copilot, so their own would only duplicate
+# the headers.
+add_cors(app)
+for module in copilots.values():
+    remove_cors(module.app)
+
+
+@app.get("/copilots.json")
+def get_copilot_description(request: Request):
+    """Widgets configuration file for the OpenBB Terminal Pro, for every copilot."""
+    return copilot_descriptor.response(request)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics of every copilot, if enabled with `COPILOT_METRICS=true`."""
+    return metrics.response()
+
+
+for name, module in copilots.items():
+    app.mount(f"/{name}", module.app)
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from common.testing import FakeChatModel, capture_stream_response, use_chat_model
+from copilot_gateway.main import app
+
+
+@pytest.fixture(autouse=True)
+def reset_sse_starlette_appstatus_event():
+    """
+    Fixture that resets the appstatus event in the sse_starlette app.
+    Should be used on any test that uses sse_starlette to stream events.
+    """
+    # See https://github.com/sysid/sse-starlette/issues/59
+    from sse_starlette.sse import AppStatus
+
+    AppStatus.should_exit_event = None
+
+
+@pytest.fixture
+def test_client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_combined_copilots_json(test_client):
+    response = test_client.get("/copilots.json")
+
+    assert response.status_code == 200
+    descriptor = response.json()
+    assert set(descriptor) == {"example_copilot", "mistral_copilot", "llama_copilot"}
+    assert (
+        descriptor["mistral_copilot"]["endpoints"]["query"]
+        == "http://localhost:7777/mistral/v1/query"
+    )
+
+
+def test_copilot_routes_are_mounted(test_client):
+    for name in ("example", "mistral", "llama"):
+        response = test_client.get(f"/{name}/copilots.json")
+        assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "name, get_chat_model",
+    [("example", "get_openai"), ("mistral", "get_mistral"), ("llama", "get_litellm")],
+)
+def test_query(test_client, monkeypatch, name, get_chat_model):
+    use_chat_model(monkeypatch, get_chat_model, FakeChatModel([name]))
+
+    response = test_client.post(
+        f"/{name}/v1/query", json={"messages": [{"role": "human", "content": "Hi"}]}
+    )
+
+    assert response.status_code == 200
+    assert capture_stream_response(response.text) == ("copilotMessageChunk", name)
+
+
+def test_cors_headers_are_added_once(test_client):
+    response = test_client.get(
+        "/mistral/copilots.json", headers={"Origin": "https://pro.openbb.co"}
+    )
+
+    assert response.headers.get_list("access-control-allow-origin") == [
+        "https://pro.openbb.co"
+    ]
+    assert response.headers.get_list("vary") == ["Origin"]
@@ -1,102 +1,192 @@
-import re
-import json
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
 from typing import AsyncGenerator
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from magentic import (
-    chatprompt,
-    SystemMessage,
-    UserMessage,
-    AssistantMessage,
-    AsyncStreamedStr,
-)
-from magentic.chat_model.litellm_chat_model import LitellmChatModel
+from fastapi import Depends, FastAPI, Request
+from starlette.background import BackgroundTasks
+from magentic import UserMessage, AsyncStreamedStr
 from sse_starlette.sse import EventSourceResponse
 
 from dotenv import load_dotenv
+from common.admission import AdmissionController
+from common.backends import BackendPool
+from common.clients import chat_models
+from common.cors import add_cors
+from common.context import ContextBudget, build_context_str
+from common.descriptor import CopilotDescriptor
+from common.disconnect import ClientDisconnected, DisconnectWatcher
+from common.documents import DocumentStore, add_document_routes, build_documents_str
+from common.history import HistoryBudget, TokenCounter, trim_history
+from common.metrics import metrics
+from common.messages import assistant_message, user_message
+from common.prompts import ChatPrompt
+from common.search import latest_query
+from common.serialization import dumps
+from common.streaming import ChunkCoalescing, coalesce_chunks
+from common.tabular import TableCompaction
+from common.validation import QUERY_REQUEST_OPENAPI, parse_query_request
 from common.models import AgentQueryRequest
 from .prompts import SYSTEM_PROMPT
 
 
 load_dotenv(".env")
-app = FastAPI()
-
-origins = [
-    "http://localhost",
-    "http://localhost:1420",
-    "http://localhost:5050",
-    "https://pro.openbb.dev",
-    "https://pro.openbb.co",
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+COPILOT_ID = "llama"
+# Ollama runs models with a small context window by default, so keep the
+# context compact.
+CONTEXT_BUDGET = ContextBudget.from_env(
+    "COPILOT_CONTEXT", default_max_tokens=4_000, default_max_item_tokens=2_000
+)
+HISTORY_BUDGET = HistoryBudget.from_env("COPILOT_HISTORY", default_max_tokens=2_000)
+STREAM_COALESCING = ChunkCoalescing.from_env()
+table_compaction = TableCompaction.from_env()
+# Requests are spread across the Ollama servers listed in `COPILOT_BACKENDS`.
+backend_pool = BackendPool.from_env(default_url="http://localhost:11434")
+# An Ollama server runs one generation at a time by default, so one request
+# per server is admitted at once, and the rest wait in a bounded queue rather
+# than piling up on the servers.
+admission = AdmissionController.from_env(max_concurrency=len(backend_pool.backends))
+# Requests whose client has gone are dropped, freeing the server for others.
+disconnect_watcher = DisconnectWatcher.from_env()
+MODEL = "ollama_chat/llama3.1:8b-instruct-q6_K"
+# Llama's tokenizer isn't tiktoken's, and the local copilot may have no network
+# access to download an encoding, so tokens are estimated by default.
+token_counter = TokenCounter.from_env(MODEL, default_tokenizer="chars")
+# Uploaded documents are searched for queries with `use_docs`.
+document_store = DocumentStore.from_env()
+copilot_descriptor = CopilotDescriptor(
+    Path(__file__).parent.resolve() / "copilots.json",
+    overrides={"hasDocuments": document_store is not None},
 )
 
 
-def sanitize_message(message: str) -> str:
-    """Sanitize a message by escaping forbidden characters."""
-    cleaned_message = re.sub(r"(?<!\{)\{(?!{)", "{{", message)
-    cleaned_message = re.sub(r"(?<!\})\}(?!})", "}}", cleaned_message)
-    return cleaned_message
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with (
+        copilot_descriptor.watch(),
+        chat_models.warmup("litellm"),
+        token_counter.warmup(),
+        backend_pool.watch(),
+    ):
+        yield
+    await chat_models.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+add_cors(app)
+add_document_routes(app, document_store)
+metrics.instrument(app)
+metrics.register_stats("copilot_admission", COPILOT_ID, admission.stats)
+metrics.register_stats("copilot_backend", COPILOT_ID, backend_pool.stats)
+metrics.register_stats("copilot_disconnect", COPILOT_ID, disconnect_watcher.stats)
+if document_store is not None:
+    metrics.register_stats("copilot_documents", COPILOT_ID, document_store.stats)
+
+
+copilot_prompt = ChatPrompt(SYSTEM_PROMPT, output_types=[AsyncStreamedStr])
 
 
 async def create_message_stream(
-    content: AsyncStreamedStr,
+    content: AsyncStreamedStr, received_at: float, http_request: Request
 ) -> AsyncGenerator[dict, None]:
-    async for chunk in content:
-        yield {"event": "copilotMessageChunk", "data": json.dumps({"delta": chunk})}
+    chunks = metrics.track_stream(
+        COPILOT_ID, disconnect_watcher.stream(http_request, content), received_at
+    )
+    async for chunk in coalesce_chunks(chunks, STREAM_COALESCING):
+        yield {"event": "copilotMessageChunk", "data": dumps({"delta": chunk})}
 
 
 @app.get("/copilots.json")
-def get_copilot_description():
+def get_copilot_description(request: Request):
     """Widgets configuration file for the OpenBB Terminal Pro"""
-    return JSONResponse(
-        content=json.load(open((Path(__file__).parent.resolve() / "copilots.json")))
-    )
+    return copilot_descriptor.response(request)
 
 
-def _get_llm(chat_messages: list):
-    @chatprompt(
-        SystemMessage(SYSTEM_PROMPT),
-        *chat_messages,
-        model=LitellmChatModel(model="ollama_chat/llama3.1:8b-instruct-q6_K"),
-    )
-    async def _llm() -> AsyncStreamedStr: ...
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics, if enabled with `COPILOT_METRICS=true`."""
+    return metrics.response()
+
 
-    return _llm
+def _get_llm(chat_messages: list, api_base: str | None = None):
+    return partial(
+        copilot_prompt,
+        chat_messages,
+        model=chat_models.get_litellm(MODEL, api_base=api_base),
+    )
 
 
-@app.post("/v1/query")
-async def query(request: AgentQueryRequest) -> EventSourceResponse:
+@app.post("/v1/query", openapi_extra=QUERY_REQUEST_OPENAPI)
+async def query(
+    http_request: Request,
+    request: AgentQueryRequest = Depends(parse_query_request),
+) -> EventSourceResponse:
     """Query the Copilot."""
+    received_at = metrics.request_started(COPILOT_ID, http_request)
+
+    with metrics.stage(COPILOT_ID, "history_trimming"):
+        messages = trim_history(request.messages, HISTORY_BUDGET, token_counter)
+
+    with metrics.stage(COPILOT_ID, "message_conversion"):
+        chat_messages = []
+        for message in messages:
+            if message.role == "ai":
+                # This copilot can't call functions, so function calls (and
+                # their results) in the history are left out.
+                if isinstance(message.content, str):
+                    chat_messages.append(assistant_message(message.content))
+            elif message.role == "human":
+                chat_messages.append(user_message(message.content))
 
-    chat_messages = []
-    for message in request.messages:
-        if message.role == "ai":
-            chat_messages.append(
-                AssistantMessage(content=sanitize_message(message.content))
+    if request.context:
+        with metrics.stage(COPILOT_ID, "context_serialization"):
+            context_str = build_context_str(
+                request.context, CONTEXT_BUDGET, table_compaction
             )
-        elif message.role == "human":
-            chat_messages.append(UserMessage(content=sanitize_message(message.content)))
+        chat_messages.insert(1, UserMessage(content="# Context\n" + context_str))
 
-    if request.context:
-        chat_messages.insert(
-            1,
-            UserMessage(content=sanitize_message("# Context\n" + str(request.context))),
-        )
+    if request.use_docs and document_store is not None:
+        with metrics.stage(COPILOT_ID, "document_retrieval"):
+            chunks = await asyncio.to_thread(
+                document_store.search, latest_query(request.messages)
+            )
+        if chunks:
+            chat_messages.insert(
+                1,
+                UserMessage(content="# Documents\n" + build_documents_str(chunks)),
+            )
 
-    llm = _get_llm(chat_messages)
-    result = await llm()
+    # The slot is held until the response has finished streaming.
+    with metrics.stage(COPILOT_ID, "queue"):
+        ticket = await disconnect_watcher.first(http_request, admission.acquire())
+    lease = backend_pool.lease()
+    try:
+        llm = _get_llm(chat_messages, api_base=lease.backend.url)
+        with metrics.stage(COPILOT_ID, "upstream_first_token"):
+            result = await disconnect_watcher.first(http_request, llm())
+        lease.first_token()
+    except BaseException as error:
+        ticket.release()
+        # The client leaving isn't the backend's fault.
+        lease.release(
+            failed=isinstance(error, Exception)
+            and not isinstance(error, ClientDisconnected)
+        )
+        raise
 
+    background = BackgroundTasks()
+    background.add_task(lease.arelease)
+    background.add_task(ticket.arelease)
     return EventSourceResponse(
-        content=create_message_stream(result),
+        content=admission.hold(
+            ticket,
+            backend_pool.hold(
+                lease, create_message_stream(result, received_at, http_request)
+            ),
+        ),
         media_type="text/event-stream",
+        headers=ticket.headers,
+        background=background,
     )
@@ -2,11 +2,13 @@ import json
 import os
 from pathlib import Path
 from fastapi.testclient import TestClient
+from llama_copilot import main
 from llama_copilot.main import app
 import pytest
 from unittest.mock import Mock, patch
 
-from common.testing import capture_stream_response
+from common.admission import AdmissionController
+from common.testing import FakeChatModel, capture_stream_response, use_chat_model
 
 test_client = TestClient(app)
 
@@ -100,9 +102,78 @@ def test_query_with_context(mock_get_llm):
     assert "pizza" in captured_stream.lower()
 
 
+def test_query_with_function_call_in_history(monkeypatch):
+    test_payload_path = (
+        Path(__file__).parent.parent.parent
+        / "test_payloads"
+        / "retrieve_widget_from_dashboard_with_result.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+    chat_model = use_chat_model(monkeypatch, "get_litellm", FakeChatModel(["sunny"]))
+
+    response = test_client.post("/v1/query", json=test_payload)
+    event_name, captured_stream = capture_stream_response(response.text)
+    assert response.status_code == 200
+    assert event_name == "copilotMessageChunk"
+    # The function call isn't sent as a tool call without a result.
+    assert all("tool_calls" not in message for message in chat_model.openai_messages)
+    assert chat_model.openai_messages[-1] == {
+        "role": "user",
+        "content": "what is the weather in London?",
+    }
+
+
 def test_query_no_messages():
     test_payload = {
         "messages": [],
     }
     response = test_client.post("/v1/query", json=test_payload)
     "messages list cannot be empty" in response.text
+
+
+def test_get_copilot_description():
+    response = test_client.get("/copilots.json")
+    assert response.status_code == 200
+    assert "endpoints" in next(iter(response.json().values()))
+
+    response = test_client.get(
+        "/copilots.json", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+
+
+def test_query_rejected_when_queue_is_full(mock_get_llm, monkeypatch):
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+
+    admission = AdmissionController(max_concurrency=1, max_queue=0)
+    admission.in_flight = 1
+    monkeypatch.setattr("llama_copilot.main.admission", admission)
+
+    response = test_client.post("/v1/query", json=test_payload)
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+    assert admission.stats()["rejected"] == 1
+
+
+def test_admits_a_request_per_backend():
+    assert main.admission.max_concurrency == len(main.backend_pool.backends)
+
+
+def test_get_metrics(mock_get_llm, monkeypatch):
+    from common.metrics import Metrics
+
+    metrics = Metrics()
+    monkeypatch.setattr("llama_copilot.main.metrics", metrics)
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    mock_get_llm.return_value = _mock_stream_generator(["2"])
+    test_client.post("/v1/query", json=json.load(open(test_payload_path)))
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert 'stage="upstream_first_token"' in response.text
+    assert "copilot_time_to_first_token_seconds_count" in response.text
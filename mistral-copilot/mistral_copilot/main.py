@@ -1,23 +1,41 @@
-import re
-import json
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
-from typing import AsyncGenerator
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from typing import AsyncGenerator, Awaitable, Callable
+from fastapi import Depends, FastAPI, HTTPException, Request
 from magentic import (
     AssistantMessage,
+    AsyncParallelFunctionCall,
     FunctionCall,
     FunctionResultMessage,
-    SystemMessage,
-    UserMessage,
-    chatprompt,
     AsyncStreamedStr,
+    ParallelFunctionCall,
 )
-from magentic.chat_model.mistral_chat_model import MistralChatModel
 from sse_starlette.sse import EventSourceResponse
 
 from dotenv import load_dotenv
+from common.cache import ResponseCache, request_key
+from common.clients import chat_models
+from common.cors import add_cors
+from common.context import ContextBudget, build_context_str, build_widgets_str
+from common.descriptor import CopilotDescriptor
+from common.disconnect import DisconnectWatcher
+from common.documents import DocumentStore, add_document_routes, build_documents_str
+from common.hedging import Hedging
+from common.history import HistoryBudget, TokenCounter, trim_history
+from common.metrics import metrics
+from common.messages import assistant_message, user_message
+from common.prompts import ChatPrompt
+from common.ratelimit import RateLimiter
+from common.retry import RetryPolicy
+from common.serialization import dumps
+from common.singleflight import SingleFlight
+from common.search import WidgetSelector, latest_query
+from common.streaming import ChunkCoalescing, coalesce_chunks
+from common.tabular import TableCompaction
+from common.validation import QUERY_REQUEST_OPENAPI, parse_query_request
 from common.models import (
     AgentQueryRequest,
     FunctionCallResponse,
@@ -26,152 +44,371 @@ from common.models import (
     LlmFunctionCall,
     LlmFunctionCallResult,
     RoleEnum,
+    widget_data_arguments,
 )
 from .prompts import SYSTEM_PROMPT
 
 
 load_dotenv(".env")
-app = FastAPI()
-
-origins = [
-    "http://localhost",
-    "http://localhost:1420",
-    "http://localhost:5050",
-    "https://pro.openbb.dev",
-    "https://pro.openbb.co",
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+COPILOT_ID = "mistral"
+MODEL = "mistral-large-2407"
+# Point at a Mistral-compatible server (eg. a proxy, or the benchmarks' stub).
+MISTRAL_BASE_URL = os.environ.get("MISTRAL_BASE_URL")
+TEMPERATURE = 0.2
+# Mistral Large 2 has a 128k token context window. The context, widgets and
+# history budgets add up to 112k, leaving the rest for the system prompt,
+# retrieved documents and the reply.
+CONTEXT_BUDGET = ContextBudget.from_env(
+    "COPILOT_CONTEXT", default_max_tokens=64_000, default_max_item_tokens=16_000
 )
+WIDGETS_BUDGET = ContextBudget.from_env("COPILOT_WIDGETS", default_max_tokens=8_000)
+# Only the widgets most relevant to the latest message are put in the prompt.
+widget_selector = WidgetSelector.from_env("COPILOT_WIDGETS", default_top_k=20)
+# What remains of the context window goes to the conversation history.
+HISTORY_BUDGET = HistoryBudget.from_env("COPILOT_HISTORY", default_max_tokens=40_000)
+token_counter = TokenCounter.from_env(MODEL)
+STREAM_COALESCING = ChunkCoalescing.from_env()
+table_compaction = TableCompaction.from_env()
+response_cache = ResponseCache.from_env(temperature=TEMPERATURE)
+single_flight = SingleFlight.from_env()
+disconnect_watcher = DisconnectWatcher.from_env()
+# Requests with no first token after `COPILOT_HEDGE_AFTER_MS` are hedged with a
+# second request to `COPILOT_HEDGE_MODEL` at `COPILOT_HEDGE_BASE_URL` (by
+# default, the same model and server), and the first to respond is used.
+hedging = Hedging.from_env()
+HEDGE_MODEL = os.environ.get("COPILOT_HEDGE_MODEL", MODEL)
+HEDGE_BASE_URL = os.environ.get("COPILOT_HEDGE_BASE_URL", MISTRAL_BASE_URL)
+# Requests are paced to the provider's quotas, and those that are rejected (or
+# fail) before their first token are retried.
+rate_limiter = RateLimiter.from_env()
+retry_policy = RetryPolicy.from_env()
+# Uploaded documents are searched for queries with `use_docs`.
+document_store = DocumentStore.from_env()
+copilot_descriptor = CopilotDescriptor(
+    Path(__file__).parent.resolve() / "copilots.json",
+    overrides={"hasDocuments": document_store is not None},
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with (
+        copilot_descriptor.watch(),
+        chat_models.warmup("mistral"),
+        token_counter.warmup(),
+    ):
+        yield
+    await chat_models.aclose()
+
 
+app = FastAPI(lifespan=lifespan)
 
-def sanitize_message(message: str) -> str:
-    """Sanitize a message by escaping forbidden characters."""
-    cleaned_message = re.sub(r"(?<!\{)\{(?!{)", "{{", message)
-    cleaned_message = re.sub(r"(?<!\})\}(?!})", "}}", cleaned_message)
-    return cleaned_message
+add_cors(app)
+add_document_routes(app, document_store)
+metrics.instrument(app)
+metrics.register_stats("copilot_disconnect", COPILOT_ID, disconnect_watcher.stats)
+if response_cache is not None:
+    metrics.register_stats("copilot_response_cache", COPILOT_ID, response_cache.stats)
+if single_flight is not None:
+    metrics.register_stats("copilot_single_flight", COPILOT_ID, single_flight.stats)
+if widget_selector is not None:
+    metrics.register_stats("copilot_widget_index", COPILOT_ID, widget_selector.stats)
+if hedging is not None:
+    metrics.register_stats("copilot_hedge", COPILOT_ID, hedging.stats)
+if rate_limiter is not None:
+    metrics.register_stats("copilot_rate_limit", COPILOT_ID, rate_limiter.stats)
+if retry_policy is not None:
+    metrics.register_stats("copilot_retry", COPILOT_ID, retry_policy.stats)
+if document_store is not None:
+    metrics.register_stats("copilot_documents", COPILOT_ID, document_store.stats)
+
+
+def _llm_get_widget_data(widget_uuids: list[str]) -> FunctionCallResponse:
+    """Retrieve data from widgets, only if their UUIDs are listed in the context.
+
+    # Usage
+    - This function can only be called if valid widget UUIDs are present.
+    - This function can NOT be called if a valid widget UUID is not present.
+    - Request every widget needed to answer the question in a single call.
+    """
+    return FunctionCallResponse(
+        function="get_widget_data",
+        input_arguments=widget_data_arguments(widget_uuids),
+    )
+
+
+def _widget_result_content(result: LlmFunctionCallResult) -> str:
+    if table_compaction is None:
+        return result.content
+    return table_compaction.compact(result.content)
+
+
+def _combine_widget_results(results: list[LlmFunctionCallResult]) -> str:
+    """Combine the results of a batched `get_widget_data` call into one."""
+    if len(results) == 1:
+        return _widget_result_content(results[0])
+    return "\n\n".join(
+        f"# Widget {', '.join(result.widget_uuids)}\n{_widget_result_content(result)}"
+        for result in results
+    )
+
+
+def _function_call_messages(
+    calls: list[LlmFunctionCall], results: list[LlmFunctionCallResult]
+) -> list:
+    """Rebuild (parallel) function calls, and their results, as magentic messages.
+
+    Each result is paired with the call that requested its widget(s), falling
+    back to the order the calls were made in. Every call needs a result, so
+    any the client didn't return are marked as empty.
+    """
+    function_calls = [
+        FunctionCall(_llm_get_widget_data, widget_uuids=call.widget_uuids)
+        for call in calls
+    ]
+    call_results: list[list[LlmFunctionCallResult]] = [[] for _ in calls]
+    for i, result in enumerate(results):
+        index = next(
+            (
+                j
+                for j, call in enumerate(calls)
+                if set(result.widget_uuids) & set(call.widget_uuids)
+            ),
+            min(i, len(calls) - 1),
+        )
+        call_results[index].append(result)
+
+    chat_messages = [
+        AssistantMessage(
+            function_calls[0]
+            if len(function_calls) == 1
+            else ParallelFunctionCall(function_calls)
+        )
+    ]
+    for function_call, results in zip(function_calls, call_results):
+        chat_messages.append(
+            FunctionResultMessage(
+                content=(_combine_widget_results(results) if results else "No data."),
+                function_call=function_call,
+            )
+        )
+    return chat_messages
+
+
+copilot_prompt = ChatPrompt(
+    SYSTEM_PROMPT, output_types=[AsyncParallelFunctionCall, AsyncStreamedStr]
+)
+
+
+def _upstream(
+    prompt: Callable[..., Awaitable], model: str, base_url: str | None, tokens: int
+) -> Callable[[], Awaitable]:
+    """Query `model` with `prompt` (of `tokens` tokens) within its rate limits,
+    retrying errors before the first token.
+    """
+    chat_model = chat_models.get_mistral(
+        model,
+        base_url=base_url,
+        temperature=TEMPERATURE,
+        # The openai client's own retries would compound the retry policy's.
+        max_retries=0 if retry_policy is not None else None,
+    )
+
+    async def _query():
+        if rate_limiter is not None:
+            await rate_limiter.acquire(model, tokens)
+        response = await prompt(model=chat_model)
+        if rate_limiter is not None and isinstance(response, AsyncStreamedStr):
+            response = AsyncStreamedStr(rate_limiter.metered(model, response))
+        return response
+
+    if retry_policy is None:
+        return _query
+    return partial(retry_policy.call, _query)
+
+
+def _function_call_event(function_call: FunctionCall) -> dict:
+    function_call_response: FunctionCallResponse = function_call()
+    return FunctionCallSSE(
+        event="copilotFunctionCall",
+        data=FunctionCallSSEData(
+            function=function_call_response.function,
+            input_arguments=function_call_response.input_arguments,
+            copilot_function_call_arguments=function_call_response.input_arguments,
+        ),
+    ).model_dump()
 
 
 async def create_response_stream(
-    response: AsyncStreamedStr | FunctionCall,
+    response: AsyncStreamedStr | AsyncParallelFunctionCall,
+    received_at: float,
+    http_request: Request | None = None,
 ) -> AsyncGenerator[dict, None]:
     if isinstance(response, AsyncStreamedStr):
-        async for chunk in response:
-            yield {"event": "copilotMessageChunk", "data": json.dumps({"delta": chunk})}
-    elif isinstance(response, FunctionCall):
-        function_call_response: FunctionCallResponse = response()
-        yield FunctionCallSSE(
-            event="copilotFunctionCall",
-            data=FunctionCallSSEData(
-                function=function_call_response.function,
-                input_arguments=function_call_response.input_arguments,
-                copilot_function_call_arguments=function_call_response.input_arguments,
-            ),
-        ).model_dump()
+        chunks = response
+        if http_request is not None:
+            chunks = disconnect_watcher.stream(http_request, chunks)
+        chunks = metrics.track_stream(COPILOT_ID, chunks, received_at)
+        async for chunk in coalesce_chunks(chunks, STREAM_COALESCING):
+            yield {"event": "copilotMessageChunk", "data": dumps({"delta": chunk})}
+    elif isinstance(response, AsyncParallelFunctionCall):
+        metrics.first_token(COPILOT_ID, received_at)
+        # The model may request several calls at once, which are all sent to
+        # the client in the same response.
+        async for function_call in response:
+            yield _function_call_event(function_call)
 
 
 @app.get("/copilots.json")
-def get_copilot_description():
+def get_copilot_description(request: Request):
     """Widgets configuration file for the OpenBB Terminal Pro"""
-    return JSONResponse(
-        content=json.load(open((Path(__file__).parent.resolve() / "copilots.json")))
-    )
+    return copilot_descriptor.response(request)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics, if enabled with `COPILOT_METRICS=true`."""
+    return metrics.response()
 
 
-@app.post("/v1/query")
-async def query(request: AgentQueryRequest) -> EventSourceResponse:
+@app.post("/v1/query", openapi_extra=QUERY_REQUEST_OPENAPI)
+async def query(
+    http_request: Request,
+    request: AgentQueryRequest = Depends(parse_query_request),
+) -> EventSourceResponse:
     """Query the Copilot."""
+    received_at = metrics.request_started(COPILOT_ID, http_request)
+
+    # Prepare context and widgets
+    widgets = request.widgets
+    if widget_selector is not None:
+        with metrics.stage(COPILOT_ID, "widget_selection"):
+            widgets = widget_selector.select(widgets, latest_query(request.messages))
+    with metrics.stage(COPILOT_ID, "context_serialization"):
+        context_str = build_context_str(
+            request.context, CONTEXT_BUDGET, table_compaction
+        )
+        widgets_str = build_widgets_str(widgets, WIDGETS_BUDGET)
+    if request.use_docs and document_store is not None:
+        with metrics.stage(COPILOT_ID, "document_retrieval"):
+            chunks = await asyncio.to_thread(
+                document_store.search, latest_query(request.messages)
+            )
+        if chunks:
+            context_str += f"\n\n## Documents\n{build_documents_str(chunks)}"
+    functions = [_llm_get_widget_data] if request.widgets else None
+
+    with metrics.stage(COPILOT_ID, "history_trimming"):
+        messages = trim_history(request.messages, HISTORY_BUDGET, token_counter)
 
-    # Define LLM functions
-    def _llm_get_widget_data(widget_uuid: str) -> FunctionCallResponse:
-        """Retrieve data from a widget, only if it's UUID is listed in the context.
-
-        # Usage
-        - This function can only be called if a valid widget UUID is present.
-        - This function can NOT be called if a valid widget UUID is not present.
-        """
-        print("Function call")
-        print(widget_uuid)
-        return FunctionCallResponse(
-            function="get_widget_data", input_arguments={"widget_uuid": widget_uuid}
+    # Identify the request, and replay its response from the cache if possible
+    use_cache = response_cache is not None and response_cache.is_cacheable(TEMPERATURE)
+    key = None
+    if use_cache or single_flight is not None:
+        key = request_key(
+            model=MODEL,
+            temperature=TEMPERATURE,
+            system_prompt=copilot_prompt.system_message(
+                widgets=widgets_str, context=context_str
+            ).content,
+            messages=messages,
+            context=context_str,
+            widgets=widgets_str,
+        )
+    if use_cache and (cached_response := response_cache.get(key)) is not None:
+        return EventSourceResponse(
+            content=response_cache.replay(cached_response),
+            media_type="text/event-stream",
         )
 
     # Prepare messages
-    chat_messages = []
-    for message in request.messages:
-        if message.role == RoleEnum.human:
-            if isinstance(message.content, str):
-                chat_messages.append(UserMessage(sanitize_message(message.content)))
-            else:
-                raise HTTPException(
-                    status_code=500, detail="Human messages can only be string."
-                )
-        elif message.role == RoleEnum.ai:
-            if isinstance(message.content, str):
-                chat_messages.append(
-                    AssistantMessage(sanitize_message(message.content))
-                )
-            elif isinstance(message.content, LlmFunctionCall):
-                function_call = FunctionCall(
-                    function=_llm_get_widget_data,
-                    **message.content.input_arguments,
-                )
-                chat_messages.append(AssistantMessage(function_call))
-        elif message.role == RoleEnum.tool:
-            if isinstance(message, LlmFunctionCallResult):
-                chat_messages.append(
-                    FunctionResultMessage(
-                        content=sanitize_message(message.content),
-                        function_call=function_call,  # type: ignore
+    with metrics.stage(COPILOT_ID, "message_conversion"):
+        chat_messages = []
+        # Consecutive function calls were made in parallel, and are rebuilt
+        # together with the results that follow them.
+        function_calls: list[LlmFunctionCall] = []
+        function_results: list[LlmFunctionCallResult] = []
+        for message in messages:
+            if message.role == RoleEnum.tool:
+                if not isinstance(message, LlmFunctionCallResult):
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Tool message must have LlmFunctionCallResult.",
                     )
+                if not function_calls:
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Tool message must follow a function call.",
+                    )
+                function_results.append(message)
+                continue
+            if function_calls and (
+                function_results or not isinstance(message.content, LlmFunctionCall)
+            ):
+                chat_messages.extend(
+                    _function_call_messages(function_calls, function_results)
                 )
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Tool message must have LlmFunctionCallResult.",
-                )
+                function_calls, function_results = [], []
 
-    # Prepare context
-    context_str = ""
-    if request.context:
-        if isinstance(request.context, list):
-            for context_widget in request.context:
-                context_str += str(context_widget.model_dump_json()) + "\n\n"
-        elif isinstance(request.context, str):
-            context_str = request.context
-
-    # Prepare widgets
-    widgets_str = ""
-    if request.widgets:
-        for widget in request.widgets:
-            widgets_str += str(widget.model_dump_json()) + "\n\n"
-        functions = [_llm_get_widget_data]
-    else:
-        functions = None
+            if message.role == RoleEnum.human:
+                if isinstance(message.content, str):
+                    chat_messages.append(user_message(message.content))
+                else:
+                    raise HTTPException(
+                        status_code=500, detail="Human messages can only be string."
+                    )
+            elif message.role == RoleEnum.ai:
+                if isinstance(message.content, str):
+                    chat_messages.append(assistant_message(message.content))
+                elif isinstance(message.content, LlmFunctionCall):
+                    function_calls.append(message.content)
+        if function_calls:
+            chat_messages.extend(
+                _function_call_messages(function_calls, function_results)
+            )
 
-    @chatprompt(
-        SystemMessage(SYSTEM_PROMPT),
-        *chat_messages,
+    # Query LLM
+    prompt = partial(
+        copilot_prompt,
+        chat_messages,
         functions=functions,
-        model=MistralChatModel(
-            model="mistral-large-2407",
-            temperature=0.2,
-        ),
+        widgets=widgets_str,
+        context=context_str,
     )
-    async def copilot(
-        widgets: str, context: str
-    ) -> FunctionCall | AsyncStreamedStr: ...
+    prompt_tokens = 0
+    if rate_limiter is not None:
+        system_prompt = copilot_prompt.system_message(
+            widgets=widgets_str, context=context_str
+        ).content
+        prompt_tokens = token_counter.count(system_prompt) + sum(
+            token_counter.message_tokens(message) for message in messages
+        )
+    query_llm = _upstream(prompt, MODEL, MISTRAL_BASE_URL, prompt_tokens)
+    if hedging is not None:
+        query_llm = partial(
+            hedging.first,
+            query_llm,
+            _upstream(prompt, HEDGE_MODEL, HEDGE_BASE_URL, prompt_tokens),
+        )
+    if single_flight is not None:
+        # Identical concurrent requests share a single upstream stream, which
+        # is cancelled once every client has disconnected.
+        async def _shared_response_stream():
+            with metrics.stage(COPILOT_ID, "upstream_first_token"):
+                response = await query_llm()
+            async for event in create_response_stream(response, received_at):
+                yield event
 
-    # Query LLM
-    response = await copilot(widgets=widgets_str, context=context_str)
+        content = single_flight.stream(key, _shared_response_stream)
+    else:
+        with metrics.stage(COPILOT_ID, "upstream_first_token"):
+            response = await disconnect_watcher.first(http_request, query_llm())
+        content = create_response_stream(response, received_at, http_request)
+    if use_cache:
+        content = response_cache.record(key, content)
 
     return EventSourceResponse(
-        content=create_response_stream(response),
+        content=content,
         media_type="text/event-stream",
     )
 
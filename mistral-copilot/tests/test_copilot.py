@@ -2,10 +2,30 @@ from ast import literal_eval
 import json
 from pathlib import Path
 from fastapi.testclient import TestClient
+import httpx
+from magentic import (
+    AssistantMessage,
+    AsyncParallelFunctionCall,
+    AsyncStreamedStr,
+    FunctionCall,
+    FunctionResultMessage,
+    ParallelFunctionCall,
+)
+from mistral_copilot import main
 from mistral_copilot.main import app
+import openai
 import pytest
+from sse_starlette.sse import AppStatus
 
-from common.testing import capture_stream_response
+from common.cache import ResponseCache
+from common.clients import chat_models
+from common.documents import DocumentStore
+from common.hedging import Hedging
+from common.ratelimit import RateLimiter
+from common.retry import RetryPolicy
+from common.search import WidgetSelector
+from common.tabular import TableCompaction
+from common.testing import FakeChatModel, capture_stream_response, use_chat_model
 
 test_client = TestClient(app)
 
@@ -100,3 +120,374 @@ def test_query_function_call_gives_final_answer():
     assert response.status_code == 200
     assert event_name == "copilotMessageChunk"
     assert "10 degrees" in captured_stream
+
+
+def test_get_copilot_description():
+    response = test_client.get("/copilots.json")
+    assert response.status_code == 200
+    assert "endpoints" in next(iter(response.json().values()))
+
+    response = test_client.get(
+        "/copilots.json", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+
+
+def test_query_response_cache(monkeypatch):
+    monkeypatch.setattr(
+        "mistral_copilot.main.response_cache", ResponseCache(max_temperature=1.0)
+    )
+    chat_model = FakeChatModel(["The answer", " is 2."])
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+
+    responses = []
+    for _ in range(2):
+        AppStatus.should_exit_event = None
+        responses.append(test_client.post("/v1/query", json=test_payload))
+
+    assert chat_model.calls == 1
+    assert responses[0].text == responses[1].text
+    assert capture_stream_response(responses[1].text) == (
+        "copilotMessageChunk",
+        "The answer is 2.",
+    )
+
+
+def test_query_response_cache_enabled_from_env(monkeypatch):
+    monkeypatch.setenv("COPILOT_RESPONSE_CACHE", "true")
+    # Mistral's temperature isn't 0, so caching its requests is opted into.
+    monkeypatch.setenv("COPILOT_RESPONSE_CACHE_MAX_TEMPERATURE", str(main.TEMPERATURE))
+    response_cache = ResponseCache.from_env(temperature=main.TEMPERATURE)
+    monkeypatch.setattr("mistral_copilot.main.response_cache", response_cache)
+    chat_model = FakeChatModel(["The answer", " is 2."])
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+
+    for _ in range(2):
+        AppStatus.should_exit_event = None
+        response = test_client.post("/v1/query", json=test_payload)
+
+    assert capture_stream_response(response.text) == (
+        "copilotMessageChunk",
+        "The answer is 2.",
+    )
+    assert chat_model.calls == 1
+    assert response_cache.stats()["hits"] == 1
+
+
+def test_query_hedges_slow_requests(monkeypatch):
+    hedging = Hedging(delay=0.01)
+    monkeypatch.setattr("mistral_copilot.main.hedging", hedging)
+    monkeypatch.setattr("mistral_copilot.main.HEDGE_MODEL", "hedge-model")
+    primary_model = FakeChatModel(["From the primary."], ttft=1)
+    hedge_model = FakeChatModel(["From the hedge."])
+    monkeypatch.setattr(
+        chat_models,
+        "get_mistral",
+        lambda model, **kwargs: hedge_model
+        if model == "hedge-model"
+        else primary_model,
+    )
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+
+    response = test_client.post("/v1/query", json=test_payload)
+
+    assert capture_stream_response(response.text) == (
+        "copilotMessageChunk",
+        "From the hedge.",
+    )
+    assert hedging.stats() == {
+        "requests": 1,
+        "fired": 1,
+        "primary_wins": 0,
+        "hedge_wins": 1,
+    }
+
+
+class _RateLimitedChatModel(FakeChatModel):
+    """A chat model that's rate limited on its first request."""
+
+    async def acomplete(self, messages, functions=None, output_types=None, stop=None):
+        if not self.calls:
+            self.calls += 1
+            response = httpx.Response(
+                429, request=httpx.Request("POST", "https://api.mistral.ai")
+            )
+            raise openai.RateLimitError("Rate limited", response=response, body=None)
+        return await super().acomplete(messages, functions, output_types, stop)
+
+
+def test_query_retries_rate_limited_requests(monkeypatch):
+    rate_limiter = RateLimiter(requests_per_second=100, tokens_per_minute=600_000)
+    retry_policy = RetryPolicy(base_delay=0.001)
+    monkeypatch.setattr("mistral_copilot.main.rate_limiter", rate_limiter)
+    monkeypatch.setattr("mistral_copilot.main.retry_policy", retry_policy)
+    chat_model = _RateLimitedChatModel(["The answer", " is 2."])
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    test_payload_path = (
+        Path(__file__).parent.parent.parent / "test_payloads" / "single_message.json"
+    )
+    test_payload = json.load(open(test_payload_path))
+
+    response = test_client.post("/v1/query", json=test_payload)
+
+    assert capture_stream_response(response.text) == (
+        "copilotMessageChunk",
+        "The answer is 2.",
+    )
+    assert chat_model.calls == 2
+    assert retry_policy.stats() == {"retries": 1, "exhausted": 0}
+    assert rate_limiter.stats()["requests"] == 2
+
+
+def test_query_retrieves_documents(monkeypatch, tmp_path):
+    pytest.importorskip("numpy")
+    document_store = DocumentStore(tmp_path, top_k=1)
+    document_store.add(
+        {
+            "arithmetic.txt": "One plus one is two, in base ten arithmetic.",
+            "geography.txt": "Paris is the capital of France.",
+        }
+    )
+    monkeypatch.setattr("mistral_copilot.main.document_store", document_store)
+    chat_model = FakeChatModel(["It is 2."])
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    test_payload = {
+        "messages": [{"role": "human", "content": "What is one plus one?"}],
+        "use_docs": True,
+    }
+
+    test_client.post("/v1/query", json=test_payload)
+    system_message = chat_model.messages[0].content
+    assert "### arithmetic.txt\nOne plus one is two" in system_message
+    assert "Paris" not in system_message
+
+    AppStatus.should_exit_event = None
+    test_client.post("/v1/query", json={**test_payload, "use_docs": False})
+    assert "arithmetic.txt" not in chat_model.messages[0].content
+
+
+WIDGET_UUIDS = [
+    "ff6368ec-a397-4baf-9f5a-fecd9fd797a3",
+    "2c9c3b5f-6a7e-4d0b-9f36-3d4f3c1a8b21",
+]
+
+
+class _FakeFunctionCallingModel:
+    """A chat model that requests the widgets, then answers.
+
+    With `parallel=True`, each widget is requested in its own (parallel)
+    function call, otherwise all of them are requested in one.
+    """
+
+    def __init__(self, parallel: bool = False):
+        self.parallel = parallel
+        self.messages = None
+
+    async def acomplete(self, messages, functions=None, output_types=None, stop=None):
+        self.messages = messages
+        if functions and not isinstance(messages[-1], FunctionResultMessage):
+            widget_uuids = (
+                [[uuid] for uuid in WIDGET_UUIDS] if self.parallel else [WIDGET_UUIDS]
+            )
+
+            async def _function_calls():
+                for uuids in widget_uuids:
+                    yield FunctionCall(functions[0], uuids)
+
+            return AssistantMessage(AsyncParallelFunctionCall(_function_calls()))
+
+        async def _stream():
+            yield "Done."
+
+        return AssistantMessage(AsyncStreamedStr(_stream()))
+
+
+def _widgets_payload(messages: list[dict]) -> dict:
+    return {
+        "messages": messages,
+        "widgets": [
+            {"uuid": uuid, "name": f"widget_{i}", "description": f"Widget {i}"}
+            for i, uuid in enumerate(WIDGET_UUIDS)
+        ],
+    }
+
+
+def test_query_batched_function_call(monkeypatch):
+    chat_model = _FakeFunctionCallingModel()
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+
+    response = test_client.post(
+        "/v1/query",
+        json=_widgets_payload([{"role": "human", "content": "Compare the widgets."}]),
+    )
+    event_name, captured_stream = capture_stream_response(response.text)
+
+    function_call = literal_eval(captured_stream)
+    assert event_name == "copilotFunctionCall"
+    assert function_call["function"] == "get_widget_data"
+    assert function_call["input_arguments"] == {"widget_uuids": WIDGET_UUIDS}
+
+
+def test_query_batched_function_call_results(monkeypatch):
+    chat_model = _FakeFunctionCallingModel()
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    function_call = {
+        "function": "get_widget_data",
+        "input_arguments": {"widget_uuids": WIDGET_UUIDS},
+    }
+
+    response = test_client.post(
+        "/v1/query",
+        json=_widgets_payload(
+            [
+                {"role": "human", "content": "Compare the widgets."},
+                {"role": "ai", "content": json.dumps(function_call)},
+                *(
+                    {
+                        "role": "tool",
+                        "function": "get_widget_data",
+                        "input_arguments": {"widget_uuid": uuid},
+                        "content": f"Data for widget {i}",
+                    }
+                    for i, uuid in enumerate(WIDGET_UUIDS)
+                ),
+            ]
+        ),
+    )
+
+    assert capture_stream_response(response.text) == ("copilotMessageChunk", "Done.")
+    *_, call_message, result_message = chat_model.messages
+    assert call_message.content.arguments == {"widget_uuids": WIDGET_UUIDS}
+    assert result_message.function_call is call_message.content
+    assert "Data for widget 0" in result_message.content
+    assert "Data for widget 1" in result_message.content
+    assert WIDGET_UUIDS[1] in result_message.content
+
+
+def test_query_parallel_function_calls(monkeypatch):
+    chat_model = _FakeFunctionCallingModel(parallel=True)
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+
+    response = test_client.post(
+        "/v1/query",
+        json=_widgets_payload([{"role": "human", "content": "Compare the widgets."}]),
+    )
+
+    function_calls = [
+        json.loads(line.removeprefix("data:").strip())
+        for line in response.text.splitlines()
+        if line.startswith("data:")
+    ]
+    assert response.text.count("event: copilotFunctionCall") == 2
+    assert [call["input_arguments"] for call in function_calls] == [
+        {"widget_uuid": uuid} for uuid in WIDGET_UUIDS
+    ]
+
+
+def test_query_parallel_function_call_results(monkeypatch):
+    chat_model = _FakeFunctionCallingModel(parallel=True)
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+
+    response = test_client.post(
+        "/v1/query",
+        json=_widgets_payload(
+            [
+                {"role": "human", "content": "Compare the widgets."},
+                *(
+                    {
+                        "role": "ai",
+                        "content": json.dumps(
+                            {
+                                "function": "get_widget_data",
+                                "input_arguments": {"widget_uuid": uuid},
+                            }
+                        ),
+                    }
+                    for uuid in WIDGET_UUIDS
+                ),
+                # The results may come back in a different order to the calls.
+                *(
+                    {
+                        "role": "tool",
+                        "function": "get_widget_data",
+                        "input_arguments": {"widget_uuid": uuid},
+                        "content": f"Data for {uuid}",
+                    }
+                    for uuid in reversed(WIDGET_UUIDS)
+                ),
+            ]
+        ),
+    )
+
+    assert capture_stream_response(response.text) == ("copilotMessageChunk", "Done.")
+    *_, call_message, first_result, second_result = chat_model.messages
+    assert isinstance(call_message.content, ParallelFunctionCall)
+    first_call, second_call = call_message.content
+    assert first_call.arguments == {"widget_uuids": WIDGET_UUIDS[:1]}
+    assert second_call.arguments == {"widget_uuids": WIDGET_UUIDS[1:]}
+    assert first_result.function_call is first_call
+    assert first_result.content == f"Data for {WIDGET_UUIDS[0]}"
+    assert second_result.function_call is second_call
+    assert second_result.content == f"Data for {WIDGET_UUIDS[1]}"
+
+
+def test_query_selects_relevant_widgets(monkeypatch):
+    monkeypatch.setattr("mistral_copilot.main.widget_selector", WidgetSelector(top_k=1))
+    chat_model = _FakeFunctionCallingModel()
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    payload = _widgets_payload([{"role": "human", "content": "What is in widget_1?"}])
+
+    test_client.post("/v1/query", json=payload)
+
+    system_message = chat_model.messages[0].content
+    assert WIDGET_UUIDS[1] in system_message
+    assert WIDGET_UUIDS[0] not in system_message
+
+
+def test_query_compacts_tabular_function_call_results(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(
+        "mistral_copilot.main.table_compaction", TableCompaction(max_chars=1_000)
+    )
+    chat_model = _FakeFunctionCallingModel()
+    use_chat_model(monkeypatch, "get_mistral", chat_model)
+    prices = [{"close": float(i)} for i in range(1_000)]
+
+    test_client.post(
+        "/v1/query",
+        json=_widgets_payload(
+            [
+                {"role": "human", "content": "What was the highest price?"},
+                {
+                    "role": "ai",
+                    "content": json.dumps(
+                        {
+                            "function": "get_widget_data",
+                            "input_arguments": {"widget_uuid": WIDGET_UUIDS[0]},
+                        }
+                    ),
+                },
+                {
+                    "role": "tool",
+                    "function": "get_widget_data",
+                    "input_arguments": {"widget_uuid": WIDGET_UUIDS[0]},
+                    "content": json.dumps(prices),
+                },
+            ]
+        ),
+    )
+
+    summary = json.loads(chat_model.messages[-1].content)
+    assert summary["row_count"] == 1_000
+    assert summary["columns"]["close"]["max"] == 999.0